@@ -18,10 +18,20 @@
 
 echo ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 echo installing applications in /usr/local/bin...
-#cp -v jtlog.py jtlogc.py ti2c.py /usr/local/bin
+#cp -v jtlog.py jtlogc.py ti2c.py ti2ccal.py ti2csim.py ti2clog.py ti2cdb.py ti2ccodec.py ti2crollup.py ti2cclock.py ti2cmetrics.py jtindex.py jtquery.py /usr/local/bin
 install --verbose --backup --target-directory=/usr/local/bin jtlog.py 
 install --verbose --backup --target-directory=/usr/local/bin jtlogc.py 
 install --verbose --backup --target-directory=/usr/local/bin ti2c.py 
+install --verbose --backup --target-directory=/usr/local/bin ti2ccal.py 
+install --verbose --backup --target-directory=/usr/local/bin ti2csim.py 
+install --verbose --backup --target-directory=/usr/local/bin ti2clog.py 
+install --verbose --backup --target-directory=/usr/local/bin ti2cdb.py 
+install --verbose --backup --target-directory=/usr/local/bin ti2ccodec.py 
+install --verbose --backup --target-directory=/usr/local/bin ti2crollup.py 
+install --verbose --backup --target-directory=/usr/local/bin ti2cclock.py 
+install --verbose --backup --target-directory=/usr/local/bin ti2cmetrics.py 
+install --verbose --backup --target-directory=/usr/local/bin jtindex.py 
+install --verbose --backup --target-directory=/usr/local/bin jtquery.py 
 
 # skip symbolic link creation if they exist; they're unlikely to change.
 echo creating symbolic links if required...
@@ -31,6 +41,12 @@ fi
 if ! [[ -L /usr/local/bin/jtlogc ]] ; then
 	ln -s /usr/local/bin/jtlogc.py /usr/local/bin/jtlogc
 fi
+if ! [[ -L /usr/local/bin/jtindex ]] ; then
+	ln -s /usr/local/bin/jtindex.py /usr/local/bin/jtindex
+fi
+if ! [[ -L /usr/local/bin/jtquery ]] ; then
+	ln -s /usr/local/bin/jtquery.py /usr/local/bin/jtquery
+fi
 
 echo installing man pages...
 if ! [[ -e /usr/local/man/man1 ]] ; then
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# jtindex.py - index existing csv logs written by jtlog & jtlogc, for sensors
+#              supplied by J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+# licensing & permissions {{{
+# jtindex.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# }}}
+# grandiose description {{{
+# jtlog & jtlogc write an index, '<log file>.idx', alongside each csv log as they go,
+# but logs from before they did, or logged with the index turned off, have none. This
+# writes one, just as the logger would have, for each log named on the command line;
+# compressed segments (.gz, .xz) are read as they are. See ti2clog.py for the format,
+# and for csvrows(), which uses it.
+# }}}
+# modules {{{
+import sys,getopt
+
+import ti2clog
+# }}}
+# functions {{{1
+# showhelp {{{2
+def showhelp():
+    print(sys.argv[0],' -h [-n <rows>] <log file> [<log file> ...]\n')
+    print('-h,--help\n\tdisplay this message.\n')
+    print('-n<rows>,--every=<rows>\n\tIndex every <rows>th row. Default {}.\n'.format(ti2clog.indexevery))
+# }}}
+# main {{{1
+def main(argv):
+    try:
+        opts,args = getopt.getopt(argv,'hn:',['help','every='])
+    except getopt.GetoptError:
+        print('Unspecified error. Perhaps command line arguments are not correct?\n\tTry: {} -h or {} --help.\nAborting...\n'.format(sys.argv[0],sys.argv[0]))
+        sys.exit(2)
+    every = ti2clog.indexevery
+    for opt,arg in opts:
+        if opt in ('-h','--help'):
+            showhelp()
+            sys.exit(0)
+        elif opt in ('-n','--every'):
+            every = int(arg)
+            if every < 1:
+                print('-n: <rows> must be 1 or more.')
+                sys.exit(2)
+    if not args:
+        showhelp()
+        sys.exit(2)
+    for logname in args:
+        try:
+            rows = ti2clog.buildindex(logname,every)
+        except (OSError,EOFError,ValueError) as error:
+            print('{}: {}'.format(logname,error))
+            continue
+        print('{}: {} rows, indexed in {}'.format(logname,rows,ti2clog.indexname(logname)))
+# }}}
+if(__name__ == '__main__'):
+    main(sys.argv[1:])
@@ -47,18 +47,25 @@
 # The default values can produce reasonably accurate results, but calibrated
 # values will reduce the errors to a minimum. 
 #
-# Note also that the main loop sleeps for the amount of time until a fresh sample
-# is expected, but does not account for how long it takes to process it; therefore, 
-# it's running slightly slower than it would appear. Possible solutions include
-# either adjusting the sleep time, or converting to an exception-based system in
-# which an expiring timer triggers a device read.
+# Note also that the main loop sleeps until a fresh sample is expected: until a deadline
+# on the monotonic clock, one sample period after the last, not for a period at a time, so
+# the time it takes to process a row doesn't add up (see ti2cclock.sleepuntil()). A row
+# that's late by more than a period doesn't make the ones after it early; the deadlines
+# start again from it. Every row is time stamped when it's read, on both clocks, in ns:
+# time,monotonic, then the sensors' cells (see ti2cclock.stamp()).
 # }}}
 
 # modules {{{
 import sys,os,getopt
+import glob
 import termios
 import time
+import json
 from ti2c import tempsensor
+from ti2c import defaultbus
+import ti2ccal
+import ti2clog
+import ti2cclock
 # }}}
 
 # globals {{{
@@ -67,13 +74,16 @@ maxduration = 31557600 # one year; no real reason for this; seems like enough.
 duration = 0        # 0 means sample until you run out of storage space. 
 discard = 0         # adjust to suit; # of samples to be discarded before logging.
 
+# calibration profiles are shared with jtlogc, in its config file:
+calfile = '~/.jtlogc/config.json'
+
 # log file particulars:
 logsubdir = 'jtlogs'
 logfile = 'jtlog'
 logfile_ext = '.csv'
 
 # Specific variables to the ADC and amplifier stages on the sensor board:
-maxsensors = 8      # I2C addresses are available from Microchip.
+maxsensors = 8      # per bus; I2C addresses are available from Microchip.
 cfgmodes = 4        # config modes of adc
 # }}}
 
@@ -81,8 +91,11 @@ cfgmodes = 4        # config modes of adc
 # showhelp {{{2
 # Explain how to use this program, then dump the user back to the command line:
 def showhelp():
-    print(sys.argv[0],' -h -s <mode-sensor#1> [-s <mode-sensor#2> ... -s <mode-sensor#{}>] [-r] [-c] [-d <duration>] [-f filename]\n'.format(maxsensors))
+    print(sys.argv[0],' -h [-b <bus>] -s <mode-sensor#1> [-s <mode-sensor#2> ... -s <mode-sensor#{}>] [-b <bus> -s ...] [-r] [-c] [-k] [-d <duration>] [-f filename] [-F <policy>] [-R <policy>] [-z <method>] [-I <rows>]\n'.format(maxsensors))
     print('-h,--help\n\tdisplay this message.\n')
+    print('-b<bus>,--bus=<bus>\n\tI2C bus # (/dev/i2c-<bus>) for the -s options that follow; default {}.'.format(defaultbus))
+    print('\tEach bus has its own {} addresses, so use one -b per bus to log more than'.format(maxsensors))
+    print('\t{} sensors; each bus\'s sensors are numbered from the first address again.\n'.format(maxsensors))
     print('-s<mode>,--sensor-mode=<mode>\n\twhere <mode> is 0-4; up to 8 -s<mode> pairs can be supplied;')
     print('\n\t<mode> is one of:\n\t\t0 - no sensor')
     for i in range(cfgmodes):
@@ -96,12 +109,30 @@ def showhelp():
             '\tlast sensor parameter.\n',sep='')
     print('-r,--raw\n\tInclude only raw ADC data in hex format in output to stdout & file.\n')
     print('-c,--cook\n\tInclude only cooked data in °C in output to stdout or file.\n')
+    print('-k,--calibrate\n\tConvert samples using the calibration profiles configured in jtlogc')
+    print('\t({}), for sensors at the same bus & address that have one.\n'.format(calfile))
     print('-d<duration>,--duration=<duration>\n\tduration of data collection in seconds; 0 means collect for one year.\n')
     print('-f<filename>,--logfile=<filename>\n\tPrefix of file name to which collected data will be written; csv')
     print('\tformat. All file output will be written to ~/jtlogs. If no filename\n',
           '\tis specified, the default log file name is \'jtlog_nnnn.csv\', where\n',
           '\tnnnn is a unique number depending on what files already exist. If\n',
           '\tfilename is specified, \'_nnnn.csv\' will be appended.\n')
+    print('-F<policy>,--flush=<policy>\n\tWhen the log file is synced to storage; <policy> is one of:')
+    print('\t\trows:<n>     - every n rows.')
+    print('\t\tseconds:<t>  - every t seconds.')
+    print('\t\tshutdown     - only when logging ends; the fewest writes, but anything')
+    print('\t\t               not yet written is lost if the power fails.')
+    print('\tDefault {}.\n'.format(ti2clog.defaultflushpolicy))
+    print('-R<policy>,--rotate=<policy>\n\tCut the log into segments, each with its own header; <policy> is one of:')
+    print('\t\tnone         - one log file.')
+    print('\t\tsize:<MB>    - a new segment once one reaches <MB> megabytes.')
+    print('\t\thours:<h>    - a new segment every <h> hours, on the clock.')
+    print('\tSegments are numbered: \'_nnnn-sss.csv\'. Default {}.\n'.format(ti2clog.defaultrotation))
+    print('-z<method>,--compress=<method>\n\tCompress each segment once it\'s closed, in the background; <method> is')
+    print('\tgzip (.gz), lzma (.xz) or none. Default none.\n')
+    print('-I<rows>,--index=<rows>\n\tWrite an index, \'<log file>.idx\', alongside each log file, with the time &')
+    print('\tposition of every <rows>th row, so a time can be found without reading the')
+    print('\tlog from the top; see ti2clog.py. 0 means no index. Default {}.\n'.format(ti2clog.indexevery))
 #  }}}
 # gen_log_name {{{2
 # Create a unique log file name:
@@ -111,43 +142,79 @@ def gen_log_name(filename):
     if not os.path.exists(logdir):
         os.mkdir(logdir)
     logfile = filename
-    log = True
+    log = None
     j = 0
-    # iterate until we have a unique log file name.
-    while os.path.exists(log):
+    # iterate until we have a unique log file name; segments & compressed logs count too.
+    while log is None or os.path.exists(log) or glob.glob(log[:-len(logfile_ext)] + '[.-]*'):
         j += 1
         log = str(logdir + '/' + logfile + '_' + str('%04d' % j) + logfile_ext)
     return log
 # }}}
+# segment_name {{{2
+# The name of a log segment; segments are numbered from 1, only if the log is rotated:
+def segment_name(log,segment,rotation):
+    if ti2clog.parserotation(rotation)[0] == 'none':
+        return log
+    return '{}-{:03}{}'.format(log[:-len(logfile_ext)],segment,logfile_ext)
+# }}}
+# open_segment {{{2
+# Open a log segment, & its index (None if indexevery is 0), & write its header:
+def open_segment(log,segment,header,flushpolicy,rotation,indexevery):
+    # rows are written in batches, and synced according to the flush policy; see ti2clog.py.
+    datalog = ti2clog.logbuffer(segment_name(log,segment,rotation),flushpolicy,rotation)
+    index = ti2clog.indexwriter(datalog.filename,indexevery,0.0,flushpolicy) if indexevery else None
+    datalog.write('Filename: ' + datalog.filename + '\n')
+    datalog.write('Date: ' + time.asctime() + '\n')
+    datalog.write(header)
+    datalog.endrow()
+    datalog.checkpoint('jtlog')         # so it can be finished off if it's never closed; see ti2clog.recover().
+    return datalog,index
+# }}}
 # get_cfg {{{2
 def get_cfg(argv):
     '''Get configuration info from command line:'''
     try:
-        opts,args=getopt.getopt(argv,'hrcs:d:f:',['help','raw','cook','sensor-mode=','duration=','logfile='])
+        opts,args=getopt.getopt(argv,'hrcks:d:f:b:F:R:z:I:',['help','raw','cook','calibrate','sensor-mode=','duration=','logfile=','bus=','flush=','rotate=','compress=','index='])
     except getopt.GetoptError:
         print('Unspecified error. Perhaps command line arguments are not correct?\n\tTry: {} -h or {} --help.\nAborting...\n'.format(sys.argv[0],sys.argv[0]))
         sys.exit(2)
     
     raw = True      # default is to supply raw data to the log file.
     cooked = True   # default is to supply cooked data to the log file.
+    calibrate = False
     sensor = []
-    s = 0           # sensor index counter.
+    s = 0           # sensor index counter; from 0 on each bus.
+    bus = defaultbus
+    buses = []      # buses named with -b, or already given sensors.
     duration = 0
+    flushpolicy = ti2clog.defaultflushpolicy
+    rotation = ti2clog.defaultrotation
+    compression = 'none'
+    indexevery = ti2clog.indexevery
     log = gen_log_name(logfile)
     for opt, arg in opts:
         if opt in ('-h','--help'):
             showhelp()
             exit(0)
+        elif opt in ('-b','--bus'):
+            if s > 0 and bus not in buses:
+                buses.append(bus)
+            if int(arg) in buses:
+                print('>>> Error: bus {} specified twice. <<<'.format(arg))
+                exit(1)
+            bus = int(arg)
+            buses.append(bus)
+            s = 0
         elif opt in ('-s','--sensor-mode'):
-            if len(sensor) > maxsensors:
-                print('>>> Error: maximum # of sensors is {}. Too many! <<<'.format(maxsensors))
+            if s >= maxsensors:
+                print('>>> Error: maximum # of sensors on a bus is {}. Too many! <<<'.format(maxsensors))
                 exit(1)
             if int(arg) in range(1,cfgmodes+1):
-                sensor.append(tempsensor(s,int(arg)-1,0))   # the last field is units (0=C, 1=K, 2=F) affects get_tempcooked()
                 try:
+                    sensor.append(tempsensor(s,int(arg)-1,0,bus))   # units (0=C, 1=K, 2=F) affects get_tempcooked()
                     sensor[len(sensor)-1].write_config()    # write to the ti2c module; will fail if no sensor.
                 except:
-                    print('>>> Error: sensor #{} not found. <<<'.format(len(sensor-1)))
+                    print('>>> Error: sensor #{} (bus {}, address {:#04x}) not found. <<<'.format(len(sensor),bus,tempsensor.i2caddress[s]))
                     exit(3)
             elif int(arg) not in range(cfgmodes+1):
                 print('>>> Error: invalid mode {}; range is 0-{}. <<<'.format(arg,cfgmodes))
@@ -163,6 +230,31 @@ def get_cfg(argv):
             cooked = False
         elif opt in ('-c','--cook'):
             raw = False
+        elif opt in ('-k','--calibrate'):
+            calibrate = True
+        elif opt in ('-F','--flush'):
+            try:
+                ti2clog.parseflushpolicy(arg)
+            except ValueError as error:
+                print('>>> Error: {} <<<'.format(error))
+                exit(1)
+            flushpolicy = arg
+        elif opt in ('-R','--rotate'):
+            try:
+                ti2clog.parserotation(arg)
+            except ValueError as error:
+                print('>>> Error: {} <<<'.format(error))
+                exit(1)
+            rotation = arg
+        elif opt in ('-z','--compress'):
+            if arg not in ti2clog.compressions:
+                print('>>> Error: compression must be one of {}. <<<'.format(', '.join(ti2clog.compressions)))
+                exit(1)
+            compression = arg
+        elif opt in ('-I','--index'):
+            indexevery = int(arg)
+            if indexevery < 0:
+                indexevery = 0
    
     # user specified both raw and cooked data explicitly:
     if raw == False and cooked == False:
@@ -176,6 +268,21 @@ def get_cfg(argv):
     elif len(sensor) == 0:
         print('No sensors specified.\n\n\tTry: {} -h or {} --help.\n\nAborting...\n'.format(sys.argv[0],sys.argv[0]))
         exit(1)
+
+    # apply calibration profiles; they're compiled here, for each sensor's mode, before sampling starts.
+    if calibrate:
+        try:
+            profiles = ti2ccal.loadprofiles(calfile)
+        except (OSError,ValueError,KeyError) as error:
+            print('>>> Error: cannot read calibration profiles from {}: {} <<<'.format(calfile,error))
+            exit(1)
+        for s in sensor:
+            if (s.get_bus(),s.get_address()) in profiles:
+                try:
+                    s.set_calibration(profiles[(s.get_bus(),s.get_address())])
+                except (ValueError,KeyError,TypeError,IndexError) as error:
+                    print('>>> Error: invalid calibration profile for {}: {} <<<'.format(s.get_location(),error))
+                    exit(1)
         
     
     # duration is converted to a sample count; so make it the # of samples at the highest data rate
@@ -185,7 +292,7 @@ def get_cfg(argv):
     if duration == 0:
         duration = maxduration
     samples = duration * max(sorted(modes))
-    return sensor,duration,samples,log,raw,cooked
+    return sensor,duration,samples,log,raw,cooked,flushpolicy,rotation,compression,indexevery
 # }}}
 # make_term_raw {{{2
 # Reconfigure the terminal to allow reception of characters:
@@ -207,23 +314,23 @@ def main(argv):
     print('J-Tech Engineering, Ltd. - Sigma Delta ADC Analyser & Logger\n')
 
     # determine what sensors are present, and what mode each will use:
-    sensor,duration,samples,log,raw,cooked = get_cfg(argv)
+    sensor,duration,samples,log,raw,cooked,flushpolicy,rotation,compression,indexevery = get_cfg(argv)
     numsensors = len(sensor)
     # }}}
-    # open a file for writing sample data {{{2
-    datalog = open(log,"w")
-    datalog.write('Filename: ' + log + '\n')
-    datalog.write('Date: ' + time.asctime() + '\n')
-    # }}}
     # confirm setup to both screen & log file: {{{2
+    # the log header is kept, since every segment of the log starts with it.
+    header = ''
     print('set up:')
     print('sample duration is {} seconds.'.format(duration))
-    print('log file name = {}.'.format(log))
+    print('log file name = {}.'.format(segment_name(log,1,rotation)))
     for i in range(numsensors):
-        sensor_config = str('Sensor #%d: ' % (i+1)) + str('addr=%#04x; ' % sensor[i].get_address()) + \
+        sensor_config = str('Sensor #%d: ' % (i+1)) + str('addr=%s; ' % sensor[i].get_location()) + \
                         str('sample freq.=%3.2f Hz; ' % sensor[i].get_samplerate()) + str('resolution=%d bits; ' % sensor[i].get_resolution()) + \
-                        str('slope=%e; ' % sensor[i].get_slope()) + str('intercept=%f.\n' %sensor[i].get_intercept())
-        datalog.write(sensor_config)
+                        str('slope=%e; ' % sensor[i].get_slope()) + str('intercept=%f' %sensor[i].get_intercept())
+        if sensor[i].get_calibration():
+            sensor_config += '; calibration=' + json.dumps(sensor[i].get_calibration())
+        sensor_config += '.\n'
+        header += sensor_config
         print(sensor_config,sep='',end='')
     print('\npress q to quit.\n')
     # }}}
@@ -246,17 +353,26 @@ def main(argv):
         sdowncount.append(1)            # force each to read initially.
     # }}}
     # print an address line as column headings: {{{2
+    # the log's rows start with their time stamps.
+    header += 'time (ns),monotonic (ns),'
     for i in range(numsensors):
-        print('sensor #%d' %(i+1),' - i2c adr: %#04x' % sensor[i].get_address(),'      ',sep='',end='')
-        datalog.write(hex(sensor[i].get_address()))
+        print('sensor #%d' %(i+1),' - i2c adr: %s' % sensor[i].get_location(),'      ',sep='',end='')
+        header += sensor[i].get_location()
         if i < numsensors-1:
             print(' | ',sep='',end='')
-            datalog.write(str(','))
+            header += ','
             if raw == True and cooked == True:
-                datalog.write(str(','))
+                header += ','
         else:
             print('\n',end='')
-            datalog.write(str('\n'))
+            header += '\n'
+    # }}}
+    # open the log, & the compressor for its segments {{{2
+    # first, finish off any logs a crash or power failure left open.
+    ti2clog.recoverall(os.path.dirname(log) + '/*',print)
+    segment = 1
+    datalog,index = open_segment(log,segment,header,flushpolicy,rotation,indexevery)
+    compressor = ti2clog.compressor(compression,print)
     # }}}
     # take the keyboard out of canonical mode, & define an exit command {{{2
     fd = sys.stdin.fileno()
@@ -269,9 +385,19 @@ def main(argv):
         # Discard the first few samples to allow settling; log the rest.
         totalsamples = samples + discard
         scount = 0                  # Counter for logging samples
+        period = int(1e9 / sfreq)   # ns between reads.
+        deadline = time.monotonic_ns()
         # main execution loop {{{3 
         while scount < totalsamples:
-            time.sleep(1/sfreq)             # sleep between reads.
+            deadline += period
+            if time.monotonic_ns() - deadline > period:     # more than a period late; start again from now.
+                deadline = time.monotonic_ns()
+            ti2cclock.sleepuntil(deadline)  # sleep between reads.
+            stamp = ti2cclock.stamp()
+            if scount >= discard:
+                if index:
+                    index.row(stamp[1] / 1e9,datalog.tell())   # the row about to be written.
+                datalog.write('{},{},'.format(stamp[1],stamp[0]))
     
             for i in range(numsensors):
                 # determine if a sensor needs to be read:
@@ -301,6 +427,7 @@ def main(argv):
                         if scount >= discard:
                             print('\n',end='')
                             datalog.write(str('\n'))
+                            datalog.endrow()
                         else:
                             print(' *')
                 else:
@@ -315,9 +442,18 @@ def main(argv):
                         if scount >= discard:
                             print('\n',end='')
                             datalog.write(str('\n'))
+                            datalog.endrow()
                         else:
                             print(' *')
     
+            datalog.poll()
+            if datalog.full():          # time for the next segment.
+                datalog.close()
+                if index:
+                    index.close()
+                compressor.add(datalog.filename)
+                segment += 1
+                datalog,index = open_segment(log,segment,header,flushpolicy,rotation,indexevery)
             if sys.stdin.read() in exit_cmd:
                 raise KeyboardInterrupt
 
@@ -328,6 +464,11 @@ def main(argv):
         raise KeyboardInterrupt
     except (KeyboardInterrupt,OSError) as error:
         termios.tcsetattr(fd,termios.TCSADRAIN,orig_attr)   # restore canonical mode.
+        datalog.close()
+        if index:
+            index.close()
+        compressor.add(datalog.filename)
+        compressor.close()              # compression finishes before the program exits.
         if error == OSError:
             if error.errno == os.errno.EREMOTEIO:
                 print('\nRemote I/O Error: it\'s likely an I2C device, probably one or more',
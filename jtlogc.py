@@ -45,11 +45,12 @@
 # The default values can produce reasonably accurate results, but calibrated
 # values will reduce errors to a minimum. 
 #
-# Note also that the main loop sleeps for the amount of time until a fresh sample
-# is expected, but does not account for how long it takes to process it; therefore, 
-# it's running slightly slower than it would appear. Possible solutions include
-# either adjusting the sleep time, or converting to an exception-based system in
-# which an expiring timer triggers a device read.
+# Note also that triggers are sent on a schedule: each is due at a fixed deadline on
+# the monotonic clock, one sample period after the last, and the trigger sleeps until
+# it rather than for a period at a time, so the time it takes to read & process the
+# samples doesn't add up (see ti2cclock.sleepuntil()). A trigger that misses its slot
+# either skips it or catches up, as the overrun policy says (see ti2cclock.schedule).
+# Every row is time stamped when it's read, on both clocks, in ns (see ti2cclock.stamp()).
 #
 # This is an adaptation of the cli tool, jtlog.py, to use curses for a more 
 # menu-driven approach. It has similar features, but is equipped with a more 
@@ -68,20 +69,33 @@
 #  Each sensor is broken into a front-end and a back-end; the front end displays
 #  data on the screen, while the back-end issues commands to the sensors, and
 #  retrieves data from them. There are two additional threads: one for writing
-#  log data to file, and one for triggering system-wide sample conversions.
+#  log data to file, and one per I2C bus for triggering bus-wide sample
+#  conversions; all buses are triggered on the same schedule.
 #  each back-end thread puts data in one queue for the front-end, and one queue
-#  for storage to file. The back-end thread also has a message queue, which is 
-#  used primarily for ending the thread on exit.
-#  The front-end threads each receive sample data from a back-end queue, and
-#  also receive supervisory requests from a message queue. The logging thread
-#  receives information from all back-end sensors, one queue per sensor, and
-#  receives supervisory commands from a separate message queue. The primary 
-#  purpose of the message queue, as stated above is to instruct the thread to 
-#  stop writing sample data to file, update the time of file closure, close 
-#  the file, and end. The global triggering thread monitors only a messaging
-#  queue for run, halt, and quit functions. Other than this, it simply issues
-#  a global trigger command to all connected sensors, so they trigger
-#  simultaneously, and sleep in between conversions.
+#  for storage to file. Every thread also has a control, through which it's
+#  sent run, halt and quit (see class control). A thread waits on its control,
+#  or on a queue its control puts the commands on too, rather than sleeping,
+#  so a command takes effect at once, whatever the sample period.
+#  The front-end threads each receive sample data from a back-end queue. The
+#  logging thread receives information from all back-end sensors, one queue
+#  per sensor; on quit, it writes whatever's still to come, updates the time
+#  of file closure, closes the file, and ends. The global triggering thread
+#  issues a global trigger command to all connected sensors on a schedule, so
+#  they trigger simultaneously, and waits on its control in between
+#  conversions.
+#  In continuous acquisition mode (see the logging menu), there's no trigger
+#  thread: each sensor converts at its own rate (up to 240 Hz at 12 bits),
+#  each back-end polls its own device, and samples travel to the logger and
+#  display in blocks, a quarter second at a time, instead of one by one.
+#  With the runtime set to asyncio (in config.json), the triggers, back-ends &
+#  displays are coroutines on one event loop instead, and there are no threads
+#  per sensor at all; see asyncruntime.
+#  However many threads use the I2C bus, none of them own it: every access
+#  goes through the bus scheduler in ti2c.py, which runs transactions one at a
+#  time, triggers first, and combines reads that are waiting together.
+#  How it's all doing (samples per second, queue depths, bus latencies &
+#  errors, trigger timing) is exported as metrics while it runs, on a Unix
+#  socket and/or to a file; see genmetrics() & ti2cmetrics.py.
 #
 # Threads & Curses: Any curses object can be called from any thread, with one
 #  exception: curses.doupdate() (and more generally, window.refresh()) must 
@@ -96,12 +110,107 @@ import curses           # display
 import curses.textpad   # user input
 import json             # config file
 import threading,queue  # sample sensors using threads.
+import asyncio          # ...or coroutines; see asyncruntime.
+import concurrent.futures
+import enum             # the commands threads are sent.
+import array            # preallocated sample buffers.
+import heapq            # merging continuous samples for binary logs.
 import webbrowser       # allow opening company website in preferred browser.
 
 from ti2c import tempsensorglobal
 from ti2c import tempsensor     # sensors
+from ti2c import getbus         # the bus scheduler, for its statistics.
+from ti2c import defaultbus
+from ti2c import location       # bus & address, for display.
+from ti2c import muxchannels
+from ti2c import prionames,latencybuckets   # the bus schedulers' statistics, for the metrics.
+import ti2ccal                  # calibration profiles
+import ti2clog                  # binary log files
+import ti2cdb                   # sample databases
+import ti2ccodec                # compact logs
+import ti2crollup               # summaries of samples, by the second, minute & hour
+import ti2cclock                # trigger schedules & timing
+import ti2cmetrics              # health metrics, exported while sampling
+
+endmarker = object()    # the last entry a data source puts on a queue when it stops: there's nothing after it.
+setupattempts = 3       # tries at each bus write while setting up, before a sensor's given up on; one NACK isn't a missing sensor.
+
+def retry(call,attempts=setupattempts):
+    """call(); again, if it raises OSError, up to attempts times in all. The last OSError is raised."""
+    for attempt in range(attempts):
+        try:
+            return call()
+        except OSError:
+            if attempt == attempts - 1:
+                raise
+
+class command(enum.Enum):
+    # what a control sends a thread; see control.
+    run = 'r'
+    halt = 'h'
+    quit = 'q'              # final: the thread finishes up & ends.
+
+class control(object):
+    # a thread's control plane: the latest command sent to it, and a condition variable to wait on for the
+    # next one, instead of a message queue polled between sleeps. A thread with nothing to do waits on its
+    # control indefinitely, and one with a schedule waits on it until its next deadline, so a command takes
+    # effect at once, and an idle thread doesn't wake at all. Commands aren't queued: only the latest matters.
+    # A thread that spends its time blocked on a data queue can have its commands put on that queue as well,
+    # in among the data (see attach()); it then calls take() for the state when it finds one.
+    def __init__(self,state=command.halt):
+        self.condition = threading.Condition()
+        self.state = state
+        self.seen = True        # whether the thread has taken the latest command.
+        self.queues = []
+        self.callbacks = []
+
+    def attach(self,q):
+        """put every command on overflowqueue q too, for a thread that waits on q rather than on the control."""
+        self.queues.append(q)
+
+    def notify(self,callback):
+        """call callback(cmd) with every command too, for a coroutine that can't wait on the condition; see asyncruntime."""
+        self.callbacks.append(callback)
+
+    def send(self,cmd):
+        """send command cmd; once quit's been sent, nothing else is."""
+        with self.condition:
+            if self.state is command.quit:
+                return
+            self.state = cmd
+            self.seen = False
+            self.condition.notify_all()
+        for q in self.queues:
+            q.putlast(cmd)
+        for callback in self.callbacks:
+            callback(cmd)
+
+    def pending(self):
+        """whether there's a command the thread hasn't taken yet."""
+        with self.condition:
+            return not self.seen
+
+    def take(self):
+        """for the thread: the current state, which it's now seen."""
+        with self.condition:
+            self.seen = True
+            self.condition.notify_all()
+            return self.state
+
+    def wait(self,timeout=None):
+        """for the thread: wait up to timeout seconds (None, for ever) for a command it hasn't seen; returns take()."""
+        with self.condition:
+            self.condition.wait_for(lambda : not self.seen,timeout)
+        return self.take()
+
+    def settle(self,timeout=None):
+        """for the sender: wait up to timeout seconds for the thread to take the latest command; True if it has."""
+        with self.condition:
+            return self.condition.wait_for(lambda : self.seen,timeout)
 
 class appconfig(object):
+    runtimes = ('threads','asyncio')    # what runs the sampling; see asyncruntime.
+    shutdowntimeout = 5.0   # seconds endsensorframework waits for the threads to finish, all told.
     cfgfile = 'config.json'
     cfgpath = '~/.jtlogc'
     logfilebasename = 'jtlog'
@@ -117,6 +226,19 @@ class appconfig(object):
             self.load()
         except:
             self.__gendefaultcfg()
+        self.fillslots()
+        self.compileprofiles()
+
+    def sensordefaults(self):
+        """the configuration of an unused sensor slot."""
+        return {'address' : -1,
+                'bus' : defaultbus,
+                'channel' : None,               # I2C mux channel; None if not behind a mux.
+                'modeind' : tempsensor.mode,
+                'slope' : tempsensor.slope_intercept[tempsensor.mode][0],
+                'intercept' : tempsensor.slope_intercept[tempsensor.mode][1],
+                'calibration' : None,           # calibration profile; see ti2ccal.py.
+                'units' : 0}
 
     def __gendefaultcfg(self):
         """appconfig __gendefaultcfg: generate a json config file with sensible default values."""
@@ -124,19 +246,26 @@ class appconfig(object):
         self.statwin.message('Generating default config...')
         sensordefaults = {}
         for i in range(len(tempsensor.i2caddress)):
-            sensordefaults.update({str(i) : {
-                'address' : -1,
-                'modeind' : tempsensor.mode,
-                'slope' : tempsensor.slope_intercept[tempsensor.mode][0],
-                'intercept' : tempsensor.slope_intercept[tempsensor.mode][1],
-                'units' : 0}})
+            sensordefaults.update({str(i) : self.sensordefaults()})
         self.sensorcfg = {'sensors' : sensordefaults}
+        self.sensorcfg.update({'buses' : [defaultbus]})     # I2C buses in use; eight sensor slots each.
 
         # add a logging dictionary; e.g. start & stop times, default sample rates, etc.
         self.sensorcfg.update({'logging' : {
             'start time' : time.strftime('%Y:%m:%d:%H:%M:%S'),
             'stop time' : time.strftime('%Y:%m:%d:%H:%M:%S',time.localtime(time.clock_gettime(time.CLOCK_REALTIME)+3600)),
             'sample period' : 1,
+            'acquisition' : 'triggered',        # or 'continuous'; see sensorbackend.
+            'logformat' : 'csv',                # or 'binary' (see ti2clog.py), 'compact' (ti2ccodec.py) or 'sqlite' (ti2cdb.py).
+            'flush policy' : ti2clog.defaultflushpolicy,    # rows:<n>, seconds:<t> or shutdown; see ti2clog.py.
+            'rotation' : ti2clog.defaultrotation,           # none, size:<MB> or hours:<h>.
+            'compression' : 'none',             # of closed log segments: none, gzip or lzma.
+            'index every' : ti2clog.indexevery, # rows per entry in a csv log's index; 0 for no index.
+            'rollups' : list(ti2crollup.defaulttiers),  # seconds per bucket of each rollup tier; [] for none.
+            'queue policy' : 'block',           # when the logger falls behind: block, drop-oldest or drop-newest; see overflowqueue.
+            'overrun' : ti2cclock.defaultoverrun,   # triggered mode, after a missed trigger: skip or catchup; see ti2cclock.py.
+            'timing log' : True,                # triggered mode: log every trigger's timing too.
+            'runtime' : 'threads',              # or 'asyncio': coroutines on one event loop; see asyncruntime.
             'logfile' : self.logfilebasename,
             'logloc' : self.logfileloc}})
 
@@ -168,16 +297,48 @@ class appconfig(object):
         else:
             self.statwin.message('using existing log path: {}.'.format(self.sensorcfg['logging']['logloc']))
 
+    def buses(self):
+        """the I2C bus numbers in use; configurations from before there was a choice use only the default bus."""
+        return self.sensorcfg.get('buses',[defaultbus])
+
+    def fillslots(self):
+        """make sure there are eight sensor slots for every bus in use; slots are never taken away."""
+        for i in range(len(self.sensorcfg['sensors']),len(tempsensor.i2caddress) * len(self.buses())):
+            self.sensorcfg['sensors'][str(i)] = self.sensordefaults()
+
+    def setbuses(self,buses):
+        """change the I2C buses in use; sensors on buses no longer in use are disabled. returns a list of their #s."""
+        self.sensorcfg['buses'] = buses
+        disabled = []
+        for s in sorted(self.sensorcfg['sensors'],key=int):
+            sensor = self.sensorcfg['sensors'][s]
+            if sensor['address'] != -1 and sensor.get('bus',defaultbus) not in buses:
+                sensor['address'] = -1
+                disabled.append(int(s))
+        self.fillslots()
+        self.save(self.sensorcfg)
+        return disabled
+
     def checksensor(self,sensor):
         """ verify sensor corresponds to a physical device. """
         if sensor['address'] == -1: # if there's no sensor, still valid, even though it's technically not there.
             return True
         try:
-            tempsensor(sensor['address'],sensor['modeind'],sensor['units']).write_config()    # write to the ti2c module; will fail if no sensor.
+            tempsensor(sensor['address'],sensor['modeind'],sensor['units'],sensor.get('bus',defaultbus),sensor.get('channel')).write_config()    # write to the ti2c module; will fail if no sensor.
             return True
         except:
             return False
 
+    def compileprofiles(self):
+        """compile calibration profiles ahead of time, so starting the sensors isn't held up; report any that won't compile."""
+        for s in sorted(self.sensorcfg['sensors'],key=int):
+            sensor = self.sensorcfg['sensors'][s]
+            if sensor['address'] != -1 and sensor.get('calibration'):
+                try:
+                    ti2ccal.buildlut(sensor['calibration'],sensor['modeind'])
+                except (ValueError,KeyError,TypeError,IndexError) as error:
+                    self.statwin.message('error: sensor #{} calibration profile: {}; using slope & intercept.'.format(int(s)+1,error))
+
     def load(self):
         """appconfig load: load system parameters from json file; returns a dictionary."""
         with open('{}/{}'.format(self.cfgpath,self.cfgfile),'r') as f:
@@ -191,144 +352,306 @@ class appconfig(object):
             json.dump(self.sensorcfg,f,indent=4)
 
     def gensensorframework(self):
-        """create all sensor, triggering, logging, and displaying objects, message queues, and threads."""
+        """create all sensor, triggering, logging, and displaying objects, their queues & controls, and threads."""
         # instantiate active sensors:
         self.sensor = []
         self.sensorno = []
-        for s in sorted(self.sensorcfg['sensors']):
+        for s in sorted(self.sensorcfg['sensors'],key=int):
             if self.sensorcfg['sensors'][s]['address'] != -1:
                 self.sensorno.append(int(s)) # maps active sensors to sequential list.
 
                 # create the object:
                 self.sensor.append(tempsensor(self.sensorcfg['sensors'][s]['address'],
                                               self.sensorcfg['sensors'][s]['modeind'],
-                                              self.sensorcfg['sensors'][s]['units']))
+                                              self.sensorcfg['sensors'][s]['units'],
+                                              self.sensorcfg['sensors'][s].get('bus',defaultbus),
+                                              self.sensorcfg['sensors'][s].get('channel')))
                 # load calibration info:
-                self.sensor[int(s)].set_slope(self.sensorcfg['sensors'][s]['slope'])
-                self.sensor[int(s)].set_intercept(self.sensorcfg['sensors'][s]['intercept'])
+                self.sensor[-1].set_slope(self.sensorcfg['sensors'][s]['slope'])
+                self.sensor[-1].set_intercept(self.sensorcfg['sensors'][s]['intercept'])
+                try:
+                    self.sensor[-1].set_calibration(self.sensorcfg['sensors'][s].get('calibration'))
+                except (ValueError,KeyError,TypeError,IndexError):
+                    pass    # already reported by compileprofiles(); the slope & intercept apply.
+
+        # the buses with sensors on them; each gets its own trigger thread (and has its own bus scheduler).
+        self.buses = sorted(set(s.get_bus() for s in self.sensor)) or [defaultbus]
+        for b in self.buses:
+            getbus(b).resetstats()      # bus latency statistics are per run; see endsensorframework.
                 
         # queues:
+        # every queue a sampling thread puts to is an overflowqueue, so that what happens when it's full is a
+        # matter of policy, and counted; see overflowqueue. Only the logger's is up to the config.
+        self.continuous = self.sensorcfg['logging'].get('acquisition','triggered') == 'continuous'
+        policy = self.sensorcfg['logging'].get('queue policy','block')
+        if policy not in overflowqueue.policies:
+            self.statwin.message('error: queue policy {} isn\'t one of {}; using block.'.format(policy,', '.join(overflowqueue.policies)))
+            policy = 'block'
+        runtime = self.sensorcfg['logging'].get('runtime','threads')
+        if runtime not in self.runtimes:
+            self.statwin.message('error: runtime {} isn\'t one of {}; using threads.'.format(runtime,', '.join(self.runtimes)))
+            runtime = 'threads'
+        threaded = runtime == 'threads'
         # qfileio is a list of queues; a thread object of class datalogger gets data from each qfilio queue.
-        # the last member of the qfileio list is associated with the global triggering thread, and is used for timestamps.
-        # the datalogger uses this to record sample times.
+        # the last members of the qfileio list, one per bus, are associated with the global triggering threads,
+        # and are used for timestamps. the datalogger uses these to record sample times.
+        # in continuous mode, every entry is a block of samples: (address,monotonic,wall,raw,cooked); time stamps are
+        # in ns, on both clocks (see ti2cclock.stamp()).
         self.qfileio = []
-        [self.qfileio.append(queue.Queue(100)) for _ in range(len(self.sensor)+1)]
+        [self.qfileio.append(overflowqueue(100,policy,(lambda block : len(block[1])) if self.continuous else None)) for _ in range(len(self.sensor))]
+        [self.qfileio.append(overflowqueue(100,policy)) for _ in range(len(self.buses))]
 
         # queues used by display objects; each display object gets data from a queue associated with a sensor thread.
+        # the display only wants the latest, so it never holds up sampling: when it's behind, the oldest blocks go.
         self.qdisplay = []
-        [self.qdisplay.append(queue.Queue(1000)) for _ in range(len(self.sensor))]
+        [self.qdisplay.append(overflowqueue(1000,'drop-oldest',lambda block : len(block[0]))) for _ in range(len(self.sensor))]
+
+        # queues used by the global trigger thread to hand each sensor thread its sample after every trigger;
+        # the trigger mustn't wait on a back-end, so a back-end that's behind loses its oldest samples.
+        self.qsample = []
+        [self.qsample.append(overflowqueue(10,'drop-oldest')) for _ in range(len(self.sensor))]
 
-        # control queues: threads have a message queue for receiving instructions, pause/run/quit, etc:
-        #   qmsg[0..n-1]    - sensorread threads;
-        #   qmsg[n..2n-1]   - sensordisp threads;
-        #   qmsg[2n]        - datalogger thread;
-        #   qmsg[2n+1]      - global trigger thread.
-        self.qmsg = []
-        [self.qmsg.append(queue.Queue(10)) for _ in range(len(self.sensor)*2+2)]
+        # controls: every thread has a control, through which it's sent run, halt & quit; see control:
+        #   control[0..n-1]     - sensorread threads;
+        #   control[n..2n-1]    - sensordisp threads;
+        #   control[2n]         - datalogger thread;
+        #   control[2n+1..]     - global trigger threads, one per bus.
+        self.control = [control() for _ in range(len(self.sensor)*2+1+len(self.buses))]
 
         # threads:
-        # sensor read & display objects (note these create threads and must know which message queues to get/put data from/to):
+        # sensor read & display objects (note these create threads and must know which queues to get/put data from/to, and their controls):
         self.globalsampleperiod = self.sensorcfg['logging']['sample period']
+        # the trigger schedule, shared by every bus's trigger; it starts with the sensors.
+        overrun = self.sensorcfg['logging'].get('overrun',ti2cclock.defaultoverrun)
+        if overrun not in ti2cclock.overruns:
+            self.statwin.message('error: overrun policy {} isn\'t one of {}; using {}.'.format(overrun,', '.join(ti2cclock.overruns),ti2cclock.defaultoverrun))
+            overrun = ti2cclock.defaultoverrun
+        self.schedule = ti2cclock.schedule(self.globalsampleperiod,overrun)
         self.sensorread = []
         self.sensordisp = []
         for i in range(len(self.sensor)):
             self.sensorread.append(sensorbackend(self.sensor[i],i,
-                                                 self.qdisplay[i],self.qfileio[i],self.qmsg[i],
-                                                 self.statwin))
+                                                 self.qsample[i],self.qdisplay[i],self.qfileio[i],self.control[i],
+                                                 self.statwin,self.continuous,threaded))
             self.sensordisp.append(sensorfrontend(self.sensor[i],self.sensorno[i],i,len(self.sensor),self.globalsampleperiod,
-                                                  self.qdisplay[i],self.qmsg[len(self.sensor)+i],
-                                                  self.statwin))
-
-        self.logger = datalogger(self.qfileio,self.qmsg[len(self.sensor)*2],self.globalsampleperiod,
-                                 self.sensorcfg['logging']['logloc']+'/'+self.sensorcfg['logging']['logfile'],self.statwin)
-
-        self.trigger = sensorglobaltrigger(self.globalsampleperiod,self.qfileio[len(self.sensor)],self.qmsg[len(self.sensor)*2+1],self.statwin)
-
-        # initial samples from sensor are corrupt, so force a trigger now to overwrite whatever is there.
-        self.trigger.trigger()
-        time.sleep(0.267)       # must wait for conversion to complete before returning. 
+                                                  self.qdisplay[i],self.control[len(self.sensor)+i],
+                                                  self.statwin,threaded))
+
+        # the logger's settings are checked here, where a bad one can be reported & the default used; in its thread, it'd be the end of the log.
+        logformat = self.sensorcfg['logging'].get('logformat','csv')
+        if logformat not in datalogger.logformats:
+            self.statwin.message('error: log format {} isn\'t one of {}; using csv.'.format(logformat,', '.join(datalogger.logformats)))
+            logformat = 'csv'
+        flushpolicy = self.sensorcfg['logging'].get('flush policy',ti2clog.defaultflushpolicy)
+        try:
+            ti2clog.parseflushpolicy(flushpolicy)
+        except (ValueError,TypeError,AttributeError):
+            self.statwin.message('error: flush policy {} isn\'t rows:<n>, seconds:<t> or shutdown; using {}.'.format(flushpolicy,ti2clog.defaultflushpolicy))
+            flushpolicy = ti2clog.defaultflushpolicy
+        rotation = self.sensorcfg['logging'].get('rotation',ti2clog.defaultrotation)
+        try:
+            ti2clog.parserotation(rotation)
+        except (ValueError,TypeError,AttributeError):
+            self.statwin.message('error: rotation {} isn\'t none, size:<MB> or hours:<h>; using {}.'.format(rotation,ti2clog.defaultrotation))
+            rotation = ti2clog.defaultrotation
+        compression = self.sensorcfg['logging'].get('compression','none')
+        if compression not in ti2clog.compressions:
+            self.statwin.message('error: compression {} isn\'t one of {}; using none.'.format(compression,', '.join(ti2clog.compressions)))
+            compression = 'none'
+
+        self.logger = datalogger(self.qfileio,self.control[len(self.sensor)*2],self.globalsampleperiod,
+                                 self.sensorcfg['logging']['logloc']+'/'+self.sensorcfg['logging']['logfile'],self.statwin,
+                                 self.continuous,[s.get_location() for s in self.sensor],len(self.buses),
+                                 logformat,self.sensor,flushpolicy,rotation,compression,self.sensorcfg,
+                                 self.sensorcfg['logging'].get('index every',ti2clog.indexevery),
+                                 self.sensorcfg['logging'].get('rollups',list(ti2crollup.defaulttiers)),
+                                 self.buses if self.sensorcfg['logging'].get('timing log',True) else None)
+
+        # sensors that weren't found send nothing, so the logger needn't wait for them.
+        for i,sr in enumerate(self.sensorread):
+            if not sr.found:
+                self.qfileio[i].putlast(endmarker)
+
+        # in continuous mode the sensors run on their own clocks, and there's nothing to trigger.
+        # otherwise each bus's trigger samples the sensors on it that were found, and that it could configure;
+        # the back-end of one it couldn't is ended, as if it hadn't been found.
+        self.trigger = []
+        if not self.continuous:
+            for b,bus in enumerate(self.buses):
+                onbus = [i for i in range(len(self.sensor)) if self.sensor[i].get_bus() == bus and self.sensorread[i].found]
+                self.trigger.append(sensorglobaltrigger(self.schedule,[self.sensor[i] for i in onbus],[self.qsample[i] for i in onbus],
+                                                        self.qfileio[len(self.sensor)+b],self.control[len(self.sensor)*2+1+b],self.statwin,bus,threaded))
+                for i in onbus:
+                    if self.sensor[i] not in self.trigger[-1].sensor:
+                        self.sensorread[i].found = False
+                        (self.qsample[i] if threaded else self.qfileio[i]).putlast(endmarker)
+
+            # initial samples from sensor are corrupt, so force a trigger now to overwrite whatever is there.
+            for t in self.trigger:
+                try:
+                    t.trigger()
+                except OSError:
+                    pass            # the first sample of the run may be off, that's all.
+            time.sleep(0.267)       # must wait for conversion to complete before returning. 
+
+        # under the asyncio runtime, the triggers, back-ends & displays have no threads of their own; it runs them.
+        self.runtime = None if threaded else asyncruntime(self)
+
+        # and everything's health, as metrics; exported until endsensorframework.
+        self.exporter = self.genmetrics()
         
+    def genmetrics(self):
+        """the health metrics of the framework just generated, and an exporter for them, as the config says; None for none."""
+        # they're all read from what the threads keep anyway, when they're exported; see ti2cmetrics.py.
+        logging = self.sensorcfg['logging']
+        socketname = logging.get('metrics socket','{}/metrics.sock'.format(self.cfgpath))
+        filename = logging.get('metrics file')
+        if not socketname and not filename:
+            return None
+        interval = logging.get('metrics interval',ti2cmetrics.defaultinterval)
+        if isinstance(interval,bool) or not isinstance(interval,(int,float)) or interval <= 0:
+            self.statwin.message('error: metrics interval {} isn\'t a number of seconds; using {}.'.format(interval,ti2cmetrics.defaultinterval))
+            interval = ti2cmetrics.defaultinterval
+
+        n = len(self.sensor)
+        sensors = [s.get_location() for s in self.sensor]
+        buses = [(str(b),getbus(b)) for b in self.buses]
+        # every queue, by its name here, and the sensor it's for, or the bus whose trigger time stamps it carries.
+        queues = ([('qfileio',sensors[i],self.qfileio[i]) for i in range(n)] +
+                  [('qfileio','bus {}'.format(b),self.qfileio[n+k]) for k,b in enumerate(self.buses)] +
+                  [('qdisplay',sensors[i],self.qdisplay[i]) for i in range(n)] +
+                  [('qsample',sensors[i],self.qsample[i]) for i in range(n)])
+        perqueue = lambda f : (lambda : [((name,source),f(q)) for name,source,q in queues])
+        perbus = lambda f : (lambda : [((b,),f(bus.stats())) for b,bus in buses])
+        pertrigger = lambda f : (lambda : [((str(t.bus),),f(t.timing.stats())) for t in self.trigger])
+
+        m = ti2cmetrics.registry()
+        m.counter('jtlogc_samples_total','samples logged, by sensor.',('sensor',),
+                  lambda : [((label,),count) for label,count in zip(sensors,self.logger.samples)],True)
+        m.counter('jtlogc_samples_missing_total','triggered: cells left empty in the log, for want of a sample.',(),
+                  lambda : [((),self.logger.missing)])
+        m.counter('jtlogc_samples_late_total','triggered: samples too late for their row, and not logged.',(),
+                  lambda : [((),self.logger.late)])
+        m.counter('jtlogc_logger_bytes_total','bytes logged; for a database, what it\'s grown by on the card.',(),
+                  lambda : [((),self.logger.logged)],True)
+        m.gauge('jtlogc_queue_depth','entries waiting in each queue: samples, blocks of samples (continuous), or trigger time stamps.',
+                ('queue','source'),perqueue(lambda q : q.qsize()))
+        m.counter('jtlogc_queue_dropped_total','samples thrown away by each queue, as its policy says, when it was full.',
+                  ('queue','source'),perqueue(lambda q : q.dropped))
+        m.counter('jtlogc_queue_waits_total','puts that found each queue full, and waited.',('queue','source'),perqueue(lambda q : q.waits))
+        m.counter('jtlogc_i2c_transactions_total','bus transactions run, by bus.',('bus',),perbus(lambda s : s['transactions']))
+        m.histogram('jtlogc_i2c_latency_seconds','time from request to completion of bus requests, by bus & priority.',latencybuckets,
+                    ('bus','priority'),lambda : [((b,p),(s[p]['histogram'],s[p]['mean'] * s[p]['requests']))
+                                                 for b,bus in buses for s in [bus.stats()] for p in prionames])
+        m.counter('jtlogc_i2c_errors_total','failed bus requests, by bus & errno; EREMOTEIO (ENXIO or EIO on some controllers) is a NACK.',
+                  ('bus','errno'),lambda : [((b,e),count) for b,bus in buses for e,count in sorted(bus.stats()['errors'].items())])
+        if self.trigger:
+            m.counter('jtlogc_triggers_total','triggers sent, by bus.',('bus',),pertrigger(lambda s : s['triggers']))
+            m.counter('jtlogc_triggers_skipped_total','slots skipped after an overrun, by bus.',('bus',),pertrigger(lambda s : s['skipped']))
+            m.counter('jtlogc_triggers_failed_total','triggers that failed (a NACKed general call, say), costing their slot, by bus.',('bus',),
+                      pertrigger(lambda s : s['failed']))
+            m.gauge('jtlogc_trigger_late_seconds','how far behind the schedule triggers are, on average, by bus.',('bus',),
+                    pertrigger(lambda s : s['late']['mean'] / 1e9))
+            m.gauge('jtlogc_trigger_late_max_seconds','the latest trigger, by bus.',('bus',),pertrigger(lambda s : s['late']['max'] / 1e9))
+            m.gauge('jtlogc_trigger_jitter_seconds','the standard deviation of how late triggers are, by bus.',('bus',),
+                    pertrigger(lambda s : s['jitter'] / 1e9))
+            m.gauge('jtlogc_trigger_drift_ratio','how fast triggers are slipping behind the schedule, in seconds per second, by bus.',('bus',),
+                    pertrigger(lambda s : s['drift'] / 1e9))
+            m.gauge('jtlogc_trigger_write_seconds','the trigger\'s bus write, on average, by bus.',('bus',),
+                    pertrigger(lambda s : s['write']['mean'] / 1e9))
+            m.gauge('jtlogc_trigger_write_max_seconds','the slowest trigger bus write, by bus.',('bus',),pertrigger(lambda s : s['write']['max'] / 1e9))
+        return ti2cmetrics.exporter(m,interval,filename,socketname,self.statwin.message)
+
     def startsensors(self):
-        '''send all threads a run message & show them'''
-        for q in self.qmsg:
-            q.put('r')
+        '''send all threads a run command & show them'''
+        self.schedule.start()       # the first trigger's due now.
+        for c in self.control:
+            c.send(command.run)
         # show the sensor data:
         [sd.windowrefresh() for sd in self.sensordisp]
         self.statwin.message('sensors started')
 
     def stopsensors(self):
-        '''send all threads a halt message; this is like pause, not quit'''
-        for q in self.qmsg:
-            q.put('h')          # halt the threads functions; do not kill them.
-        #self.qmsg[len(self.sensor)*2+1].put('h')   # halt the trigger.
+        '''send all threads a halt command; this is like pause, not quit'''
+        for c in self.control:
+            c.send(command.halt)    # halt the threads functions; do not kill them.
 
     def pausedisplayupdates(self):
-        '''send all display threads a halt message, pausing them; the threads are still running, just not updating'''
-        for q in range(len(self.sensor),len(self.sensor)*2):
-            self.qmsg[q].put('h')
-        #time.sleep(self.globalsampleperiod)    # wait a little so the display threads can stop.
-        time.sleep(0.1)                         # if the sample period is long, the program will sit here for far too long.
+        '''send all display threads a halt command, pausing them; the threads are still running, just not updating'''
+        displays = self.control[len(self.sensor):len(self.sensor)*2]
+        for c in displays:
+            c.send(command.halt)
+        # wait for them to take it, so none is still drawing when a menu goes up; at most a block's worth.
+        deadline = time.monotonic() + 0.1
+        for c in displays:
+            c.settle(max(deadline - time.monotonic(),0))
 
     def resumedisplayupdates(self):
-        '''resume display updates by queueing run commands to the display threads'''
-        for q in range(len(self.sensor),len(self.sensor)*2):
-            self.qmsg[q].put('r')
+        '''resume display updates by sending run commands to the display threads'''
+        for c in self.control[len(self.sensor):len(self.sensor)*2]:
+            c.send(command.run)
         [sd.windowrefresh() for sd in self.sensordisp]
         
     def endsensorframework(self):
-        '''send a quit command to each thread; this will make them complete and end'''
-        # end datalogger thread; will close log file on exit;
-        self.qmsg[len(self.sensor)*2].put('q')
-        # datalogger thread blocks on other threads, which may have extremely long 
-        # sleep times. Push dummy data onto the sensor back-end threads to force the 
-        # threads to unblock, receive the quit command from its message queue, and 
-        # finally, mercifully, die.
-        # But wait, there's a possibility of confusion if the datalogger queues have data in them:
-        while True:
-            allempty = True
-            for i in range(len(self.sensor)):
-                if not self.qfileio[i].empty():
-                    allempty = False
-            if not self.qfileio[len(self.sensor)].empty():
-                allempty = False
-            if allempty:
-                break
-                
-        [self.qfileio[i].put((0,0,0.0)) for i in range(len(self.sensor))]   # dump 0 into each sensor backend queue
-        self.qfileio[len(self.sensor)].put(time.time()) # dump time into time queue to wake the thread up.
-        #self.statwin.message('endsensorframework: awaiting datalogger thread exit.')
+        '''stop every thread, and wait for them to finish: the log is closed once everything sampled is in it'''
+        # quit goes to every thread at once; none of them sleeps on anything but its control or a queue it's
+        # attached to, so they all see it straight away, whatever the sample period. The data sources (the trigger threads, or
+        # in continuous mode the sensor back-ends) finish the sample in hand (a trigger collecting its sensors stops
+        # waiting for those that haven't answered yet), and put an endmarker on each of their queues behind it; one-shot back-ends pass theirs on. The logger writes everything ahead of
+        # the endmarkers, then closes the log; the displays just stop. The threads end in parallel, and
+        # however they're doing, this returns within shutdowntimeout.
+        for c in self.control:
+            c.send(command.quit)
         curses.doupdate()
-        self.logger.tl.join()
-        
-        # end sensor front end threads:
-        for q in range(len(self.sensor),len(self.sensor)*2):
-            self.qmsg[q].put('q')
-        for q in range(len(self.sensor)):       # threads block on data; so unblock them.
-            self.qdisplay[q].put(0) # raw
-            self.qdisplay[q].put(0) # cooked
-        #self.statwin.message('endsensorframework: awaiting frontends.')
-        curses.doupdate()
-        for sd in self.sensordisp:
-            sd.td.join()
-        
-        # end sensor backend threads:
-        for q in range(len(self.sensor)):
-            self.qmsg[q].put('q')
-        #self.statwin.message('endsensorframework: awaiting backends')
-        curses.doupdate()
-        for sr in self.sensorread:
-            sr.ts.join()
-        
-        # end trigger thread:
-        self.qmsg[len(self.sensor)*2+1].put('q')
-        #self.statwin.message('endsensorframework: awaiting trigger thread exit.')
-        curses.doupdate()
-        self.trigger.tgt.join()
-        
+        deadline = time.monotonic() + self.shutdowntimeout
+        threads = ([t.tgt for t in self.trigger if hasattr(t,'tgt')] + [sr.ts for sr in self.sensorread if hasattr(sr,'ts')] +
+                   [self.logger.tl] + [sd.td for sd in self.sensordisp if hasattr(sd,'td')] + ([self.runtime.thread] if self.runtime else []))
+        for t in threads:
+            t.join(max(deadline - time.monotonic(),0))
+        late = [t.name for t in threads if t.is_alive()]
+        if late:
+            self.statwin.message('error: {} still running {} s after stopping; the log may not be complete.'.format(', '.join(late),self.shutdowntimeout))
+
+        # report how the buses coped:
+        for b in self.buses:
+            stats = getbus(b).stats()
+            switches = ' ({} mux switches)'.format(stats['switches']) if stats['switches'] else ''
+            self.statwin.message('bus {}: {} transactions{}, {} requests combined; latency ms (mean/max): trigger {:.2f}/{:.2f}; read {:.2f}/{:.2f}.'.format(
+                                 b,stats['transactions'],switches,stats['coalesced'],
+                                 stats['trigger']['mean'] * 1000,stats['trigger']['max'] * 1000,
+                                 stats['read']['mean'] * 1000,stats['read']['max'] * 1000))
+
+        # and the triggers' timing:
+        for t in self.trigger:
+            stats = t.timing.stats()
+            if stats['triggers'] or stats['failed']:
+                self.statwin.message('bus {}: {} triggers, {} skipped, {} failed; us: late {:.1f} (max {:.1f}), jitter {:.1f}, drift {:.3f}/s; write {:.1f} (max {:.1f}).'.format(
+                                     t.bus,stats['triggers'],stats['skipped'],stats['failed'],stats['late']['mean'] / 1000,stats['late']['max'] / 1000,
+                                     stats['jitter'] / 1000,stats['drift'] / 1000,stats['write']['mean'] / 1000,stats['write']['max'] / 1000))
+
+        # and the queues; anything lost, or any wait, means sampling outran the logger or the display.
+        for i,s in enumerate(self.queuestats()):
+            if s['logger dropped'] or s['logger waits'] or s['display dropped'] or s['trigger dropped']:
+                self.statwin.message('sensor @ {}: samples dropped: {} by the logger, {} by the display, {} by the back-end; logger kept it waiting {} times.'.format(
+                                     self.sensor[i].get_location(),s['logger dropped'],s['display dropped'],s['trigger dropped'],s['logger waits']))
+        stamps = sum([q.dropped for q in self.qfileio[len(self.sensor):]])
+        if stamps:
+            self.statwin.message('datalogger: {} trigger time stamps dropped.'.format(stamps))
+
+        # a last export, with the numbers the run ended on; the metrics read the queues.
+        if self.exporter:
+            self.exporter.close()
+
         # wipe out the queues
         del self.qfileio
         del self.qdisplay
-        del self.qmsg
+        del self.qsample
+        del self.control
+
+    def queuestats(self):
+        """per sensor: samples dropped by, and waits on, its queues since the framework was generated."""
+        return [{'logger dropped' : self.qfileio[i].dropped,'logger waits' : self.qfileio[i].waits,
+                 'display dropped' : self.qdisplay[i].dropped,'trigger dropped' : self.qsample[i].dropped} for i in range(len(self.sensor))]
 
     def regensensorframework(self):
         self.endsensorframework()
@@ -343,7 +666,7 @@ class thetime(object):
         self.win= curses.newwin(self.ysize,self.xsize,self.yloc,self.xloc)
         self.win.bkgd(' ',curses.color_pair(1))
 
-        self.qmsg = queue.Queue(2)
+        self.control = control(command.run)
         self.tloctime = threading.Thread(target=self.__syslocaltimetask,name='t-rtc',args=())
         self.tloctime.start()
 
@@ -352,167 +675,644 @@ class thetime(object):
         self.win.mvwin(self.yloc,self.xloc)
 
     def __syslocaltimetask(self):
-        msg = 'r'
-        while(True):
-            if msg == 'r':
-                with threading.Lock():
-                    self.win.addstr(0,0,time.strftime('%Y:%m:%d:%H:%M:%S'))
-                    self.win.noutrefresh()
-            elif msg == 'q':
-                break
-
-            if not self.qmsg.empty():                               # only processes when data received.
-                msg = self.qmsg.get()
-
-            time.sleep(1)
+        while self.control.take() is not command.quit:
+            with threading.Lock():
+                self.win.addstr(0,0,time.strftime('%Y:%m:%d:%H:%M:%S'))
+                self.win.noutrefresh()
+            self.control.wait(1 - time.time() % 1)                 # until the next second, or quit.
             
         #sys.stderr.write('thread: {} ended.\n'.format(threading.current_thread().name))
         # end thread
 
     def endthetime(self):
-        self.qmsg.put('q')
+        self.control.send(command.quit)
         self.tloctime.join()
-        del self.qmsg
+        del self.control
         del self.win
 
 
 class datalogger(object):
-    def __init__(self,qfileio,qmsg,sampleperiod,logfileprefix,statwin):     # note qfileio is an array of queues
+    logformats = ('csv','binary','compact','sqlite')
+    # the formats with a writer for a log file: the file name suffix, and the writer; see ti2clog.py & ti2ccodec.py.
+    writers = {'binary' : (ti2clog.extension,ti2clog.logwriter),'compact' : (ti2ccodec.extension,ti2ccodec.encoder)}
+    fanintimeout = 1.0  # triggered mode: seconds, beyond a sample period, that a row waits for a late sample.
+    drainlimit = 2.0    # seconds, from stopping, the logger waits for the queues' endmarkers.
+
+    def __init__(self,qfileio,control,sampleperiod,logfileprefix,statwin,continuous=False,labels=None,ntimestamps=1,
+                 logformat='csv',sensors=(),flushpolicy=ti2clog.defaultflushpolicy,
+                 rotation=ti2clog.defaultrotation,compression='none',config=None,indexevery=ti2clog.indexevery,
+                 rollups=ti2crollup.defaulttiers,timingbuses=None):     # note qfileio is an array of queues
         self.qfileio = qfileio
-        self.qmsg = qmsg
+        self.nsensors = len(qfileio) - ntimestamps  # the last ntimestamps queues carry trigger time stamps, one per bus.
+        self.labels = labels                    # each sensor's bus & address as written to the log; by default, its address.
+        self.control = control
         self.sampleperiod = sampleperiod
         self.logfileprefix = logfileprefix      # path and prefix of log file; time stamp and csv suffix added in-thread
         self.statwin = statwin
+        self.continuous = continuous            # sensors queue blocks of samples, not one per trigger; see __writeblocks.
+        self.logformat = logformat              # one of logformats.
+        self.binary = logformat != 'csv'        # samples go to a writer as numbers, not to the log as text.
+        self.sensors = sensors                  # the sensor objects, for the binary log's header or the database.
+        self.config = config                    # the configuration, recorded with each run in a database.
+        self.indexevery = indexevery            # rows per entry in a csv log's index (see ti2clog.py); 0 for none.
+        self.index = None
+        self.rollups = rollups                  # seconds per bucket of each rollup tier; see ti2crollup.py.
+        self.rollup = None
+        self.timingbuses = timingbuses          # triggered mode: the bus of each time stamp queue, to log triggers' timing; None for none.
+        self.timinglog = None
+        self.rows = {}                          # triggered mode: rows being gathered; see __gather.
+        self.written = 0                        # the sequence # of the last row written; slots start at 1.
+        self.missing = 0                        # cells left empty, and samples too late for their row.
+        self.late = 0
+        self.samples = [0] * self.nsensors      # samples logged, by sensor; for the metrics, as is logged.
+        self.logged = 0                         # bytes logged, all segments told.
+        self.segmentbytes = 0                   # ...in the segments closed so far.
+        self.base = 0                           # the size of the segment (a database's, that is) when it was opened.
+        self.flushpolicy = flushpolicy          # when the log is synced to the card; see ti2clog.py.
+        self.rotation = rotation                # when the log is cut into a new segment.
+        self.compression = compression          # how closed segments are compressed, if at all.
+        # the queues still to deliver their endmarker: the sensors', and in triggered mode, the time stamps' too.
+        self.open = set(range(self.nsensors if continuous else len(qfileio)))
+        # commands turn up on the queue the logger waits on, too: the first bus's time stamps, or the first sensor's blocks.
+        self.control.attach(self.qfileio[0 if continuous else self.nsensors])
     
         self.tl = threading.Thread(target=self.__logwriter,name='t-datalogger',args=())
         self.tl.start()
 
-    # the sensor task will queue the sensor address, calculated temperature, and raw adc sample,
-    # instead of maintaining a column of data, just write addr,raw,cooked,,addr,raw,cooked,,adr,raw,cooked...
+    # the sensor task will queue the sensor address, trigger sequence #, read time stamp, calculated temperature, and
+    # raw adc sample; instead of maintaining a column of data, just write addr,raw,cooked,,addr,raw,cooked,,adr,raw,cooked...
+    # (addr is bus:addr for sensors that aren't on the default bus.)
+    # every bus's trigger thread queues a (sequence #,time stamp,timing) per trigger; the sequence # is the
+    # trigger's slot in the schedule they all share (see ti2cclock.py), so the triggers for a slot on every bus
+    # belong to the same row, and the earliest time stamp is used for it. the timing goes to the timing log.
+    # time stamps are (monotonic,wall) pairs of ns, from ti2cclock.stamp(): a row has its trigger's, & every sample
+    # the stamp of when it was read, so the read latency is exact, and a wall clock step shows. a csv row is
+    # time,monotonic,,addr,raw,cooked,read monotonic,read wall,,addr,... with time to the ns, and the rest as ns.
+    # samples are gathered into rows by sequence #, whatever order they turn up in; a row is written once it's
+    # complete, or once it's waited a sample period & fanintimeout for a sensor that's late, with that sensor's
+    # cell left empty: addr,, (NaN in binary logs). So one slow or missing sensor holds up its own cells, not
+    # the log, and a row never pairs samples from different triggers. samples turning up after their row has
+    # been written are dropped, and counted.
     # this way the sensor doesn't need to know its number, and the log function doesn't need to care, but 
     # the cost is more data being queued.
-    # the task will block waiting for data from the queue while running, but if halted will check every sample period 
-    # for supervisory queue messages, such as either 'r' or 'q'.
+    # the task waits on the queues for up to a quarter second at a time, while running; its commands arrive on
+    # the queue it waits on, so it sees them at once. halted, once whatever was in flight has been written, it
+    # waits on its control until the next command, or until the flush policy's due.
+    # quit: the logger keeps writing until every queue has delivered its endmarker, or drainlimit seconds
+    # have passed (a source that's hung never sends one), then closes the log.
+    # in continuous mode, sensors aren't sampled together, so there's no common timestamp: each sample gets a row
+    # of its own, time,monotonic,,addr,raw,cooked, stamped when it was read; rows are in order for each sensor, a
+    # block at a time.
+    # binary logs have the same rows, as fixed width records; see ti2clog.py. databases have a row per sample; see ti2cdb.py.
+
+    # samples are summarised as they go by, too, by the second, minute & hour; see ti2crollup.py. a rollup
+    # covers the whole run, whatever the segments.
+
+    # a log is one or more segments, cut by the rotation policy; every segment has a header of its own,
+    # so it can be read without the others. closed segments are handed to the compressor.
+
+    def __opensegment(self):
+        """open a new log segment, named for the time it starts, and write its header."""
+        if self.logformat == 'sqlite':      # every run goes in the one database, which stands in for the log; it's never cut.
+            self.datalog = self.writer = ti2cdb.dbwriter(self.logfileprefix + ti2cdb.extension,self.sensors,self.continuous,
+                                                         self.sampleperiod,self.flushpolicy,self.config)
+            self.base = self.datalog.tell()
+            return
+        self.base = 0
+        # rows are gathered up & written in batches, and synced to the card by the flush policy; see ti2clog.logbuffer.
+        stamp = time.strftime('%Y%m%d%H%M%S')
+        suffix = self.writers[self.logformat][0] if self.binary else '.csv'
+        log = self.logfileprefix + stamp + suffix
+        n = 1
+        while os.path.exists(log) or os.path.exists(log + ti2clog.compressions[self.compression]):   # small segments; two in a second.
+            n += 1
+            log = '{}{}_{}{}'.format(self.logfileprefix,stamp,n,suffix)
+        self.datalog = ti2clog.logbuffer(log,self.flushpolicy,self.rotation)
+        if self.binary:
+            self.writer = self.writers[self.logformat][1](self.datalog,self.sensors,self.continuous,self.sampleperiod)
+        else:
+            if self.indexevery:
+                self.index = ti2clog.indexwriter(log,self.indexevery,ti2clog.continuousslack if self.continuous else 0.0,self.flushpolicy)
+            self.datalog.write('Filename: ' + log + '\n')
+            self.datalog.write('Start time: ' + time.asctime() + '\n')
+            self.endstamp = self.datalog.write('dnE time: ' + time.asctime() + '\n') # overwritten when the segment is closed.
+            if self.continuous:
+                self.datalog.write('Sample period: continuous; each sensor at its own sample rate.\n')
+            else:
+                self.datalog.write('Sample period: ' + str(self.sampleperiod) + ' seconds.\n')
+            self.datalog.write(ti2clog.stampsline)
+            self.datalog.checkpoint('jtlogc',self.endstamp)    # so it can be finished off if it's never closed; see ti2clog.recover().
+
+    def __closesegment(self):
+        """stamp the segment's end time, close it, and queue it for compression."""
+        if self.logformat == 'sqlite':
+            self.writer.close()
+        elif self.binary:
+            self.writer.close()
+        else:
+            self.datalog.pwrite('End time: ' + time.asctime(),self.endstamp)
+            self.datalog.close()
+            if self.index:
+                self.index.close()
+        self.segmentbytes += self.datalog.tell() - self.base
+        self.logged = self.segmentbytes
+        if self.logformat != 'sqlite':
+            self.compressor.add(self.datalog.filename)
 
     def __logwriter(self):
-        # open a file for writing sample data
-        log = time.strftime(self.logfileprefix + '%Y%m%d%H%M%S.csv')
-        datalog = open(log,'w')
-        header = 'Filename: ' + log + '\n'
-        endstamp = len(header)
-        datalog.write(header)
-        header = 'Start time: ' + time.asctime() + '\n'
-        endstamp += len(header)
-        datalog.write(header)
-        datalog.write('dnE time: ' + time.asctime() + '\n') # thread will overwrite this when terminating.
-        datalog.write('Sample period: ' + str(self.sampleperiod) + ' seconds.\n')
-
-        # adapt the list size to suit the # of sensors.
-        valsensor = []
-        [valsensor.append(0) for _ in range(len(self.qfileio)-1)]
-
-        msg = 'r'               # initial state is running.
+        # the compressor has a thread of its own, which python waits for at exit: it's closed whatever happens to the log.
+        self.compressor = ti2clog.compressor(self.compression,self.statwin.message)
+        try:
+            self.__logrun()
+        finally:
+            self.compressor.close()                 # compression carries on in the background.
 
-        while True:
-            if msg == 'r':
-                #sys.stderr.write('{}: awaiting timestamp.\n'.format(threading.current_thread().name))
-                with threading.Lock():
-                    timestamp = self.qfileio[len(self.qfileio)-1].get()  # a float
-                for i in range(len(self.qfileio)-1):    # all queues have tuples, except the time stamp
-                    #sys.stderr.write('{}: awaiting q[{}].\n'.format(threading.current_thread().name,str(i)))
-                    with threading.Lock():
-                        valsensor[i] = self.qfileio[i].get()    # a tuple: (sensor address, raw sample, cooked temp)
-                if valsensor[0][0] != 0:   # if the address entry of the tuple is 0, this is end of file, so don't write.
-                    datalog.write(time.strftime('%Y/%m/%d %H:%M:%S.{:03},'.format(int(timestamp % 1 * 1000)),time.localtime(timestamp)))
-                    for d in valsensor:
-                        datalog.write(',{:#4x},{:#7x},{:#7.3f},'.format(d[0],d[1],d[2]))
-                    datalog.seek(datalog.tell()-1)               # move back a character; overwrite the comma with a \n.
-                    datalog.write('\n')
+    def __logrun(self):
+        # open a file for writing sample data
+        ti2clog.recoverall(self.logfileprefix + '*',self.statwin.message)   # logs a crash or power failure left open.
+        self.__opensegment()
+        if self.rollups:
+            try:
+                self.rollup = ti2crollup.rollup(self.logfileprefix + time.strftime('%Y%m%d%H%M%S'),
+                                                 self.labels or ['{:#4x}'.format(s.get_address()) for s in self.sensors],
+                                                 self.rollups,self.flushpolicy)
+            except ValueError as error:
+                self.statwin.message('rollups: {}'.format(error))
+        if self.timingbuses and not self.continuous:
+            self.timinglog = ti2cclock.timinglog(self.logfileprefix + time.strftime('%Y%m%d%H%M%S'),self.flushpolicy)
+        if self.binary:
+            self.pending = [[] for _ in range(self.nsensors)]  # continuous samples waiting to be merged; see __writemerged.
+            self.latest = [0] * self.nsensors      # monotonic ns.
+
+        labels = self.labels
+        if labels is None:
+            labels = [None] * self.nsensors
+
+        halted = time.monotonic()   # when the logger was halted, as it is initially; None while running.
+        deadline = None             # after quit, the time to give up on the endmarkers.
+
+        while self.open:
+            state = self.control.take()
+            if deadline is None and state is command.quit:
+                deadline = time.monotonic() + self.drainlimit
+            elif deadline is not None and time.monotonic() >= deadline:
+                break
+            if state is command.run or deadline:
+                halted = None
+            elif halted is None:
+                halted = time.monotonic()
+            # halted, samples still on their way when sampling halted are written, up to when they'd be given up on.
+            if halted is None or self.rows or time.monotonic() < halted + self.sampleperiod + self.fanintimeout:
+                if self.continuous:
+                    if (self.__writemerged(self.writer) if self.binary else self.__writeblocks(self.datalog)) == 0 and self.open:
+                        self.qfileio[min(self.open)].waitfor(sensorbackend.blocktime / 4)  # nothing waiting; blocks arrive every blocktime.
+                else:
+                    self.__gather(min(self.sampleperiod,0.25))
+                    self.__writerows(labels)
+            else:                   # nothing left to do until the next command; a 'seconds' flush policy holds while halted, too.
+                due = self.datalog.due - time.monotonic() if self.datalog.kind == 'seconds' and self.datalog.rows else None
+                self.control.wait(None if due is None else max(due,0))
+            self.datalog.poll()
+            self.logged = self.segmentbytes + self.datalog.tell() - self.base
+            if self.timinglog:
+                self.timinglog.poll()
+            if self.datalog.full():
+                self.__closesegment()
+                self.__opensegment()
+
+        if self.open:
+            self.statwin.message('datalogger: {} queues hadn\'t finished {} s after stopping; logging what they had.'.format(len(self.open),self.drainlimit))
+        if self.continuous:                         # the back-ends have ended; write whatever they left behind.
+            if self.binary:
+                self.__writemerged(self.writer,True)
             else:
-                time.sleep(self.sampleperiod)
-
-            # check for supervisor message:
-            if self.qmsg.empty() == False:
-                msg = self.qmsg.get()
-                #self.statwin.message('thread: {} received {}.'.format(threading.current_thread().name,msg))
-                #sys.stderr.write('{}: received {}.\n'.format(threading.current_thread().name,msg))
-                if msg == 'q':
-                    break
-
-        datalog.seek(endstamp)
-        datalog.write('End time: ' + time.asctime())
-        datalog.close()
+                self.__writeblocks(self.datalog)
+        else:                                       # the triggers have ended; every row's as complete as it'll get.
+            self.__gather()
+            self.__writerows(labels,True)
+            if self.missing or self.late:
+                self.statwin.message('datalogger: {} samples missing from their rows; {} too late to log.'.format(self.missing,self.late))
+        self.__closesegment()
+        if self.rollup:
+            self.rollup.close()                     # the buckets still open are written, part full.
+        if self.timinglog:
+            self.timinglog.close()
         #self.statwin.message('thread: {} ended.'.format(threading.current_thread().name))
         #sys.stderr.write('thread: {} ended.\n'.format(threading.current_thread().name))
         # end thread.
 
+    def __gather(self,wait=0):
+        """triggered mode: move everything waiting in the queues into the rows being gathered, keyed by trigger
+        sequence #; waits up to wait seconds for the first queue still open, usually the first bus's time stamps."""
+        for q in [self.nsensors] + list(range(self.nsensors)) + list(range(self.nsensors + 1,len(self.qfileio))):
+            while True:
+                try:
+                    item = self.qfileio[q].get(timeout=wait) if wait and q in self.open else self.qfileio[q].get_nowait()
+                except queue.Empty:
+                    break
+                wait = 0
+                if item is endmarker:
+                    self.open.discard(q)
+                    continue
+                if isinstance(item,command):        # the logger's own commands; the loop takes them from its control.
+                    continue
+                if q < self.nsensors:
+                    address,seq,read,raw,cooked = item
+                else:
+                    seq,stamp,timing = item
+                    if self.timinglog:
+                        self.timinglog.add(seq,self.timingbuses[q - self.nsensors],timing)
+                if seq <= self.written:             # its row's gone.
+                    self.late += 1
+                    continue
+                row = self.rows.get(seq)
+                if row is None:                     # [time stamp per bus,cell per sensor,when to give up on it]
+                    row = self.rows[seq] = [[None] * (len(self.qfileio) - self.nsensors),[None] * self.nsensors,
+                                            time.monotonic() + self.sampleperiod + self.fanintimeout]
+                if q < self.nsensors:
+                    row[1][q] = (address,raw,cooked,read)
+                else:
+                    row[0][q - self.nsensors] = stamp
+
+    def __writerows(self,labels,final=False):
+        """triggered mode: write the gathered rows, in sequence, up to the first that's still waiting for a sample."""
+        while self.rows:
+            seq = min(self.rows)
+            stamps,cells,due = self.rows[seq]
+            # only a sample (or time stamp) that's still to come is waited for: a queue that's ended has nothing more.
+            waiting = ([k for k,t in enumerate(stamps) if t is None and self.nsensors + k in self.open] +
+                       [i for i,c in enumerate(cells) if c is None and i in self.open])
+            if not final and waiting and time.monotonic() < due:
+                break
+            del self.rows[seq]
+            self.written = seq
+            stamps = [t for t in stamps if t is not None]
+            if not stamps:                          # its time stamps were dropped (see overflowqueue); it can't be placed.
+                self.missing += self.nsensors
+                continue
+            stamp = min(stamps)                     # the earliest trigger, by the monotonic clock.
+            timestamp = stamp[1] / 1e9              # for the index & checkpoints, which only need to find the row.
+            self.missing += cells.count(None)
+            for i,c in enumerate(cells):
+                if c is not None:
+                    self.samples[i] += 1
+            if self.binary:
+                self.writer.writerow(stamp,[None if c is None else c[1] for c in cells],[None if c is None else c[2] for c in cells],
+                                     [None if c is None else c[3] for c in cells])
+            else:
+                position = self.datalog.write(ti2clog.timetext(stamp[1]) + ',{},'.format(stamp[0]) +
+                                              ','.join([',{},,,,'.format(label or '') if c is None else
+                                                        ',{},{:#7x},{:#7.3f},{},{}'.format(label or '{:#4x}'.format(c[0]),c[1],c[2],*c[3])
+                                                        for c,label in zip(cells,labels)]) +
+                                              '\n')
+                self.datalog.endrow(1,timestamp)
+                if self.index:
+                    self.index.row(timestamp,position)
+            if self.rollup:
+                for i,c in enumerate(cells):
+                    if c is not None:
+                        self.rollup.add(i,stamp[1],c[2])
+
+    def __writeblocks(self,datalog):
+        """continuous mode: write every block waiting in the sensor queues, one row per sample; returns the # of blocks written."""
+        blocks = 0
+        for i,(q,label) in enumerate(zip(self.qfileio[:self.nsensors],self.labels or [None] * self.nsensors)):   # the time stamp queues aren't used.
+            while not q.empty():
+                block = q.get()
+                if block is endmarker:
+                    self.open.discard(i)
+                    continue
+                if isinstance(block,command):
+                    continue
+                address,monotonic,wall,raw,cooked = block
+                if self.rollup:
+                    self.rollup.addblock(i,wall,cooked)
+                label = label or '{:#4x}'.format(address)
+                position = datalog.write(''.join([ti2clog.timetext(t) + ',{},,{},{:#7x},{:#7.3f}\n'.format(monotonic[j],label,raw[j],cooked[j])
+                                                  for j,t in enumerate(wall)]))
+                datalog.endrow(len(wall),wall[-1] / 1e9 if len(wall) else None)
+                self.samples[i] += len(wall)
+                if self.index and len(wall):
+                    self.index.row(wall[0] / 1e9,position,len(wall))
+                blocks += 1
+        return blocks
+
+    def __writemerged(self,writer,final=False):
+        """continuous mode, binary log: as __writeblocks, but the samples are written in time order across all sensors."""
+        # each back-end hands over its samples every blocktime, on its own schedule, so a sample is held back
+        # until every sensor has handed over what it took before it; or a second has passed, since a sensor
+        # that isn't answering hands over nothing.
+        blocks = 0
+        for i,q in enumerate(self.qfileio[:self.nsensors]):
+            while not q.empty():
+                block = q.get()
+                if block is endmarker:
+                    self.open.discard(i)
+                    continue
+                if isinstance(block,command):
+                    continue
+                address,monotonic,wall,raw,cooked = block
+                if self.rollup:
+                    self.rollup.addblock(i,wall,cooked)
+                self.pending[i].extend(zip(zip(monotonic,wall),[i] * len(wall),raw,cooked))
+                if len(monotonic):
+                    self.latest[i] = monotonic[-1]
+                blocks += 1
+        # samples are merged by the monotonic clock, which says what order they were really read in, whatever the wall clock's done.
+        if final:
+            watermark = float('inf')
+        else:
+            watermark = max(min(self.latest),time.monotonic_ns() - int(4 * sensorbackend.blocktime * 1e9))
+        ready = []
+        for i,pending in enumerate(self.pending):
+            n = 0
+            while n < len(pending) and pending[n][0][0] <= watermark:
+                n += 1
+            ready.append(pending[:n])
+            self.pending[i] = pending[n:]
+            self.samples[i] += n
+        writer.writesamples(heapq.merge(*ready))
+        return blocks
+
 class sensorglobaltrigger(object):
-    def __init__(self,triggertime,qfileio,qmsg,statwin):
-        self.triggertime = triggertime
+    # besides triggering, this thread collects the results: rather than every sensor back-end polling
+    # its own device, all devices are read together in one combined bus transaction per poll, and each
+    # back-end is handed its (raw,cooked) sample through its qsample queue.
+    # there's one trigger thread per I2C bus, since a general call only reaches the devices on its own bus.
+    # sensors behind a mux are triggered with all their channels enabled at once, so the whole bus still
+    # converts in lockstep, and read a channel at a time (see tempsensorglobal.read_status()).
+    # triggers are sent on a schedule, shared by every bus's trigger: each is due at a fixed time, and is
+    # slept for until then, not for a period at a time, so lateness doesn't add up. Each trigger's timing
+    # goes to the logger with its time stamp, and into running statistics; see ti2cclock.py.
+    def __init__(self,schedule,sensor,qsample,qfileio,control,statwin,bus=defaultbus,threaded=True):
+        self.schedule = schedule        # a ti2cclock.schedule.
+        self.timing = ti2cclock.timingstats()
+        self.bus = bus
+        self.sensor = sensor            # list of sensor objects, in the same order as qsample.
+        self.qsample = qsample
         self.qfileio = qfileio
-        self.qmsg = qmsg
+        self.control = control
         self.statwin = statwin
-        self.sensors = tempsensorglobal()
-        self.sensors.reset()
-
-        self.tgt = threading.Thread(target=self.__trigger,name='t-trig',args=())
-        self.tgt.start()
+        self.sensors = tempsensorglobal(bus,sorted(set(s.get_channel() for s in self.sensor) - {None}))
+        try:
+            retry(self.sensors.reset)
+        except OSError as error:    # the configuration below is what matters; a device that missed the reset still gets it.
+            self.statwin.message('sensorglobaltrigger: bus {} reset failed: {}.'.format(bus,error))
+        # the reset puts every device back in its power-on configuration (continuous, 12 bits). An smbus
+        # block read puts the configuration back as a side effect, since it's sent as the command byte;
+        # the combined reads don't send a command byte, so reconfigure explicitly (one-shot, not triggered).
+        # a channel at a time, to save switching the mux back & forth. A sensor that can't be configured
+        # isn't sampled: it's dropped, with its queue, and the rest carry on.
+        failed = []
+        for s in sorted(self.sensor,key=lambda s: -1 if s.get_channel() is None else s.get_channel()):
+            try:
+                retry(s.write_config_oneshot)
+            except OSError:
+                self.statwin.message('sensorglobaltrigger: sensor @ {} could not be configured; it won\'t be sampled.'.format(s.get_location()))
+                failed.append(s)
+        keep = [i for i,s in enumerate(self.sensor) if s not in failed]
+        self.sensor = [self.sensor[i] for i in keep]
+        self.qsample = [self.qsample[i] for i in keep]
+        # every sensor converts at the same time, so results are expected after the slowest conversion.
+        self.conversiontime = max([1 / s.get_samplerate() for s in self.sensor],default=0)
+        self.seq = 0                    # the last trigger's slot; every sample is tagged with the slot it's from.
+
+        # under the asyncio runtime, there's no thread; the runtime triggers & collects instead.
+        if threaded:
+            self.tgt = threading.Thread(target=self.__trigger,name='t-trig{}'.format(bus),args=())
+            self.tgt.start()
 
     def trigger(self):
-        with threading.Lock():
+        self.sensors.trigger()
+
+    def fire(self,slot):
+        """sleep until slot is due, and trigger; returns the trigger's time stamp, (monotonic,wall), & (due,actual,write)
+        timing, all in ns, for the logger; None if the trigger failed (a NACK, say), which is counted, and costs the slot."""
+        due = self.schedule.due(slot)
+        ti2cclock.sleepuntil(due)
+        before = time.monotonic_ns()
+        try:
             self.sensors.trigger()
+        except OSError:
+            self.timing.fail()
+            return None
+        stamp = ti2cclock.stamp()       # the conversions start at the end of the general call.
+        actual = stamp[0]
+        self.timing.record(due,actual,actual - before)
+        self.seq = slot
+        return stamp,(due,actual,actual - before)
+
+    def nextslot(self,slot):
+        """the slot to trigger after slot (None, just run), after the schedule's overrun policy."""
+        if slot is None:
+            return self.schedule.current()
+        slot,skipped = self.schedule.next(slot + 1)
+        if skipped:
+            self.timing.skip(skipped)
+        return slot
 
     # method will trigger all devices to convert simultaneously; min. time = 266.67mS.
-    # messages retrieved from qmsg:
-    # 'r' = run; q = end function; anythinge else = halt.
+    # commands, from its control: run, halt & quit. running, it waits on the control until ti2cclock.margin
+    # before the next trigger's due, then fire()s it on the dot; halted, until the next command. quit ends
+    # it, after the trigger in hand has been collected; the endmarkers it leaves on its queues tell the
+    # back-ends & logger there's nothing more to come.
     def __trigger(self):
-        msg = 'h'
-        tnext = time.perf_counter() + self.triggertime
+        try:
+            self.__triggerloop()
+        finally:
+            for q in self.qsample + [self.qfileio]:
+                q.putlast(endmarker)
+
+    def __triggerloop(self):
+        slot = None             # the next slot to trigger; None while halted.
         while(True):
-            if msg == 'r':
-                if tnext > time.perf_counter():
-                    time.sleep(tnext - time.perf_counter())
-                tnext += self.triggertime
-                with threading.Lock():
-                    self.sensors.trigger()
-                    self.qfileio.put(time.time())  # in a raspbian system, returns a float with fractional seconds.
-                #self.statwin.message('thread: {} triggered.'.format(threading.current_thread().name))
-            while(tnext - time.perf_counter() > 0.25 or msg != 'r'):
-                if not self.qmsg.empty():
-                    msg = self.qmsg.get()
-                    #self.statwin.message('thread: {} received {}.'.format(threading.current_thread().name,msg))
-                    if msg == 'r':
-                        tnext = time.perf_counter()
-                        break
-                    if msg == 'q': 
-                        break
-                time.sleep(0.15)
-            if msg == 'q':
+            state = self.control.take()
+            if state is command.quit:
                 break
+            if state is not command.run:
+                slot = None
+                self.control.wait()
+                continue
+            if slot is None:
+                slot = self.nextslot(None)          # run: the last slot due, straight away.
+            delay = self.schedule.due(slot) - time.monotonic_ns() - ti2cclock.margin
+            if delay > 0:
+                self.control.wait(delay / 1e9)
+                continue
+            fired = self.fire(slot)
+            if fired is not None:           # a failed trigger has nothing to collect; on to the next slot.
+                self.qfileio.put((slot,) + fired)
+                #self.statwin.message('thread: {} triggered.'.format(threading.current_thread().name))
+                self.__collect()
+            slot = self.nextslot(slot)
         #self.statwin.message('thread: {} ended.'.format(threading.current_thread().name))
         #sys.stderr.write('thread: {} ended.\n'.format(threading.current_thread().name))
         # end thread
 
+    # wait out the conversion, then read all sensors in one transaction per poll until each has
+    # reported new data. A sensor that hasn't by the time another conversion could have finished
+    # is given up on; its cell in the row is left empty, and the logger doesn't wait for it.
+    # the waits are on the control, so a halt or quit stops the collection at once, rather than
+    # after as much as two conversions.
+    def __pause(self,seconds):
+        """wait seconds, unless the trigger's halted or quit first; True if it's still running."""
+        deadline = time.perf_counter() + seconds
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return True
+            if self.control.wait(remaining) is not command.run:
+                return False
+
+    def __collect(self):
+        if not self.__pause(self.conversiontime):
+            return
+        pending = list(range(len(self.sensor)))
+        giveup = time.perf_counter() + self.conversiontime
+        while pending:
+            ready = self.sensors.read_status([self.sensor[i] for i in pending])
+            read = ti2cclock.stamp()    # when the samples were read; the trigger's stamp says when they were taken.
+            late = []
+            for i,r in zip(pending,ready):
+                if r:
+                    self.qsample[i].put((self.seq,read,self.sensor[i].get_tempraw(),self.sensor[i].get_tempcooked()))
+                else:
+                    late.append(i)
+            pending = late
+            if pending and time.perf_counter() > giveup:
+                for i in pending:
+                    self.statwin.message('sensorglobaltrigger: sensor @ {} did not respond.'.format(self.sensor[i].get_location()))
+                break
+            if pending and not self.__pause(self.conversiontime / 10):
+                break
+
+class overflowqueue(queue.Queue):
+    # a queue.Queue that does as its policy says when a put() finds it full:
+    #   'block'       - wait for room, as queue.Queue does; nothing's lost, but the thread putting is held up.
+    #   'drop-oldest' - throw away the oldest entry to make room; for the latest being what matters.
+    #   'drop-newest' - throw away the new entry; for what's already queued being what matters.
+    # either way it's counted: dropped, in samples (weight gives the # in an entry, for blocks; 1 otherwise),
+    # and waits, the # of puts that found the queue full & had to wait. A slow consumer can then cost samples,
+    # or hold up sampling, but never without anyone knowing. Commands (see control) & endmarkers are never dropped.
+    policies = ('block','drop-oldest','drop-newest')
+
+    def __init__(self,maxsize=0,policy='block',weight=None):
+        if policy not in self.policies:
+            raise ValueError('queue policy must be one of {}, not {}.'.format(', '.join(self.policies),policy))
+        super().__init__(maxsize)
+        self.policy = policy
+        self.weight = weight
+        self.dropped = 0
+        self.waits = 0
+
+    def put(self,item,block=True,timeout=None):
+        if self.policy == 'block':
+            if self.full():
+                self.waits += 1
+            return super().put(item,block,timeout)
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                if self.policy == 'drop-newest':
+                    self.dropped += self.weight(item) if self.weight else 1
+                    return
+                # the oldest sample, that is: commands & endmarkers aren't samples, and mustn't be lost.
+                i = next((i for i,old in enumerate(self.queue) if old is not endmarker and not isinstance(old,command)),None)
+                if i is not None:
+                    old = self.queue[i]
+                    del self.queue[i]
+                    self.dropped += self.weight(old) if self.weight else 1
+                    self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def waitfor(self,timeout=None):
+        """wait up to timeout seconds for there to be an entry, without taking it; True if there is."""
+        with self.not_empty:
+            return self.not_empty.wait_for(self._qsize,timeout)
+
+    def putlast(self,item=None):
+        """queue item whatever the policy, and whether there's room or not; for the endmarker, which mustn't be lost or wait."""
+        with self.not_full:
+            self._put(endmarker if item is None else item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+class samplering(object):
+    # continuous mode storage for one sensor: arrays allocated once, up front, so that collecting a
+    # sample at 240 Hz is four stores, not four list appends. The back-end appends samples as they
+    # arrive, and take()s whatever has built up since last time as a block for the logger & display.
+    # each sample's time stamp, from ti2cclock.stamp(), is kept as two arrays of int64 ns.
+    def __init__(self,size):
+        self.size = size
+        self.monotonic = array.array('q',[0]) * size
+        self.wall = array.array('q',[0]) * size
+        self.raw = array.array('l',[0]) * size
+        self.cooked = array.array('d',[0.0]) * size
+        self.head = 0               # next slot to fill.
+        self.count = 0              # # of samples since the last take().
+        self.overruns = 0           # # of samples overwritten before they were taken.
+
+    def __len__(self):
+        return self.count
+
+    def append(self,stamp,raw,cooked):
+        self.monotonic[self.head],self.wall[self.head] = stamp
+        self.raw[self.head] = raw
+        self.cooked[self.head] = cooked
+        self.head = (self.head + 1) % self.size
+        if self.count == self.size:
+            self.overruns += 1      # full: the oldest sample was just overwritten.
+        else:
+            self.count += 1
+
+    def take(self):
+        """the samples collected since the last take(), oldest first, as arrays: (monotonic,wall,raw,cooked)."""
+        start = (self.head - self.count) % self.size
+        end = start + self.count
+        if end <= self.size:
+            block = (self.monotonic[start:end],self.wall[start:end],self.raw[start:end],self.cooked[start:end])
+        else:                       # wrapped around the end of the arrays.
+            end -= self.size
+            block = (self.monotonic[start:] + self.monotonic[:end],self.wall[start:] + self.wall[:end],
+                     self.raw[start:] + self.raw[:end],self.cooked[start:] + self.cooked[:end])
+        self.count = 0
+        return block
+
 class sensorbackend(object):
     # creates a thread, retrieves data from one of up to eight i2c devices,
     # posts data to one queue for display, & a second queue for logging;
     # listens to a third for instructions on whether it should continue running.
     # note that the physical device is triggered by the global trigger thread,
     # so there's little need to start/stop the sensor back-end; to stop it from 
-    # sampling, halt the global trigger function.
-    def __init__(self,sensor,sensorno,qdisplay,qfileio,qmsg,statwin):
+    # sampling, halt the global trigger function. In one-shot mode the trigger
+    # thread also reads the device, and passes the samples in through qsample.
+    # In continuous mode there's no trigger thread; the back-end reads the device
+    # itself, at the device's own rate, and passes samples on in blocks.
+    blocktime = 0.25    # continuous mode: seconds' worth of samples per block to the logger & display.
+
+    def __init__(self,sensor,sensorno,qsample,qdisplay,qfileio,control,statwin,continuous=False,threaded=True):
         self.sensor = sensor        # an existing sensor object
         self.sensorno = sensorno
+        self.qsample = qsample
         self.qdisplay = qdisplay
         self.qfileio = qfileio
-        self.qmsg = qmsg
+        self.control = control      # continuous mode only; in one-shot mode, the trigger is run & halted instead.
         self.statwin = statwin
+        self.continuous = continuous
+        self.found = False
         
         try:
-            self.sensor.stop_sampling() # Don't let the sensor run initially, or it will fill up the queue with data!
+            retry(self.sensor.stop_sampling)    # Don't let the sensor run initially, or it will fill up the queue with data!
             self.statwin.message('sensordevice: sensor = {:#04x}; mode = {}; cfg = {:#04x}.'.format(self.sensor.address,self.sensor.mode,self.sensor.cfgbyte))
-            self.ts = threading.Thread(target=self.__sensoroneshottask,name='t-sensor{}'.format(self.sensorno),args=())
-            self.ts.start()
+            self.found = True
+            if threaded:                # the asyncio runtime polls the device, or hands on its samples, itself.
+                if self.continuous:
+                    task = self.__sensortask
+                else:
+                    task = self.__sensoroneshottask
+                self.ts = threading.Thread(target=task,name='t-sensor{}'.format(self.sensorno),args=())
+                self.ts.start()
         except:
             self.statwin.message('sensordevice: sensor @ ' + hex(self.sensor.address) + ' not found.')
        
@@ -522,56 +1322,96 @@ class sensorbackend(object):
         #    self.sensor.trigger()   # note this is not a global trigger.
         #time.sleep(0.467)           # don't return from init until initial corrupt trigger has expired.
 
+    # Continuous mode: the device converts every period on its own clock. Each read is scheduled by
+    # deadline, a little short of a period after the last new sample; a read that finds nothing new is
+    # retried an eighth of a period later. That keeps reads just behind the device's conversions,
+    # rather than drifting behind until one is lost, for one or two reads per sample. Samples go into a
+    # preallocated ring, which is handed to the logger & display as a block every blocktime seconds.
     def __sensortask(self):
-        while(True):
-            with threading.Lock():
-                if self.sensor.read_status() and self.sensor.status & 0x10: # sensor status bit 4 will be 1 if in continuous mode.
-                    raw = self.sensor.get_tempraw()
-                    cooked = self.sensor.get_tempcooked()
-                    self.qfileio.put((self.sensor.address,raw,cooked))
-                    self.qdisplay.put(raw)
-                    self.qdisplay.put(cooked)
-            time.sleep(0.8 / self.sensor.get_samplerate())
-            if self.qmsg.empty() == False:
-                msg = self.qmsg.get()
-                if msg == 'q':
+        period = 1 / self.sensor.get_samplerate()
+        ring = samplering(int(self.blocktime / period) * 4 + 16)   # room for a few blocks, in case a handoff is held up.
+        missed = 0              # conversions the device completed, but that were overwritten before being read.
+        errors = 0
+        state = command.halt    # initial state is halted; the device is stopped until the run command.
+        try:
+            while(True):
+                cmd = self.control.take()
+                if cmd is command.quit:
                     break
-                elif msg == 'r':
-                    self.sensor.start_sampling()
-                elif msg == 'h':
-                    self.sensor.stop_sampling()
-            #self.statwin.message('thread: {}\tqdisplay: {}\tqfileio: {}.'.format(threading.current_thread().name,self.qdisplay.qsize(),self.qfileio.qsize()))
+                if cmd is not state:
+                    state = cmd
+                    if state is command.run:
+                        try:
+                            retry(self.sensor.start_sampling)
+                        except OSError:     # it's read anyway: a device that missed it may still be converting; if not, it's counted.
+                            errors += 1
+                        tnext = time.perf_counter() + period
+                        thandoff = tnext + self.blocktime
+                        tlast = None
+                    else:
+                        try:
+                            self.sensor.stop_sampling()
+                        except OSError:
+                            pass
+                        self.__handoff(ring)
+                if state is command.run:
+                    now = time.perf_counter()
+                    if now >= tnext:
+                        try:
+                            ready = self.sensor.read_result()
+                        except OSError:
+                            ready = None
+                            errors += 1
+                        if ready:
+                            if tlast is not None and now - tlast > 1.5 * period:
+                                missed += int(round((now - tlast) / period)) - 1
+                            tlast = now
+                            ring.append(ti2cclock.stamp(),self.sensor.get_tempraw(),self.sensor.get_tempcooked())
+                            tnext = now + period * 7 / 8
+                        elif ready is None:
+                            tnext = now + period        # no answer; don't hammer the bus.
+                        else:
+                            tnext = now + period / 8
+                    if now >= thandoff:
+                        self.__handoff(ring)
+                        thandoff += self.blocktime
+                    delay = min(tnext,thandoff) - time.perf_counter()
+                    if delay > 0:
+                        self.control.wait(delay)
+                else:
+                    self.control.wait()
+            # quit: the last of the samples, then the endmarker, for the logger.
+            try:
+                self.sensor.stop_sampling()
+            except OSError:
+                pass
+            self.__handoff(ring)
+            if missed or errors or ring.overruns:
+                self.statwin.message('sensordevice: sensor @ {:#04x}: {} samples missed, {} read errors, {} overruns.'.format(self.sensor.address,
+                                                                                                                          missed,errors,ring.overruns))
+        finally:                # whatever happens, the logger isn't left waiting for this sensor.
+            self.qfileio.putlast(endmarker)
+
+    def __handoff(self,ring):
+        """pass the samples collected since the last handoff to the logger & display, as one block."""
+        if len(ring):
+            monotonic,wall,raw,cooked = ring.take()
+            self.qfileio.put((self.sensor.address,monotonic,wall,raw,cooked))
+            self.qdisplay.put((raw,cooked))
             
-    # The read_status method will return true only when it is not converting; will return false during conversion.
-    # For this reason, once the data is read, await a False condition before expecting new data. Rather than using
-    # some sort of message system to indicate a conversion is underway, we poll the device itself to see if a
-    # conversion has been triggered. The global trigger function above will initiate a conversion on all devices at once.
-    # initial sample is garbage; not sure why.
+    # The global trigger thread initiates a conversion on all devices at once, then reads them all
+    # together (one bus transaction instead of one per sensor), and queues each sensor's result to 
+    # its back-end. All that's left to do here is pass the sample on to the display & logger, until
+    # the trigger's endmarker, which is passed on to the logger.
     def __sensoroneshottask(self):
-        data_ready = False
-        while(not data_ready):
-            data_ready = self.sensor.read_status()
-            time.sleep(0.050)
-        triggered = False
         while(True):
-            with threading.Lock():
-                data_ready = self.sensor.read_status()
-            if not triggered and not data_ready:
-                triggered = True
-            if triggered and data_ready:
-                triggered = False
-                with threading.Lock():
-                    raw = self.sensor.get_tempraw()
-                    cooked = self.sensor.get_tempcooked()
-                    self.qfileio.put((self.sensor.address,raw,cooked))
-                    self.qdisplay.put(raw)
-                    self.qdisplay.put(cooked)
-                #self.statwin.message('thread: {}\tqdisplay: {}\tqfileio: {}.'.format(threading.current_thread().name,self.qdisplay.qsize(),self.qfileio.qsize()))
-            if self.qmsg.empty() == False:
-                msg = self.qmsg.get()
-                if msg == 'q':
-                    break
-            time.sleep(0.200) # conversion takes ~267mS, so check more frequently than that.
+            sample = self.qsample.get()
+            if sample is endmarker:
+                self.qfileio.putlast(endmarker)
+                break
+            seq,read,raw,cooked = sample
+            self.qfileio.put((self.sensor.address,seq,read,raw,cooked))
+            self.qdisplay.put(((raw,),(cooked,)))       # a block of one.
         #self.statwin.message('thread: {} ended.'.format(threading.current_thread().name))
         #sys.stderr.write('thread: {} ended.\n'.format(threading.current_thread().name))
         # end thread
@@ -579,7 +1419,7 @@ class sensorbackend(object):
 class sensorfrontend(object):
     ybuffer = 18    # need a way of determining this automagically; # of rows to exclude from window height calc.
     xsize = 12
-    def __init__(self,sensor,sensorno,displaypos,maxwindows,period,qdisplay,qmsg,statwin):
+    def __init__(self,sensor,sensorno,displaypos,maxwindows,period,qdisplay,control,statwin,threaded=True):
         # way too many parameters!!!
         self.sensor = sensor            # sensor details.
         self.sensorno = sensorno+1      # sensor number + 1 from the json config file.
@@ -588,7 +1428,8 @@ class sensorfrontend(object):
         self.period = period
         self.statwin = statwin
         self.qdisplay = qdisplay
-        self.qmsg = qmsg
+        self.control = control          # its commands come in among the blocks; quit, the display just stops.
+        self.control.attach(qdisplay)
 
         winperrow = int((curses.COLS - 2) / (self.xsize + 1))    # # of windows that can fit on a single row.
         winrows = int(self.maxwindows / winperrow)               # # of rows of sensor windows; always round up! 8/3 = 2.666, meaning 3 rows, etc.
@@ -596,6 +1437,7 @@ class sensorfrontend(object):
             winrows += 1
         winrow = int(self.displaypos/winperrow)
         self.ysize = int((curses.LINES - self.ybuffer - (winrows - 1)) / winrows) # total # of available lines
+        self.ysize = max(self.ysize,4)  # border, one line of history, & the latest value; lots of sensors need a tall terminal.
         
         yloc = 3 + int(self.displaypos/winperrow) * (self.ysize + 1) * winrow
         xloc = 1 + (self.displaypos - (winrow * winperrow)) * (self.xsize + 1)
@@ -609,9 +1451,14 @@ class sensorfrontend(object):
         self.raw = [0 for i in range(self.ysize - 3)]  # holds values for display in scrolling window
         self.cookedhist = [0 for i in range(self.ysize - 3)]  # holds values for display in scrolling window
         self.ind = 0 # raw data index.
-        
-        self.td = threading.Thread(target=self.__sensordisplaytask,name='t-disp{}'.format(self.sensorno),args=())
-        self.td.start()
+        self.cooked = 0
+        self.running = False            # halted until the run command.
+        self.ended = False
+
+        # under the asyncio runtime, there's no thread; the runtime calls drain() instead.
+        if threaded:
+            self.td = threading.Thread(target=self.__sensordisplaytask,name='t-disp{}'.format(self.sensorno),args=())
+            self.td.start()
 
         # show the window right away.
         self.windowrefresh()
@@ -642,38 +1489,307 @@ class sensorfrontend(object):
         self.displaycooked()
         self.sensorwin.noutrefresh()
 
+    def update(self,block):
+        """take one entry from qdisplay: a command, or a block of samples, added to the history if running.
+        returns whether there's anything new to show; ended is set once it's quit."""
+        if isinstance(block,command):
+            state = self.control.take()
+            self.ended = state is command.quit                  # the display just stops.
+            self.running = state is command.run
+            return False
+        if not self.running:                                    # not run == halt!
+            return False                                        # discard the block.
+        raw,cooked = block                                      # (raw values, cooked values).
+        # only the latest samples in a block fit in the window, so skip the rest:
+        for i in range(max(len(raw) - (self.ysize - 3),0),len(raw)):
+            self.raw[self.ind] = raw[i]
+            self.cookedhist[self.ind] = self.cooked             # keep a history of cooked values too.
+            self.cooked = cooked[i]
+            # advance the object's list index:        
+            self.ind += 1
+            if self.ind >= self.ysize - 3:
+                self.ind = 0
+        return True
+
+    def drain(self):
+        """asyncio runtime: update() with everything waiting in qdisplay, without waiting, and refresh once."""
+        shown = False
+        while not self.ended and not self.qdisplay.empty():
+            shown = self.update(self.qdisplay.get_nowait()) or shown
+        if shown:
+            self.windowrefresh()
+
     def __sensordisplaytask(self):
-        self.cooked = 0
-        msg = 'h'                                                   # run, but there's no data initially.
-        while(True):
-            if msg == 'r':
-                while(not self.qdisplay.empty()):
-                    with threading.Lock():
-                        self.raw[self.ind] = self.qdisplay.get()    # will block while awaiting data.
-                        self.cookedhist[self.ind] = self.cooked     # keep a history of cooked values too.
-                        self.cooked = self.qdisplay.get()
-                    # advance the object's list index:        
-                    self.ind += 1
-                    if self.ind >= self.ysize - 3:
-                        self.ind = 0
-                    if self.qdisplay.empty():                       # only refresh once, regardless of how many entries.
-                        self.windowrefresh()
-            elif msg == 'q':
-                break
-            else:   # not run == halt!
-                while(not self.qdisplay.empty()):
-                    with threading.Lock():
-                        dummy = self.qdisplay.get()                 # discard raw.
-                        dummy = self.qdisplay.get()                 # discard cooked.
-            time.sleep(0.25)
-            if not self.qmsg.empty():
-                msg = self.qmsg.get()
-
-            #self.statwin.message('thread: {}\tqdisplay: {}.'.format(threading.current_thread().name,self.qdisplay.qsize()))
+        while not self.ended:
+            if self.update(self.qdisplay.get()) and self.qdisplay.empty():   # a block of samples, or a command.
+                self.windowrefresh()                            # only refresh once, regardless of how many entries.
         #self.statwin.message('thread: {} ended.'.format(threading.current_thread().name))
         #sys.stderr.write('thread: {} ended.\n'.format(threading.current_thread().name))
         # end thread
 
+class asyncruntime(object):
+    # the asyncio runtime, an alternative to a thread per sensor back-end & display, and per bus trigger:
+    # with the 'runtime' logging key set to asyncio, they're coroutines on one event loop instead, in one
+    # thread, t-asyncio. Each bus gets a coroutine: in triggered mode, its trigger schedule, collecting the
+    # samples & handing them to the logger & display; in continuous mode, polling its sensors, all those that
+    # are due in one transaction. The displays are drawn on the loop whenever there's something new. Calls
+    # that block on the bus (all of which wait on the bus scheduler; see ti2c.py) run in a small executor,
+    # workers threads per bus. The logger keeps its thread: it waits on the card, not the bus. That's a
+    # handful of threads however many sensors there are, not 2N+3: the loop, its executor, the logger, the
+    # clock, and a bus scheduler per bus.
+    # the coroutines take their commands from the same controls as the threads (see control.notify()), and
+    # put to the same queues, so the logger, the queue policies and the statistics are none the wiser.
+    workers = 2         # executor threads for blocking bus calls, per bus.
+
+    def __init__(self,settings):
+        self.settings = settings            # the appconfig, with its framework generated, but not started.
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers * len(settings.buses),thread_name_prefix='t-aio')
+        self.events = {}                    # an asyncio.Event per control, set when it's sent a command.
+        self.redraw = None                  # set when a display has something new, or a command.
+        displays = [sd.control for sd in settings.sensordisp]
+        for c in settings.control:
+            c.notify(lambda cmd,c=c : self.__notify(self.__wake,c))
+        for c in displays:
+            c.notify(lambda cmd : self.__notify(self.__draw))
+
+        self.thread = threading.Thread(target=self.__run,name='t-asyncio',args=())
+        self.thread.start()
+
+    def __notify(self,callback,*args):
+        """from any thread: run callback on the loop, unless it's finished."""
+        try:
+            self.loop.call_soon_threadsafe(callback,*args)
+        except RuntimeError:                # the loop's closed; there's nothing left to tell.
+            pass
+
+    def __wake(self,control):
+        if control in self.events:
+            self.events[control].set()
+
+    def __draw(self):
+        if self.redraw is not None:
+            self.redraw.set()
+
+    def __run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.__main())
+        finally:
+            self.executor.shutdown()
+            self.loop.close()
+
+    async def __main(self):
+        s = self.settings
+        self.events = {c : asyncio.Event() for c in s.control}
+        self.redraw = asyncio.Event()
+        tasks = [self.__displays()]
+        if s.continuous:
+            for bus in s.buses:
+                bs = [b for b in s.sensorread if b.found and b.sensor.get_bus() == bus]
+                if bs:
+                    event = asyncio.Event()             # one for the bus: any of its back-ends' commands wakes its poller.
+                    for b in bs:
+                        self.events[b.control] = event
+                    tasks.append(self.__poll(bs))
+        else:
+            for t in s.trigger:
+                tasks.append(self.__trigger(t,[s.sensor.index(sensor) for sensor in t.sensor]))
+        for error in await asyncio.gather(*tasks,return_exceptions=True):
+            if isinstance(error,Exception):
+                s.statwin.message('asyncruntime: {}: {}'.format(type(error).__name__,error))
+
+    async def __call(self,function,*args):
+        """call function, which blocks on the bus, in the executor."""
+        return await self.loop.run_in_executor(self.executor,function,*args)
+
+    def __take(self,controls):
+        """take() every one of controls (which are sent the same commands); quit if any of them has been sent it."""
+        states = [c.take() for c in controls]
+        return command.quit if command.quit in states else states[0]
+
+    async def __wait(self,controls,timeout=None):
+        """the coroutine version of control.wait(), for a control, or a list of controls sharing an event: wait up to
+        timeout seconds (None, for ever) for a command."""
+        if isinstance(controls,control):
+            controls = [controls]
+        event = self.events[controls[0]]
+        event.clear()
+        if any(c.pending() for c in controls):
+            return
+        try:
+            await asyncio.wait_for(event.wait(),timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def __put(self,q,item):
+        """put item on overflowqueue q; a 'block' queue that's full is waited on in the executor, not on the loop."""
+        if q.policy == 'block' and q.full():
+            await self.loop.run_in_executor(self.executor,q.put,item)
+        else:
+            q.put(item)
+
+    def __show(self,i,block):
+        """hand sensor i's display a block of samples; it's drawn once the loop gets round to it."""
+        self.settings.qdisplay[i].put(block)
+        self.redraw.set()
+
+    async def __displays(self):
+        """draw the displays whenever there's something new, until they've all quit."""
+        displays = self.settings.sensordisp
+        while not all(sd.ended for sd in displays):
+            await self.redraw.wait()
+            self.redraw.clear()
+            for sd in displays:
+                sd.drain()
+
+    # triggered mode: as sensorglobaltrigger's thread, for the sensors onbus (their #s) on trigger t's bus,
+    # but each sample goes to the logger & display here; there are no one-shot back-ends to hand it on.
+    async def __trigger(self,t,onbus):
+        try:
+            await self.__triggerloop(t,onbus)
+        finally:
+            for q in [self.settings.qfileio[i] for i in onbus] + [t.qfileio]:
+                q.putlast(endmarker)
+
+    async def __triggerloop(self,t,onbus):
+        slot = None             # the next slot to trigger; None while halted.
+        while True:
+            state = t.control.take()
+            if state is command.quit:
+                break
+            if state is not command.run:
+                slot = None
+                await self.__wait(t.control)
+                continue
+            if slot is None:
+                slot = t.nextslot(None)
+            delay = t.schedule.due(slot) - time.monotonic_ns() - ti2cclock.margin
+            if delay > 0:
+                await self.__wait(t.control,delay / 1e9)
+                continue
+            # the last of the wait, & the trigger, in the executor: the loop can't sleep to the ns.
+            fired = await self.__call(t.fire,slot)
+            if fired is not None:       # a NACKed trigger costs its slot, not the run; see fire().
+                await self.__put(t.qfileio,(slot,) + fired)
+                await self.__collect(t,onbus)
+            slot = t.nextslot(slot)
+
+    async def __pause(self,c,seconds):
+        """wait seconds on control c, unless it's halted or quit first; True if it's still running."""
+        deadline = time.perf_counter() + seconds
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return True
+            await self.__wait(c,remaining)
+            if c.take() is not command.run:
+                return False
+
+    # the waits are on the trigger's control, as in sensorglobaltrigger's thread: a halt or quit stops collecting at once.
+    async def __collect(self,t,onbus):
+        if not await self.__pause(t.control,t.conversiontime):
+            return
+        pending = list(range(len(t.sensor)))
+        giveup = time.perf_counter() + t.conversiontime
+        while pending:
+            ready = await self.__call(t.sensors.read_status,[t.sensor[i] for i in pending])
+            read = ti2cclock.stamp()
+            late = []
+            for i,r in zip(pending,ready):
+                if r:
+                    raw,cooked = t.sensor[i].get_tempraw(),t.sensor[i].get_tempcooked()
+                    await self.__put(self.settings.qfileio[onbus[i]],(t.sensor[i].address,t.seq,read,raw,cooked))
+                    self.__show(onbus[i],((raw,),(cooked,)))
+                else:
+                    late.append(i)
+            pending = late
+            if pending and time.perf_counter() > giveup:
+                for i in pending:
+                    t.statwin.message('sensorglobaltrigger: sensor @ {} did not respond.'.format(t.sensor[i].get_location()))
+                break
+            if pending and not await self.__pause(t.control,t.conversiontime / 10):
+                break
+
+    # continuous mode: as sensorbackend's thread, for all the back-ends on one bus (bs) at once, rather than a
+    # coroutine each: whichever sensors are due are read together, in one combined transaction (a mux channel
+    # at a time; see tempsensorglobal.read_status()), and handed off together every blocktime.
+    async def __poll(self,bs):
+        controls = [b.control for b in bs]
+        reader = tempsensorglobal(bs[0].sensor.get_bus(),sorted(set(b.sensor.get_channel() for b in bs) - {None}))
+        period = [1 / b.sensor.get_samplerate() for b in bs]
+        rings = [samplering(int(b.blocktime / p) * 4 + 16) for b,p in zip(bs,period)]
+        missed = [0] * len(bs)
+        errors = [0] * len(bs)
+        state = command.halt
+        while True:
+            cmd = self.__take(controls)
+            if cmd is command.quit:
+                break
+            if cmd is not state:
+                state = cmd
+                if state is command.run:
+                    for i,b in enumerate(bs):
+                        try:
+                            await self.__call(b.sensor.start_sampling)
+                        except OSError:
+                            errors[i] += 1
+                    tnext = [time.perf_counter() + p for p in period]
+                    thandoff = min(tnext) + bs[0].blocktime
+                    tlast = [None] * len(bs)
+                else:
+                    await self.__stop(bs)
+                    await self.__handoff(bs,rings)
+            if state is command.run:
+                now = time.perf_counter()
+                due = [i for i in range(len(bs)) if now >= tnext[i]]
+                if due:
+                    ready = await self.__call(reader.read_status,[bs[i].sensor for i in due])
+                    read = ti2cclock.stamp()
+                    for i,r in zip(due,ready):
+                        if r:
+                            if tlast[i] is not None and now - tlast[i] > 1.5 * period[i]:
+                                missed[i] += int(round((now - tlast[i]) / period[i])) - 1
+                            tlast[i] = now
+                            rings[i].append(read,bs[i].sensor.get_tempraw(),bs[i].sensor.get_tempcooked())
+                            tnext[i] = now + period[i] * 7 / 8
+                        elif r is None:
+                            errors[i] += 1
+                            tnext[i] = now + period[i]      # no answer; don't hammer the bus.
+                        else:
+                            tnext[i] = now + period[i] / 8
+                if now >= thandoff:
+                    await self.__handoff(bs,rings)
+                    thandoff += bs[0].blocktime
+                delay = min(tnext + [thandoff]) - time.perf_counter()
+                if delay > 0:
+                    await self.__wait(controls,delay)
+            else:
+                await self.__wait(controls)
+        # quit: the last of the samples, then the endmarkers, for the logger.
+        await self.__stop(bs)
+        await self.__handoff(bs,rings)
+        for i,b in enumerate(bs):
+            b.qfileio.putlast(endmarker)
+            if missed[i] or errors[i] or rings[i].overruns:
+                b.statwin.message('sensordevice: sensor @ {:#04x}: {} samples missed, {} read errors, {} overruns.'.format(b.sensor.address,
+                                                                                                                       missed[i],errors[i],rings[i].overruns))
+
+    async def __stop(self,bs):
+        for b in bs:
+            try:
+                await self.__call(b.sensor.stop_sampling)
+            except OSError:
+                pass
+
+    async def __handoff(self,bs,rings):
+        """pass the samples each back-end's collected since the last handoff to its logger & display queues, as one block."""
+        for b,ring in zip(bs,rings):
+            if len(ring):
+                monotonic,wall,raw,cooked = ring.take()
+                await self.__put(b.qfileio,(b.sensor.address,monotonic,wall,raw,cooked))
+                self.__show(b.sensorno,(raw,cooked))
+
 class mainwindow(object):
     appname = ' Sigma Delta ADC Analyser & Logger '
     copyright = ' (c)2020 - J-Tech Engineering, Ltd. '
@@ -725,26 +1841,43 @@ class mainwindow(object):
         self.stdscr.addstr(curses.LINES - 5 - 2,1,'stop time:  {}'.format(self.settings.sensorcfg['logging']['stop time']))
         
         # note the datalogger object fills in the date & time for the log file when it's opened; so just give the concept of the file name:
-        logfileinfo = str('log file: {}/{}yyyymmddhhmmss.csv'.format(self.settings.sensorcfg['logging']['logloc'],
-                                                                     self.settings.sensorcfg['logging']['logfile'])).rjust(curses.COLS - 34)
-        sampleperiodinfo = str('sample period: {} s'.format(self.settings.sensorcfg['logging']['sample period'])).rjust(curses.COLS - 34)
+        if self.settings.sensorcfg['logging'].get('logformat') == 'sqlite':     # one database for every run.
+            logfileinfo = str('database: {}/{}{}'.format(self.settings.sensorcfg['logging']['logloc'],
+                                                         self.settings.sensorcfg['logging']['logfile'],
+                                                         ti2cdb.extension)).rjust(curses.COLS - 34)
+        else:
+            logfileinfo = str('log file: {}/{}yyyymmddhhmmss{}'.format(self.settings.sensorcfg['logging']['logloc'],
+                                                                       self.settings.sensorcfg['logging']['logfile'],
+                                                                       datalogger.writers.get(self.settings.sensorcfg['logging'].get('logformat'),
+                                                                                              ('.csv',))[0])).rjust(curses.COLS - 34)
+        if self.settings.sensorcfg['logging'].get('acquisition') == 'continuous':
+            sampleperiodinfo = 'sample period: continuous'.rjust(curses.COLS - 34)
+        else:
+            sampleperiodinfo = str('sample period: {} s'.format(self.settings.sensorcfg['logging']['sample period'])).rjust(curses.COLS - 34)
         self.stdscr.addstr(curses.LINES - 5 - 4,33,sampleperiodinfo)
         self.stdscr.addstr(curses.LINES - 5 - 2,33,logfileinfo)
 
         # display each sensor's configured state; note i is the sequence of defined sensors, and not neccessarily contiguous:
         j=0 # Use j to correctly locate the sensor configuration blocks: left-justified, no gaps!
-        for i in sorted(self.settings.sensorcfg['sensors']):
+        for i in sorted(self.settings.sensorcfg['sensors'],key=int):
             if self.settings.sensorcfg['sensors'][i]['address'] != -1 and int(j+1)*13 < curses.COLS-2:
                 self.stdscr.addstr(curses.LINES - 15,2 + 13 * int(j),
                                    '~sensor #{}~'.format(int(i)+1),curses.A_BOLD)
+                where = location(self.settings.sensorcfg['sensors'][i].get('bus',defaultbus),
+                                 self.settings.sensorcfg['sensors'][i]['address'],
+                                 self.settings.sensorcfg['sensors'][i].get('channel'))
                 self.stdscr.addstr(curses.LINES - 14,2 + 13 * int(j),
-                                   'addr: {:#05x}'.format(self.settings.sensorcfg['sensors'][i]['address']))
+                                   'addr: {}'.format(where) if len(where) < 7 else where)    # columns are 13 wide.
                 self.stdscr.addstr(curses.LINES - 13,2 + 13 * int(j),
                                    'sr: {} bits'.format(tempsensor.mcp3421[self.settings.sensorcfg['sensors'][i]['modeind']][0]))
-                self.stdscr.addstr(curses.LINES - 12,2 + 13 * int(j),
-                                   'm: {:#3.6f}'.format(self.settings.sensorcfg['sensors'][i]['slope']))
-                self.stdscr.addstr(curses.LINES - 11,2 + 13 * int(j),
-                                   'b: {:#5.5f}'.format(self.settings.sensorcfg['sensors'][i]['intercept']))
+                if self.settings.sensorcfg['sensors'][i].get('calibration'):
+                    self.stdscr.addstr(curses.LINES - 12,2 + 13 * int(j),
+                                       'cal: {}'.format(self.settings.sensorcfg['sensors'][i]['calibration'].get('type')))
+                else:
+                    self.stdscr.addstr(curses.LINES - 12,2 + 13 * int(j),
+                                       'm: {:#3.6f}'.format(self.settings.sensorcfg['sensors'][i]['slope']))
+                    self.stdscr.addstr(curses.LINES - 11,2 + 13 * int(j),
+                                       'b: {:#5.5f}'.format(self.settings.sensorcfg['sensors'][i]['intercept']))
                 j+=1
     
     def centremessage(self,verbiage):
@@ -844,6 +1977,9 @@ class menu(object):
         self.y = 2                                                                  # always right below the menu line at the top of the window.
         self.x = 1 + (1 + self.menuwidth) * self.menunum
         self.statwin = statwin
+        # with several buses, there can be more sensors than lines on the screen; the menu scrolls.
+        self.height = max(min(self.itemcount,curses.LINES - self.y - 1),1)
+        self.top = 0                                                                # first item shown.
 
     def __nav(self,delta):
         if delta >= ord('0') and delta <= ord('9'):
@@ -856,7 +1992,7 @@ class menu(object):
             self.selection = self.itemcount - 1
 
     def display(self):
-        ddmenu = curses.newwin(self.itemcount,self.menuwidth,self.y,self.x)
+        ddmenu = curses.newwin(self.height,self.menuwidth,self.y,self.x)
         ddmenu.bkgd(' ',curses.color_pair(2))
         ddmenu.keypad(True)
         
@@ -864,12 +2000,17 @@ class menu(object):
         
         key = curses.ERR
         while True:
-            for i,choice in enumerate(self.choices):
-                if i == self.selection:
+            if self.selection < self.top:
+                self.top = self.selection
+            elif self.selection >= self.top + self.height:
+                self.top = self.selection - self.height + 1
+            ddmenu.erase()
+            for i,choice in enumerate(self.choices[self.top:self.top + self.height]):
+                if i + self.top == self.selection:
                     textattr = curses.color_pair(3)
                 else:
                     textattr = curses.color_pair(2)
-                ddmenu.addstr(i,1,choice,textattr)
+                ddmenu.addstr(i,1,choice[:self.menuwidth - 2],textattr)
             ddmenu.noutrefresh()
             curses.doupdate()
 
@@ -962,9 +2103,10 @@ class single_item_entry(object):
 class sensorcfgwin(object):
     instructions = ' tab to move between fields; arrows to choose; n|p to switch sensor '
     pendingaction = ('save','next','prev')
-    maxsensors = 8
+    taborder = (0,7,8,1,4,5,6)  # editable fields, in tab order; the bus & mux channel follow the address.
+    channels = [None] + list(range(muxchannels))    # mux channel choices; None is straight on the bus.
     
-    def __init__(self,sensor,sensorno,statwin):
+    def __init__(self,sensor,sensorno,statwin,buses=[defaultbus]):
         self.ycfg = 10
         if curses.COLS > 79:
             self.xcfg = 78
@@ -975,12 +2117,17 @@ class sensorcfgwin(object):
         #self.sensors = sensor # dictionary corresponding to all sensors.
         #self.sensor = self.sensors[str(self.sensorno)]
         self.sensor = sensor
+        self.sensor.setdefault('bus',defaultbus)    # configurations from before there was a choice.
+        self.sensor.setdefault('channel',None)
+        self.buses = buses          # the I2C buses the sensor can be on.
         #self.__banner()
         self.banner = ' sensor #' + str(self.sensorno + 1) + ' configuration '
         self.statwin = statwin
 
         self.nefld = ((0,int((self.xcfg - len(self.banner))/2),self.banner),
                       (1,2,'address:'),
+                      (1,24,'bus:'),
+                      (1,36,'mux:'),
                       (3,2,'mode (0..3):'),
                       (4,2,'resolution:       bits'),
                       (5,2,'max. rate:          Hz'),
@@ -996,7 +2143,9 @@ class sensorcfgwin(object):
                      (5,16,'     ',curses.color_pair(2)),
                      (7,16,'  ',curses.color_pair(3)),
                      (5,int(self.xcfg/2)+12,'               ',curses.color_pair(3)),
-                     (7,int(self.xcfg/2)+12,'               ',curses.color_pair(3)))
+                     (7,int(self.xcfg/2)+12,'               ',curses.color_pair(3)),
+                     (1,29,'   ',curses.color_pair(3)),
+                     (1,41,'  ',curses.color_pair(3)))
 
         # instantiate a curses window object
         self.child = curses.newwin(self.ycfg,self.xcfg,3,int((curses.COLS - self.xcfg)/2))
@@ -1030,7 +2179,9 @@ class sensorcfgwin(object):
                           str(tempsensor.mcp3421[self.sensor['modeind']][1]),
                           tempsensor.unit[self.sensor['units']],
                           str(self.sensor['slope']).ljust(15),
-                          str(self.sensor['intercept']).ljust(15)]
+                          str(self.sensor['intercept']).ljust(15),
+                          str(self.sensor['bus']).ljust(3),
+                          '--' if self.sensor['channel'] is None else str(self.sensor['channel']).ljust(2)]
         # invert the colours on the active one:
         for i in range(len(fieldvalue)):
             if i == field:
@@ -1053,17 +2204,9 @@ class sensorcfgwin(object):
         elif userinput == curses.KEY_DOWN:
              delta = -1
         elif userinput == curses.KEY_BTAB:
-            newfield -= 1
-            if newfield < 0:
-                newfield = len(self.efld) - 1
-            if newfield == 3:
-                newfield = 1
+            newfield = self.taborder[self.taborder.index(newfield) - 1]
         elif userinput == ord('\x09'):      # curses.KEY_TAB? Weird that this isn't in curses.
-            newfield += 1
-            if newfield > len(self.efld) - 1:
-                newfield = 0
-            if newfield == 2:
-                newfield = 4
+            newfield = self.taborder[(self.taborder.index(newfield) + 1) % len(self.taborder)]
         elif userinput in [curses.KEY_ENTER, ord('\n'),0x1b]:
             newfield = -1                 # if the returned field is -1, save & exit.
         elif userinput in [ord('n'),ord('N')]:  # save & exit, but return a notification that thenext sensor should be loaded.
@@ -1082,7 +2225,7 @@ class sensorcfgwin(object):
         editwindowobject = curses.newwin(1,15,3 + self.efld[field][0],int((curses.COLS - self.xcfg)/2) + self.efld[field][1])
         editwindowobject.bkgd(' ',curses.color_pair(3))
         valuewin = curses.textpad.Textbox(editwindowobject)
-        if field == len(self.efld)-2:
+        if field == 5:
             floatvalue = self.sensor['slope']
         else:
             floatvalue = self.sensor['intercept']
@@ -1101,7 +2244,7 @@ class sensorcfgwin(object):
                 editwindowobject.clear()
                 break
             except:
-                if field == len(self.efld)-2:
+                if field == 5:
                     floatvalue = self.sensor['slope']
                 else:
                     floatvalue = self.sensor['intercept']
@@ -1185,6 +2328,18 @@ class sensorcfgwin(object):
                     self.__updatewin(field)     # fill in the editable fields.
                     intercept = self.__textfieldinput(field)
                     self.sensor['intercept'] = intercept
+                elif field == 7:        # bus
+                    if self.sensor['bus'] in self.buses:
+                        busind = self.buses.index(self.sensor['bus'])
+                    else:
+                        busind = 0
+                    self.sensor['bus'] = self.buses[(busind + delta) % len(self.buses)]
+                elif field == 8:        # mux channel
+                    if self.sensor['channel'] in self.channels:
+                        chind = self.channels.index(self.sensor['channel'])
+                    else:
+                        chind = 0
+                    self.sensor['channel'] = self.channels[(chind + delta) % len(self.channels)]
                 elif field in [-1,-2,-3]:
                     nextmove = self.pendingaction[-field - 1]
                     break
@@ -1315,11 +2470,13 @@ def main(stdscr):
            
             # add addresses of configured sensors to the menu.
             menu_items = []
-            for i in sorted(settings.sensorcfg['sensors']):
+            for i in sorted(settings.sensorcfg['sensors'],key=int):
                 if settings.sensorcfg['sensors'][i]['address'] == -1:
                     menu_items.append('sensor #{}'.format(int(i)+1))
                 else:
-                    menu_items.append('sensor #{} - {:#04x}'.format(int(i)+1,settings.sensorcfg['sensors'][i]['address']))
+                    menu_items.append('sensor #{} - {}'.format(int(i)+1,location(settings.sensorcfg['sensors'][i].get('bus',defaultbus),
+                                                                                 settings.sensorcfg['sensors'][i]['address'],
+                                                                                 settings.sensorcfg['sensors'][i].get('channel'))))
 
             sensorsel = menu(ddmenu,menu_items,statwin)
             selection = sensorsel.display()
@@ -1335,11 +2492,12 @@ def main(stdscr):
                         collectdata = False
                         Collectionalarm = False             # don't restart if operation occurs during scheduled sampling.
                         settings.endsensorframework()       # wipe out all threads & queues; save & close the log file.
-                    configwindow = sensorcfgwin(settings.sensorcfg['sensors'][str(selection)],selection,statwin)
+                    configwindow = sensorcfgwin(settings.sensorcfg['sensors'][str(selection)],selection,statwin,settings.buses())
                     settings.sensorcfg['sensors'][str(selection)],action = configwindow.gensetup()     # load the sensor config values
                    
                     if settings.checksensor(settings.sensorcfg['sensors'][str(selection)]) == True:    # meaning the sensor responded.
                         settings.save(settings.sensorcfg)       # update the config file.
+                        settings.compileprofiles()              # the mode may have changed.
                         statwin.message('sensor #' + str(selection + 1) + ' configured.')
                     else:
                         settings.load()                     # reload the sensor values from file.
@@ -1350,12 +2508,12 @@ def main(stdscr):
 
                     if action == 'next':
                         selection += 1
-                        if selection > sensorcfgwin.maxsensors - 1:
+                        if selection > len(settings.sensorcfg['sensors']) - 1:
                             selection = 0
                     elif action == 'prev':
                         selection -= 1
                         if selection < 0:
-                            selection = sensorcfgwin.maxsensors - 1
+                            selection = len(settings.sensorcfg['sensors']) - 1
                 else:
                     action = 'save' # should really be 'abort'
                     statwin.message('operation cancelled.')
@@ -1380,7 +2538,11 @@ def main(stdscr):
                 settings.pausedisplayupdates()
             ddmenu = 1
             ddmenuheading.refreshmenu(ddmenu)
-            menu_items = ['start time','stop time','sample period (sec)','log file prefix','log file location']
+            menu_items = ['start time','stop time','sample period (sec)','log file prefix','log file location','continuous mode','I2C buses','log format',
+                          'flush policy','log rotation','compression']
+            if settings.sensorcfg['logging'].get('acquisition') == 'continuous':
+                menu_items[5] += ' *'
+            menu_items[7] += ': ' + settings.sensorcfg['logging'].get('logformat','csv')
             logsel = menu(ddmenu,menu_items,statwin)
             selection = logsel.display()
             del logsel
@@ -1450,6 +2612,86 @@ def main(stdscr):
                     userinput = single_item_entry(' ' + menu_items[selection] + ' ',logloc,statwin)
                     logloc = userinput.get_userinput()
                     settings.createlogdir(logloc)
+                elif selection == 5:    # continuous mode on/off; no entry window.
+                    if settings.sensorcfg['logging'].get('acquisition') == 'continuous':
+                        settings.sensorcfg['logging']['acquisition'] = 'triggered'
+                        statwin.message('continuous mode off: sensors are triggered together every sample period.')
+                    else:
+                        settings.sensorcfg['logging']['acquisition'] = 'continuous'
+                        statwin.message('continuous mode on: each sensor samples at its own rate.')
+                    settings.save(settings.sensorcfg)
+                    if collectdata == True:
+                        statwin.message('the change takes effect when sampling restarts.')
+                    userinput = None
+                elif selection == 6:    # I2C buses in use, e.g. 1,3
+                    while(True):
+                        userinput = single_item_entry(' ' + menu_items[selection] + ' ',','.join(str(b) for b in settings.buses()),statwin)
+                        entry = userinput.get_userinput()
+                        try:
+                            buses = sorted(set(int(b) for b in entry.split(',')))
+                            if len(buses) == 0 or buses[0] < 0:
+                                raise ValueError
+                            for s in settings.setbuses(buses):
+                                statwin.message('sensor #{} was on a bus no longer in use; disabled.'.format(s + 1))
+                            statwin.message('I2C buses: {}; {} sensor slots.'.format(','.join(str(b) for b in buses),len(settings.sensorcfg['sensors'])))
+                            if collectdata == True:
+                                statwin.message('the change takes effect when sampling restarts.')
+                            break
+                        except ValueError:
+                            statwin.message('invalid bus list: ->'+entry+'<-; enter bus numbers separated by commas.')
+                elif selection == 7:    # log format; steps through datalogger.logformats. no entry window.
+                    formats = datalogger.logformats
+                    current = settings.sensorcfg['logging'].get('logformat','csv')
+                    logformat = formats[(formats.index(current) + 1) % len(formats) if current in formats else 0]   # an unknown one steps to csv.
+                    settings.sensorcfg['logging']['logformat'] = logformat
+                    statwin.message({'csv' : 'log format csv.',
+                                     'binary' : 'log format binary: samples are logged as fixed width records; see ti2clog.py.',
+                                     'compact' : 'log format compact: only the changes in time & raw data are logged; see ti2ccodec.py.',
+                                     'sqlite' : 'log format sqlite: samples go in the database {}{}; see ti2cdb.py.'.format(
+                                                settings.sensorcfg['logging']['logfile'],ti2cdb.extension)}[logformat])
+                    settings.save(settings.sensorcfg)
+                    if collectdata == True:
+                        statwin.message('the change takes effect when sampling restarts.')
+                    userinput = None
+                elif selection == 8:    # flush policy, e.g. seconds:5
+                    while(True):
+                        userinput = single_item_entry(' ' + menu_items[selection] + ' ',
+                                                      settings.sensorcfg['logging'].get('flush policy',ti2clog.defaultflushpolicy),statwin)
+                        entry = userinput.get_userinput()
+                        try:
+                            ti2clog.parseflushpolicy(entry)
+                            settings.sensorcfg['logging']['flush policy'] = entry.strip()
+                            settings.save(settings.sensorcfg)
+                            statwin.message('flush policy: {}.'.format(entry.strip()))
+                            if collectdata == True:
+                                statwin.message('the change takes effect when sampling restarts.')
+                            break
+                        except ValueError:
+                            statwin.message('invalid flush policy: ->'+entry+'<-; enter rows:<n>, seconds:<t> or shutdown.')
+                elif selection == 9:    # log rotation, e.g. hours:24
+                    while(True):
+                        userinput = single_item_entry(' ' + menu_items[selection] + ' ',
+                                                      settings.sensorcfg['logging'].get('rotation',ti2clog.defaultrotation),statwin)
+                        entry = userinput.get_userinput()
+                        try:
+                            ti2clog.parserotation(entry)
+                            settings.sensorcfg['logging']['rotation'] = entry.strip()
+                            settings.save(settings.sensorcfg)
+                            statwin.message('log rotation: {}.'.format(entry.strip()))
+                            if collectdata == True:
+                                statwin.message('the change takes effect when sampling restarts.')
+                            break
+                        except ValueError:
+                            statwin.message('invalid log rotation: ->'+entry+'<-; enter none, size:<MB> or hours:<h>.')
+                elif selection == 10:   # compression of closed segments; steps through none, gzip & lzma. no entry window.
+                    methods = list(ti2clog.compressions)
+                    method = methods[(methods.index(settings.sensorcfg['logging'].get('compression','none')) + 1) % len(methods)]
+                    settings.sensorcfg['logging']['compression'] = method
+                    settings.save(settings.sensorcfg)
+                    statwin.message('compression of closed log segments: {}.'.format(method))
+                    if collectdata == True:
+                        statwin.message('the change takes effect when sampling restarts.')
+                    userinput = None
                 del userinput
             else:
                 statwin.message('operation cancelled.')
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+# jtquery.py - read back csv logs written by jtlog & jtlogc, for sensors
+#              supplied by J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+# licensing & permissions {{{
+# jtquery.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# }}}
+# grandiose description {{{
+# jtlog & jtlogc lay their csv logs out differently; jtlog writes the row's time stamps
+# (older logs have none), then a column per sensor under a row of addresses, jtlogc a
+# time stamp, then address, raw & temperature for each sensor. This reads either
+# (ti2clog.csvsamples() works out which), picks out sensors & a time range, thins the
+# samples out, and writes them as csv or as json, one sample per line:
+#
+#   every <n>       - every nth sample from each sensor.
+#   bucket <t>      - the count, mean, min & max of each sensor's samples in each t
+#                     seconds, counted from the epoch (so 60 is on the minute); of the
+#                     temperatures, or the raw data if the log has no temperatures.
+#
+# It's all generators: one row of the log in memory at a time, and a bucket per sensor,
+# so a log of any size can be queried, and the output piped on as it comes. Logs named
+# on the command line are read in the order given; name a log's segments in order, and
+# they're read as one.
+# }}}
+# modules {{{
+import sys,os,getopt
+import re
+import time
+import json
+
+import ti2clog
+# }}}
+# functions {{{1
+# showhelp {{{2
+def showhelp():
+    print(sys.argv[0],' -h [-s <sensor>] [-f <time>] [-t <time>] [-n <n> | -w <seconds>] [-j] <log file> [<log file> ...]\n')
+    print('-h,--help\n\tdisplay this message.\n')
+    print('-s<sensor>,--sensor=<sensor>\n\tOnly the sensor labelled <sensor> in the log, e.g. 0x68, or 3:0x69 for a sensor on')
+    print('\tbus 3; use one -s per sensor, or separate them with commas. Default all.\n')
+    print('-f<time>,--from=<time>\n\tSamples from <time> on: yyyy/mm/dd hh:mm:ss[.nnnnnnnnn] (or any other separators, e.g.')
+    print('\tyyyy:mm:dd:hh:mm:ss), local time; trailing fields can be left out. Or seconds')
+    print('\tsince the epoch. Default the start of the log.\n')
+    print('-t<time>,--to=<time>\n\tSamples up to, but not including, <time>; as -f. Default the end of the log.\n')
+    print('-n<n>,--every=<n>\n\tEvery <n>th sample from each sensor.\n')
+    print('-w<seconds>,--bucket=<seconds>\n\tThe count, mean, min & max of each sensor\'s samples in every <seconds>.\n')
+    print('-j,--json\n\tWrite json, one object per line, rather than csv.\n')
+# }}}
+# parse_time {{{2
+def parse_seconds(text):
+    '''int ns, from seconds with a fraction to the ns, e.g. 1600000000.123456789; the fraction is read as digits, not a
+    float, which can't hold the ns of a time since the epoch:'''
+    match = re.fullmatch('\\s*([-+]?)([0-9]*)(?:\\.([0-9]*))?\\s*',text)
+    if match is None or not (match.group(2) or match.group(3)):
+        return ti2clog.ns(float(text))  # 1.6e9 and the like; or a ValueError.
+    sign,whole,fraction = match.groups()
+    t = int(whole or '0') * 1000000000 + int(((fraction or '') + '000000000')[:9])
+    return -t if sign == '-' else t
+
+def parse_time(text):
+    '''ns since the epoch, from a local date & time, or seconds since the epoch:'''
+    try:
+        return parse_seconds(text)
+    except (ValueError,OverflowError):
+        pass
+    fields = [f for f in re.split('[^0-9.]+',text) if f]
+    if len(fields) < 1 or len(fields) > 6:
+        raise ValueError('can\'t make a time of {}.'.format(text))
+    fields += ['1','1','0','0','0'][len(fields) - 1:]
+    seconds = parse_seconds(fields[5])
+    t = time.mktime((int(fields[0]),int(fields[1]),int(fields[2]),int(fields[3]),int(fields[4]),seconds // 1000000000,0,0,-1))
+    return int(t) * 1000000000 + seconds % 1000000000
+# }}}
+# format_time {{{2
+def format_time(t):
+    '''ns since the epoch, as the logs' time stamps: yyyy/mm/dd hh:mm:ss.nnnnnnnnn'''
+    return ti2clog.timetext(t)
+# }}}
+# samples {{{2
+def samples(lognames,start,stop,labels):
+    '''(time ns,label,raw,temp) from each log in turn:'''
+    for logname in lognames:
+        for sample in ti2clog.csvsamples(logname,start,stop,labels):
+            yield sample
+# }}}
+# every_nth {{{2
+def every_nth(samples,n):
+    '''every nth sample from each sensor, starting with the first:'''
+    counts = {}
+    for sample in samples:
+        count = counts.get(sample[1],0)
+        counts[sample[1]] = count + 1
+        if count % n == 0:
+            yield sample
+# }}}
+# buckets {{{2
+def buckets(samples,width):
+    '''(bucket start ns,label,count,mean,min,max) for each sensor's samples in each width seconds:'''
+    width = ti2clog.ns(width)
+    open_buckets = {}                   # label: [bucket start,count,sum,min,max]
+    for t,label,raw,temp in samples:
+        value = raw if temp is None else temp
+        if value is None:
+            continue
+        start = t - t % width
+        b = open_buckets.get(label)
+        if b is not None and b[0] != start:
+            yield b[0],label,b[1],b[2] / b[1],b[3],b[4]     # the sensor's moved on; its last bucket is done.
+            b = None
+        if b is None:
+            open_buckets[label] = [start,1,value,value,value]
+        else:
+            b[1] += 1
+            b[2] += value
+            b[3] = min(b[3],value)
+            b[4] = max(b[4],value)
+    for label,b in sorted(open_buckets.items(),key=lambda item : item[1][0]):
+        yield b[0],label,b[1],b[2] / b[1],b[3],b[4]
+# }}}
+# write_samples {{{2
+def write_samples(samples,as_json):
+    if not as_json:
+        print('time,sensor,raw,temp')
+    for t,label,raw,temp in samples:
+        if as_json:
+            print(json.dumps({'time' : format_time(t),'ns' : t,'sensor' : label,'raw' : raw,'temp' : temp}))
+        else:
+            print('{},{},{},{}'.format(format_time(t),label,'' if raw is None else raw,'' if temp is None else '{:.3f}'.format(temp)))
+# }}}
+# write_buckets {{{2
+def write_buckets(buckets,as_json):
+    if not as_json:
+        print('time,sensor,count,mean,min,max')
+    for t,label,count,mean,low,high in buckets:
+        if as_json:
+            print(json.dumps({'time' : format_time(t),'ns' : t,'sensor' : label,'count' : count,'mean' : mean,'min' : low,'max' : high}))
+        else:
+            print('{},{},{},{:.3f},{:.3f},{:.3f}'.format(format_time(t),label,count,mean,low,high))
+# }}}
+# main {{{1
+def main(argv):
+    try:
+        opts,args = getopt.getopt(argv,'hs:f:t:n:w:j',['help','sensor=','from=','to=','every=','bucket=','json'])
+    except getopt.GetoptError:
+        print('Unspecified error. Perhaps command line arguments are not correct?\n\tTry: {} -h or {} --help.\nAborting...\n'.format(sys.argv[0],sys.argv[0]))
+        sys.exit(2)
+    labels = None
+    start = None
+    stop = None
+    every = None
+    width = None
+    as_json = False
+    try:
+        for opt,arg in opts:
+            if opt in ('-h','--help'):
+                showhelp()
+                sys.exit(0)
+            elif opt in ('-s','--sensor'):
+                labels = (labels or set()) | set([s.strip() for s in arg.split(',') if s.strip()])
+            elif opt in ('-f','--from'):
+                start = parse_time(arg)
+            elif opt in ('-t','--to'):
+                stop = parse_time(arg)
+            elif opt in ('-n','--every'):
+                every = int(arg)
+                if every < 1:
+                    raise ValueError('-n: <n> must be 1 or more.')
+            elif opt in ('-w','--bucket'):
+                width = float(arg)
+                if width <= 0:
+                    raise ValueError('-w: <seconds> must be more than 0.')
+            elif opt in ('-j','--json'):
+                as_json = True
+        if every and width:
+            raise ValueError('-n & -w can\'t be used together.')
+    except ValueError as error:
+        print(error)
+        sys.exit(2)
+    if not args:
+        showhelp()
+        sys.exit(2)
+
+    try:
+        selected = samples(args,start,stop,labels)
+        if width:
+            write_buckets(buckets(selected,width),as_json)
+        else:
+            write_samples(every_nth(selected,every) if every else selected,as_json)
+    except BrokenPipeError:             # e.g. piped into head; not an error, so nothing more to say on exit.
+        os.dup2(os.open(os.devnull,os.O_WRONLY),sys.stdout.fileno())
+    except (OSError,EOFError,ValueError) as error:
+        sys.stdout.flush()
+        print('{}: {}'.format(sys.argv[0],error),file=sys.stderr)
+        sys.exit(1)
+# }}}
+if(__name__ == '__main__'):
+    main(sys.argv[1:])
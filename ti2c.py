@@ -40,14 +40,405 @@
 # __doc__
 """ti2c python module; defines class tempsensor."""
 
-import smbus
+import os,errno
+import time
+import itertools
+import bisect
+import threading,queue
+import ctypes,fcntl
+
+try:
+    import smbus
+except ImportError:     # no smbus module (not a pi?); only the simulated bus is available.
+    smbus = None
+
+try:
+    import numpy
+except ImportError:     # only needed by tempsensorarray.
+    numpy = None
+
+# I2C bus backends:
+# Buses are opened the first time a sensor asks for one, not when the module is imported, so the
+# module (and both applications) can be loaded on a machine without an I2C bus. Backends are:
+#   'smbus' - the real thing: /dev/i2c-<n> through the python smbus module.
+#   'sim'   - an in-process simulation of a bus full of mcp3421 devices; see ti2csim.py.
+# The backend is taken from the TI2C_BUS environment variable, if set, e.g.:
+#   TI2C_BUS=sim jtlogc.py
+# or can be set programmatically with setbackend() before any sensor objects are created.
+# There can be more than one bus, each with its own eight mcp3421 addresses; a sensor is known by
+# its bus number & address. Sensors that don't say otherwise are on defaultbus, the pi's usual bus.
+busbackend = os.environ.get('TI2C_BUS','smbus')
+defaultbus = 1
+
+# I2C multiplexers: a TCA9548A (or similar) switch splits a bus into eight downstream channels, each
+# of which can have its own eight mcp3421 addresses. Writing a byte to the mux enables the channels
+# whose bits are set, and nothing changes until the STOP at the end of that write, so every switch is
+# a bus transaction of its own; see i2cscheduler for how they're kept to a minimum. A sensor behind
+# the mux is known by its bus, channel & address; channel None means straight on the bus, and those
+# addresses must not be reused behind the mux, since they're visible whatever channel is selected.
+muxaddress = 0x70               # TCA9548A with A0-A2 low; 0x70-0x77 are possible.
+muxchannels = 8
+
+def channelmask(channels):
+    """the mux control byte enabling channels (a list of channel #s); None if there are none."""
+    mask = 0
+    for channel in channels:
+        if channel is not None:
+            if channel not in range(muxchannels):
+                raise ValueError('I2C mux channel must be 0-{}, not {}.'.format(muxchannels - 1,channel))
+            mask |= 1 << channel
+    return mask or None
+
+def location(bus,address,channel=None):
+    """a sensor's bus, mux channel & address, for people: '0x68' on the default bus, '<bus>:0x68' on any
+    other, and 'ch<n>:0x68' or '<bus>:ch<n>:0x68' behind a mux."""
+    where = '{:#04x}'.format(address)
+    if channel is not None:
+        where = 'ch{}:{}'.format(channel,where)
+    if bus == defaultbus:
+        return where
+    return '{}:{}'.format(bus,where)
+buses = {}                      # open buses (i2cschedulers, see below), by bus number.
+buslock = threading.Lock()      # guards the buses dictionary, not the buses themselves.
+
+# Combined transactions: the smbus module has no way of doing several reads & writes in one go, but
+# the i2c-dev driver does: the I2C_RDWR ioctl takes a list of messages and runs them back to back,
+# separated by repeated starts, in a single system call. The structures below are from linux/i2c.h
+# and linux/i2c-dev.h.
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+I2C_RDWR_IOCTL_MAX_MSGS = 42    # the kernel refuses more messages than this in one ioctl.
+
+class i2c_msg(ctypes.Structure):
+    _fields_ = [('addr',ctypes.c_uint16),('flags',ctypes.c_uint16),('len',ctypes.c_uint16),('buf',ctypes.POINTER(ctypes.c_uint8))]
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+    _fields_ = [('msgs',ctypes.POINTER(i2c_msg)),('nmsgs',ctypes.c_uint32)]
+
+class smbusbackend(object):
+    """smbusbackend: a thin wrapper around smbus.SMBus; the interface every bus backend provides."""
+    def __init__(self,busnum):
+        if smbus is None:
+            raise ImportError('the smbus module is required to use I2C bus {}; try TI2C_BUS=sim.'.format(busnum))
+        self.busnum = busnum
+        self.smbus = smbus.SMBus(busnum)
+        self.fd = os.open('/dev/i2c-{}'.format(busnum),os.O_RDWR)     # for combined (I2C_RDWR) transactions.
+
+    def write_byte(self,address,value):
+        """write a single byte to the device at address."""
+        self.smbus.write_byte(address,value)
+
+    def read_i2c_block_data(self,address,cmd,length):
+        """write cmd to the device at address, then read length bytes from it; returns a list of ints."""
+        return self.smbus.read_i2c_block_data(address,cmd,length)
+
+    def transfer(self,msgs):
+        """run a list of messages as one combined transaction; returns the bytes read, in message order."""
+        # each message is (address,length) to read length bytes, or (address,bytes) to write them.
+        data = bytearray()
+        for i in range(0,len(msgs),I2C_RDWR_IOCTL_MAX_MSGS):
+            chunk = msgs[i:i + I2C_RDWR_IOCTL_MAX_MSGS]
+            msgarray = (i2c_msg * len(chunk))()
+            bufs = []
+            for m,(address,payload) in zip(msgarray,chunk):
+                if isinstance(payload,int):
+                    buf = (ctypes.c_uint8 * payload)()
+                    m.flags = I2C_M_RD
+                else:
+                    buf = (ctypes.c_uint8 * len(payload)).from_buffer_copy(bytes(payload))
+                    m.flags = 0
+                m.addr = address
+                m.len = len(buf)
+                m.buf = buf
+                bufs.append(buf)
+            fcntl.ioctl(self.fd,I2C_RDWR,i2c_rdwr_ioctl_data(msgarray,len(chunk)))
+            for m,buf in zip(msgarray,bufs):
+                if m.flags & I2C_M_RD:
+                    data += bytes(buf)
+        return bytes(data)
+
+    def close(self):
+        self.smbus.close()
+        os.close(self.fd)
+
+# Bus scheduling: the trigger thread, every sensor back-end, and the UI's sensor checks all share one
+# bus. Rather than each caller using the bus whenever it likes, calls go through an i2cscheduler, which
+# owns the bus: one worker thread runs the queued transactions one at a time, most urgent first:
+#   PRIO_TRIGGER - general calls (triggers & resets); the moment of a trigger is when samples are taken.
+#   PRIO_CONFIG  - writes to a single device (configuration).
+#   PRIO_READ    - reads (status polls & conversion results).
+# Combined-transaction reads (transfer()) that are waiting together, from any number of threads, are
+# coalesced into one transaction; that's where the savings are as sensors are added. The time each 
+# request spends between being made and being completed is kept by priority; see stats().
+# On a bus with a mux, every request says which channels it needs (see channels()), and the scheduler
+# switches the mux before running it if it isn't already there. Reads waiting together are taken
+# channel by channel, starting with the channel the mux is on, so each channel is switched to once
+# per round of reads rather than once per read. General calls are sent with every channel that has a
+# sensor on it enabled at once, so one trigger still reaches all of them at the same moment.
+# Besides the mean & max, latencies are counted into buckets, latencybuckets seconds wide at most, for a
+# histogram of them; and every request that fails is counted by its errno: a device that doesn't answer
+# is a NACK, EREMOTEIO from the Pi's controller (ENXIO or EIO from some others).
+PRIO_TRIGGER = 0
+PRIO_CONFIG = 1
+PRIO_READ = 2
+prionames = ('trigger','config','read')
+latencybuckets = (0.0005,0.001,0.002,0.005,0.01,0.02,0.05,0.1,0.25)     # seconds; the upper bound of each.
+
+class i2crequest(object):
+    """one queued bus operation, and its outcome."""
+    def __init__(self,op,args,mask=None):
+        self.op = op                    # name of the backend method to call.
+        self.args = args
+        self.mask = mask                # mux channels it needs enabled; None for devices straight on the bus.
+        self.result = None
+        self.error = None
+        self.made = time.perf_counter()
+        self.done = threading.Event()
+
+    def nbytes(self):
+        """# of bytes a transfer() request reads."""
+        return sum(payload for address,payload in self.args[0])
+
+class i2cscheduler(object):
+    """i2cscheduler: owns a bus backend; runs transactions from all threads on one worker thread, in priority order."""
+    def __init__(self,bus):
+        self.bus = bus
+        self.queue = queue.PriorityQueue()
+        self.seq = itertools.count()    # keeps requests of equal priority in the order they were made.
+        self.closed = False
+        self.muxaddress = muxaddress
+        self.muxmask = None             # channels the mux has enabled; None until it's been set.
+        self.statslock = threading.Lock()
+        self.resetstats()
+        self.worker = threading.Thread(target=self.__run,name='t-i2c{}'.format(getattr(bus,'busnum','')),daemon=True)
+        self.worker.start()
+
+    def __getattr__(self,name):
+        """anything that isn't a bus transaction (e.g. simbus.fault()) goes straight to the backend."""
+        if name == 'bus':
+            raise AttributeError(name)
+        return getattr(self.bus,name)
+
+    def channels(self,channels):
+        """the bus as seen by devices behind the given mux channels (a list of channel #s); see i2cchannels."""
+        return i2cchannels(self,channelmask(channels))
+
+    def write_byte(self,address,value,mask=None):
+        """write a single byte to the device at address; address 0 is a general call, and jumps the queue."""
+        return self.__submit(PRIO_TRIGGER if address == 0 else PRIO_CONFIG,i2crequest('write_byte',(address,value),mask))
+
+    def read_i2c_block_data(self,address,cmd,length,mask=None):
+        """write cmd to the device at address, then read length bytes from it; returns a list of ints."""
+        return self.__submit(PRIO_READ,i2crequest('read_i2c_block_data',(address,cmd,length),mask))
+
+    def transfer(self,msgs,mask=None):
+        """run a list of messages as one combined transaction; as smbusbackend.transfer()."""
+        msgs = list(msgs)
+        if all(isinstance(payload,int) for address,payload in msgs):
+            priority = PRIO_READ
+        elif any(address == 0 for address,payload in msgs):
+            priority = PRIO_TRIGGER
+        else:
+            priority = PRIO_CONFIG
+        return self.__submit(priority,i2crequest('transfer',(msgs,),mask))
+
+    def close(self):
+        """finish whatever is queued, stop the worker, and close the bus."""
+        if not self.closed:
+            self.closed = True
+            self.queue.put((PRIO_READ + 1,next(self.seq),None))    # after everything else.
+            self.worker.join()
+            self.bus.close()
+
+    def resetstats(self):
+        with self.statslock:
+            self.requests = [0] * len(prionames)
+            self.latency = [0.0] * len(prionames)      # total seconds from request to completion.
+            self.maxlatency = [0.0] * len(prionames)
+            self.histogram = [[0] * (len(latencybuckets) + 1) for _ in prionames]  # the last, for any longer.
+            self.errors = {}                            # failed requests, by errno name.
+            self.transactions = 0                       # bus operations actually run.
+            self.coalesced = 0                          # requests that shared a transaction with another.
+            self.switches = 0                           # mux channel changes (each one of the transactions).
+
+    def stats(self):
+        """request, latency & error statistics since the last resetstats(); latencies in seconds, and
+        histogram is the # of requests in each of latencybuckets, then the # longer than the last."""
+        with self.statslock:
+            s = {'transactions' : self.transactions,'coalesced' : self.coalesced,'switches' : self.switches,
+                 'errors' : dict(self.errors)}
+            for p,name in enumerate(prionames):
+                s[name] = {'requests' : self.requests[p],
+                           'mean' : self.latency[p] / self.requests[p] if self.requests[p] else 0.0,
+                           'max' : self.maxlatency[p],
+                           'histogram' : list(self.histogram[p])}
+            return s
+
+    def __submit(self,priority,request):
+        if self.closed:
+            raise OSError(errno.EBADF,'I2C bus is closed')
+        self.queue.put((priority,next(self.seq),request))
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def __run(self):
+        while True:
+            priority,seq,request = self.queue.get()
+            if request is None:
+                break
+            if priority == PRIO_READ:
+                batch = self.__gatherreads((priority,seq,request))
+            else:
+                batch = [request]
+            self.__execute(priority,batch)
+
+    def __gatherreads(self,first):
+        """the next reads to run together: those for one set of mux channels, the current one if possible."""
+        waiting = [first]               # every read waiting now, oldest first.
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] != PRIO_READ or item[2] is None:
+                self.queue.put(item)    # something more urgent came in, or it's time to stop; reads can wait.
+                break
+            waiting.append(item)
+        # stay on the channel the mux is on while there's anything to read there; otherwise, oldest first.
+        chosen = next((item for item in waiting if item[2].mask in (None,self.muxmask)),waiting[0])
+        mask = chosen[2].mask if chosen[2].mask is not None else self.muxmask
+        batch = [chosen]
+        if chosen[2].op == 'transfer':
+            # gather up any other combined reads on the same channels, up to what the kernel takes in one go:
+            nmsgs = len(chosen[2].args[0])
+            for item in waiting:
+                if item is not chosen and item[2].op == 'transfer' and item[2].mask in (None,mask) and \
+                   nmsgs + len(item[2].args[0]) <= I2C_RDWR_IOCTL_MAX_MSGS:
+                    batch.append(item)
+                    nmsgs += len(item[2].args[0])
+        for item in waiting:
+            if item not in batch:
+                self.queue.put(item)    # they keep their place in line.
+        return [item[2] for item in batch]
+
+    def __call(self,request):
+        try:
+            request.result = getattr(self.bus,request.op)(*request.args)
+        except Exception as error:      # handed to the caller, to be raised in its own thread.
+            request.error = error
+
+    def __select(self,batch):
+        """switch the mux to the channels batch needs, if it isn't there already; returns 1 if it was switched."""
+        mask = next((request.mask for request in batch if request.mask is not None),None)
+        if mask is None or mask == self.muxmask:
+            return 0
+        self.muxmask = None             # if the write fails, there's no telling what's enabled.
+        self.bus.write_byte(self.muxaddress,mask)
+        self.muxmask = mask
+        return 1
+
+    def __execute(self,priority,batch):
+        transactions = 1
+        try:
+            switches = self.__select(batch)
+        except OSError as error:        # the mux didn't answer, so nothing behind it can be reached.
+            switches = 0
+            for request in batch:
+                request.error = error
+        else:
+            transactions += switches
+            if len(batch) == 1:
+                self.__call(batch[0])
+            else:
+                try:
+                    data = self.bus.transfer([m for request in batch for m in request.args[0]])
+                except OSError:
+                    # one NACK fails the lot, so run them one at a time: each caller gets its own result or error.
+                    # (devices read before the NACK have been read twice; a second read just finds no new data.)
+                    for request in batch:
+                        self.__call(request)
+                    transactions += len(batch)
+                else:
+                    i = 0
+                    for request in batch:
+                        n = request.nbytes()
+                        request.result = data[i:i + n]
+                        i += n
+        now = time.perf_counter()
+        with self.statslock:
+            self.transactions += transactions
+            self.switches += switches
+            if len(batch) > 1:
+                self.coalesced += len(batch)
+            for request in batch:
+                latency = now - request.made
+                self.requests[priority] += 1
+                self.latency[priority] += latency
+                self.maxlatency[priority] = max(self.maxlatency[priority],latency)
+                self.histogram[priority][bisect.bisect_left(latencybuckets,latency)] += 1
+                if isinstance(request.error,OSError):
+                    name = errno.errorcode.get(request.error.errno,'unknown')
+                    self.errors[name] = self.errors.get(name,0) + 1
+        for request in batch:
+            request.done.set()
+
+class i2cchannels(object):
+    """i2cchannels: a bus scheduler, as seen by devices behind some of the channels of a mux; same interface."""
+    def __init__(self,scheduler,mask):
+        self.scheduler = scheduler
+        self.mask = mask                # the mux control byte; None for devices straight on the bus.
+
+    def __getattr__(self,name):
+        """statistics, backend extras, etc. come from the scheduler."""
+        if name == 'scheduler':
+            raise AttributeError(name)
+        return getattr(self.scheduler,name)
+
+    def write_byte(self,address,value):
+        return self.scheduler.write_byte(address,value,self.mask)
+
+    def read_i2c_block_data(self,address,cmd,length):
+        return self.scheduler.read_i2c_block_data(address,cmd,length,self.mask)
+
+    def transfer(self,msgs):
+        return self.scheduler.transfer(msgs,self.mask)
+
+def setbackend(backend):
+    """select the bus backend ('smbus' or 'sim') for buses opened from now on."""
+    global busbackend
+    if backend not in ('smbus','sim'):
+        raise ValueError('unknown I2C bus backend: {}'.format(backend))
+    busbackend = backend
+
+def getbus(busnum=1):
+    """return the bus object for bus busnum, opening it with the selected backend on first use."""
+    with buslock:
+        if busnum not in buses:
+            if busbackend == 'sim':
+                import ti2csim
+                buses[busnum] = i2cscheduler(ti2csim.simbus(busnum))
+            else:
+                buses[busnum] = i2cscheduler(smbusbackend(busnum))
+        return buses[busnum]
+
+def closebuses():
+    """close all open buses; the next getbus() call reopens with the current backend."""
+    with buslock:
+        for bus in buses.values():
+            bus.close()
+        buses.clear()
 
 # There are a few commands that talk to all mcp3421 devices on the SMBus.
 # Since they aren't specific to tempsensor objects, they're in a class of their own.
 # The trigger function is useful if performing conversions slower than the 18-bit conversion rate.
+# General calls only reach the devices on one bus, so there's one of these per bus; on a bus with a
+# mux, pass the channels with sensors behind them, and they're all enabled for the general calls.
 class tempsensorglobal(object):
-    bus = smbus.SMBus(1)
-    def __init__(self):
+    def __init__(self,bus=defaultbus,channels=()):
+        self.busnum = bus
+        self.bus = getbus(bus).channels(channels)
         self.gen_call_address = 0
         self.gen_reset = 0x06
         self.gen_convert = 0x08
@@ -60,10 +451,44 @@ class tempsensorglobal(object):
         """trigger all mcp3421 devices to simultaneously perform a conversion; will put all devices in one-shot mode."""
         self.bus.write_byte(self.gen_call_address,self.gen_convert)
 
-class tempsensor(object):
-    # create an object able to access the I2C bus:
-    bus = smbus.SMBus(1)
+    def read_status(self,sensors):
+        """read_status() for a list of tempsensor objects, reading all of them in a single bus transaction (one per mux channel).
+        returns a list of results, one per sensor: True if data is ready, False if not, None if the sensor didn't respond."""
+        bychannel = {}
+        for i,s in enumerate(sensors):
+            bychannel.setdefault(s.get_channel(),[]).append(i)
+        # whatever channel the mux is on now is read first, saving a switch; then the rest in order.
+        current = self.bus.muxmask
+        order = sorted(bychannel,key=lambda c: (channelmask([c]) != current,-1 if c is None else c))
+        ready = [None] * len(sensors)
+        for channel in order:
+            for i,r in zip(bychannel[channel],self.__read_status([sensors[i] for i in bychannel[channel]])):
+                ready[i] = r
+        return ready
+
+    def __read_status(self,sensors):
+        """read_status() for sensors that are all on the same mux channel."""
+        try:
+            data = sensors[0].bus.transfer([(s.address,s.readlength()) for s in sensors])
+        except OSError:
+            # one NACK fails the whole transaction; fall back to reading the sensors one at a time,
+            # so the ones that are still there get read, and the missing ones are identified.
+            ready = []
+            for s in sensors:
+                try:
+                    ready.append(s.read_status())
+                except OSError:
+                    ready.append(None)
+            return ready
+        ready = []
+        i = 0
+        for s in sensors:
+            n = s.readlength()
+            ready.append(s.decode_status(data[i:i + n]))
+            i += n
+        return ready
 
+class tempsensor(object):
     # possible addresses:
     # note: as of this writing, only the first four are available.
     i2caddress = (0x68,0x69,0x6a,0x6b,0x6c,0x6d,0x6e,0x6f)
@@ -87,8 +512,12 @@ class tempsensor(object):
     # an afterthought... add the symbols for C/K/F (assuming your world has utf-8 fonts:
     unit = (u'\u00b0' + 'C',' K',u'\u00b0' + 'F') 
 
-    def __init__(self,address,mode,units):
-        """tempsensor __init__; pass address (0..7) and mode (0..3) - see set_address() & set_mode() for details."""
+    def __init__(self,address,mode,units,bus=defaultbus,channel=None):
+        """tempsensor __init__; pass address (0..7) and mode (0..3) - see set_address() & set_mode() for details; bus is the I2C bus #,
+        channel the mux channel the sensor is behind (None if it isn't)."""
+        self.busnum = bus                               # /dev/i2c-<busnum>.
+        self.channel = channel
+        self.bus = getbus(bus).channels([channel])      # an object able to access the I2C bus.
         self.i2caddrind = address
         self.set_address(address)                       # map the requested address to a physical I2C address.
         self.set_mode(mode)                             # select the converter mode.
@@ -103,6 +532,9 @@ class tempsensor(object):
             self.units = 2
         self.raw = 0                                    # raw data from sensor.
         self.cooked = 0                                 # formatted data from sensor; Celsius by default.
+        self.calibration = None                         # calibration profile; None means use slope & intercept.
+        self.lut = None                                 # calibration profile compiled into a lookup table.
+        self.lutoffset = 0
 
     def set_address(self,address):
         """set ti2c module address: 0=0x68, 1=0x69... 7=0x6f."""
@@ -129,10 +561,29 @@ class tempsensor(object):
     def set_intercept(self,intercept):
         """set ti2c module intercept: for converting sample data to temperature; for calibration. """
         self.intercept = intercept
+    def set_calibration(self,profile):
+        """set ti2c module calibration profile (see ti2ccal.py); replaces slope & intercept; None reverts to them."""
+        if profile:
+            import ti2ccal
+            self.lut = ti2ccal.buildlut(profile,self.mode)
+            self.lutoffset = ti2ccal.lutoffset(self.mode)
+            self.calibration = profile
+        else:
+            self.lut = None
+            self.calibration = None
 
     def get_address(self):
         """get ti2c's I2C address."""
         return self.address
+    def get_bus(self):
+        """get ti2c's I2C bus number."""
+        return self.busnum
+    def get_channel(self):
+        """get ti2c's I2C mux channel; None if it's straight on the bus."""
+        return self.channel
+    def get_location(self):
+        """get ti2c's bus, mux channel & address, for people; see location()."""
+        return location(self.busnum,self.address,self.channel)
     def get_mode(self):
         """get ti2c operating mode; see set_mode() for details."""
         return self.mode
@@ -155,6 +606,9 @@ class tempsensor(object):
     def get_intercept(self):
         """get ti2c module intercept variable; see set_intercept() for details."""
         return self.intercept
+    def get_calibration(self):
+        """get ti2c module calibration profile; see set_calibration() for details."""
+        return self.calibration
 
     def get_tempraw(self):
         """get ti2c module raw temperature sample data."""
@@ -203,15 +657,30 @@ class tempsensor(object):
         """write the config byte to the ti2c module; will fail if sensor does not respond."""
         self.bus.write_byte(self.address,self.cfgbyte)   # configure ADC
 
+    def readlength(self):
+        """# of bytes to read from the module: the conversion result (3 bytes in 18-bit mode, 2 otherwise), then the status byte."""
+        # there's an extra byte to read if the mcp3421 is in 18-bit mode:
+        if self.mcp3421[self.mode][0] == 18:
+            return 4
+        else:
+            return 3
+
     def read_status(self):
         """Read the module, and check the status of the ready bit; return True if data is ready, False otherwise."""
-        # there's an extra byte to read if the mcp3421 is in 18-bit mode:
+        return self.decode_status(self.bus.read_i2c_block_data(self.address,self.cfgbyte,self.readlength()))
+
+    def read_result(self):
+        """Read the module with a plain I2C read, without resending the config byte; otherwise as read_status()."""
+        # an smbus block read sends the config byte as its command byte; in continuous mode the device
+        # doesn't need to hear it again, and leaving it out shortens every read.
+        return self.decode_status(self.bus.transfer([(self.address,self.readlength())]))
+
+    def decode_status(self,mcpdata):
+        """Decode data read from the module (readlength() bytes); return True if it holds a new conversion, False otherwise."""
         if self.mcp3421[self.mode][0] == 18:
-            mcpdata = self.bus.read_i2c_block_data(self.address,self.cfgbyte,4)
             self.raw = mcpdata[2] + (mcpdata[1] << 8) + (mcpdata[0] << 16)
             self.status = mcpdata[3]
         else:
-            mcpdata = self.bus.read_i2c_block_data(self.address,self.cfgbyte,3)
             self.raw = mcpdata[1] + (mcpdata[0] << 8)
             self.status = mcpdata[2]
         # the conversion results precede the status byte.
@@ -222,7 +691,7 @@ class tempsensor(object):
             if mcpdata[0] & 0x80:                           # if the data was negative, 
                 self.raw -= self.mcp3421[self.mode][2] + 1  # subtract off the sign extension bit
             # cook the data:
-            self.cooked = self.raw * self.slope + self.intercept
+            self.cook()
             return True
 
     def read_sensor(self):
@@ -239,6 +708,70 @@ class tempsensor(object):
         if mcpdata[0] & 0x80:                           # if the data was negative, 
             self.raw -= self.mcp3421[self.mode][2] + 1  # subtract off the sign extension bit
         # cook the data:
-        self.cooked = self.raw * self.slope + self.intercept
+        self.cook()
         return self.raw
 
+    def cook(self):
+        """convert the raw sample to temperature (°C), by lookup if there's a calibration profile."""
+        if self.lut is None:
+            self.cooked = self.raw * self.slope + self.intercept
+        else:
+            self.cooked = self.lut[self.raw + self.lutoffset]
+
+# Block conversion, for post-processing: tempsensor converts one sample at a time as it's read, which
+# is fine at 3.75 Hz, but slow going for days' worth of samples captured at 240 Hz. tempsensorarray
+# does the same sign extension & slope/intercept arithmetic on whole numpy arrays in one pass.
+class tempsensorarray(object):
+    def __init__(self,sensors):
+        """tempsensorarray __init__; pass a list of tempsensor objects; column i of each block of samples is from sensors[i]."""
+        if numpy is None:
+            raise ImportError('tempsensorarray requires the numpy module.')
+        # by mode, indexable by arrays of modes:
+        self.samplemask = numpy.array([m[2] for m in tempsensor.mcp3421],dtype=numpy.int64)
+        self.lsb = numpy.array([si[0] for si in tempsensor.slope_intercept])     # nominal °C per count.
+        # by sensor:
+        self.mode = numpy.array([s.get_mode() for s in sensors],dtype=numpy.int64)
+        self.slope = numpy.array([s.get_slope() for s in sensors],dtype=numpy.float64)
+        self.intercept = numpy.array([s.get_intercept() for s in sensors],dtype=numpy.float64)
+        self.units = numpy.array([s.units for s in sensors],dtype=numpy.int64)
+        # calibration profiles, as lookup tables; used where a sensor has one.
+        self.lut = [numpy.frombuffer(s.lut) if s.lut is not None else None for s in sensors]
+        self.lutoffset = [s.lutoffset for s in sensors]
+
+    def signextend(self,raw,mode=None):
+        """raw samples as read from the device (or already signed) to signed integers."""
+        # mode defaults to each sensor's mode; pass a scalar or an array shaped like raw for anything else.
+        if mode is None:
+            mode = self.mode
+        raw = numpy.asarray(raw,dtype=numpy.int64)
+        mask = self.samplemask[mode]
+        data = raw & mask                                       # mask off sign-extension bits
+        return numpy.where(raw & (mask + 1),data - (mask + 1),data)     # subtract off the sign extension bit if negative.
+
+    def get_tempC(self,raw,mode=None):
+        """block of raw samples, shaped (samples,sensors), to temperature in Celsius."""
+        data = self.signextend(raw,mode)
+        modes = numpy.broadcast_to(self.mode if mode is None else mode,data.shape)     # each sample's.
+        # each sensor's slope is calibrated for its own mode; scale it to the weight of a count in the sample's mode.
+        slope = self.slope * self.lsb[modes] / self.lsb[self.mode]
+        tempC = data * slope + self.intercept
+        # calibration tables are compiled for the sensor's mode, so they only apply to samples taken in it.
+        for i,lut in enumerate(self.lut):
+            if lut is not None:
+                own = modes[...,i] == self.mode[i]
+                index = numpy.clip(data[...,i] + self.lutoffset[i],0,len(lut) - 1)     # the others' codes may be out of its range.
+                tempC[...,i] = numpy.where(own,lut[index],tempC[...,i])
+        return tempC
+
+    def get_tempF(self,raw,mode=None):
+        """block of raw samples to temperature in Fahrenheit."""
+        return self.get_tempC(raw,mode) * 9 / 5 + 32
+
+    def get_tempK(self,raw,mode=None):
+        """block of raw samples to temperature in Kelvin."""
+        return self.get_tempC(raw,mode) + 273.15
+
+    def get_tempcooked(self,raw,mode=None):
+        """block of raw samples to temperature in each sensor's units (see tempsensor.units)."""
+        tempC = self.get_tempC(raw,mode)
+        return numpy.select([self.units == 1,self.units == 2],[tempC + 273.15,tempC * 9 / 5 + 32],tempC)
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# ti2ccal.py - calibration profiles for sensors from J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+#
+# ti2ccal.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Now that that's out of the way...
+# By default, tempsensor converts samples with a straight line: y = mx + b.
+# That's good, but a platinum RTD isn't quite linear, so a sensor can be
+# given a calibration profile instead. Profiles are dictionaries, stored in
+# the jtlogc config file (~/.jtlogc/config.json) under each sensor's
+# 'calibration' key; null means use the slope & intercept. The types are:
+#
+#   piecewise  - straight lines between measured points:
+#                {'type' : 'piecewise', 'points' : [[code,°C],[code,°C],...]}
+#                beyond the first & last points, the end segments are extended.
+#   polynomial - °C = c0 + c1*code + c2*code^2 + ...:
+#                {'type' : 'polynomial', 'coefficients' : [c0,c1,c2,...]}
+#   cvd        - Callendar-Van Dusen: the front end is taken to be linear in
+#                resistance, R = rslope*code + rintercept, and R is converted
+#                to temperature by inverting the IEC 60751 equation
+#                R = r0 * (1 + a*T + b*T^2 + c*(T-100)*T^3); c applies below 0°C:
+#                {'type' : 'cvd', 'r0' : 100.0, 'a' : 3.9083e-3, 'b' : -5.775e-7,
+#                 'c' : -4.183e-12, 'rslope' : ..., 'rintercept' : ...}
+#                any key left out takes the default shown; the default rslope &
+#                rintercept are what the nominal 18-bit slope & intercept imply
+#                for a Pt100 with alpha = 0.00385.
+#
+# 'code' is always in 18-bit counts, whatever mode the sensor runs in, so a
+# profile fitted once applies in every mode; a 12-bit sample of n counts is
+# 64*n 18-bit counts, 14-bit is 16*n, 16-bit is 4*n.
+#
+# Curves like these are too slow to evaluate per sample, so each profile is
+# compiled for the sensor's mode into a table with one entry per possible
+# code; 2^18 of them in 18-bit mode. Converting a sample is then a lookup.
+# __doc__
+"""ti2ccal python module; compiles calibration profiles into lookup tables."""
+
+import os
+import math
+import json
+import array
+import bisect
+import threading
+
+from ti2c import tempsensor
+from ti2c import defaultbus
+
+profiletypes = ('piecewise','polynomial','cvd')
+
+# IEC 60751 coefficients, and the Pt100 nominal alpha used to derive the default resistance scale.
+cvd_defaults = {'r0' : 100.0,'a' : 3.9083e-3,'b' : -5.775e-7,'c' : -4.183e-12}
+pt_alpha = 0.00385
+
+# compiled tables, keyed by profile (as json) and mode; compiling an 18-bit table isn't instant.
+luts = {}
+lutlock = threading.Lock()
+
+def scale(mode):
+    """# of 18-bit counts in one count of the given mode."""
+    return 1 << (tempsensor.mcp3421[-1][0] - tempsensor.mcp3421[mode][0])
+
+def lutoffset(mode):
+    """table index of code 0; the table runs from the most negative code to the most positive."""
+    return 1 << (tempsensor.mcp3421[mode][0] - 1)
+
+def validate(profile):
+    """raise ValueError if profile isn't something buildlut() can compile."""
+    if not isinstance(profile,dict) or profile.get('type') not in profiletypes:
+        raise ValueError('calibration profile type must be one of {}.'.format(', '.join(profiletypes)))
+    if profile['type'] == 'piecewise':
+        if len(profile.get('points',[])) < 2:
+            raise ValueError('piecewise calibration needs at least two points.')
+        codes = [p[0] for p in profile['points']]
+        if len(set(codes)) != len(codes):
+            raise ValueError('piecewise calibration points must have distinct codes.')
+    elif profile['type'] == 'polynomial':
+        if len(profile.get('coefficients',[])) < 1:
+            raise ValueError('polynomial calibration needs at least one coefficient.')
+
+def piecewise(profile,codes):
+    points = sorted(profile['points'])
+    x = [p[0] for p in points]
+    temps = []
+    for code in codes:
+        i = min(max(bisect.bisect_right(x,code),1),len(x) - 1)    # segment i-1..i; end segments extend outwards.
+        x0,t0 = points[i - 1]
+        x1,t1 = points[i]
+        temps.append(t0 + (t1 - t0) * (code - x0) / (x1 - x0))
+    return temps
+
+def polynomial(profile,codes):
+    coefficients = list(reversed(profile['coefficients']))
+    temps = []
+    for code in codes:
+        t = 0.0
+        for c in coefficients:      # Horner's method.
+            t = t * code + c
+        temps.append(t)
+    return temps
+
+def cvd_parameters(profile):
+    p = dict(cvd_defaults)
+    m,b = tempsensor.slope_intercept[-1]            # nominal 18-bit line.
+    p['rslope'] = p['r0'] * pt_alpha * m
+    p['rintercept'] = p['r0'] * (1 + pt_alpha * b)
+    p.update({k : v for k,v in profile.items() if k != 'type'})
+    return p
+
+def cvd(profile,codes):
+    p = cvd_parameters(profile)
+    r0,a,b,c = p['r0'],p['a'],p['b'],p['c']
+    temps = []
+    for code in codes:
+        r = p['rslope'] * code + p['rintercept']
+        disc = a * a - 4 * b * (1 - r / r0)
+        if disc < 0:                                # beyond anything the curve can reach.
+            temps.append(float('nan'))
+            continue
+        t = (-a + math.sqrt(disc)) / (2 * b)        # exact above 0°C, where c is 0.
+        if t < 0:
+            for _ in range(4):                      # newton's method for the full quartic; converges in 2-3.
+                f = r0 * (1 + a * t + b * t * t + c * (t - 100) * t ** 3) - r
+                df = r0 * (a + 2 * b * t + c * (4 * t ** 3 - 300 * t * t))
+                t -= f / df
+        temps.append(t)
+    return temps
+
+def buildlut(profile,mode):
+    """compile profile for a sensor in mode (0..3) into a table of °C indexed by raw code + lutoffset(mode)."""
+    key = (json.dumps(profile,sort_keys=True),mode)
+    with lutlock:
+        if key in luts:
+            return luts[key]
+    validate(profile)
+    k = scale(mode)
+    offset = lutoffset(mode)
+    codes = [code * k for code in range(-offset,offset)]
+    lut = array.array('d',{'piecewise' : piecewise,'polynomial' : polynomial,'cvd' : cvd}[profile['type']](profile,codes))
+    with lutlock:
+        luts[key] = lut
+    return lut
+
+def loadprofiles(cfgfile='~/.jtlogc/config.json'):
+    """read the calibration profiles from a jtlogc config file; returns {(bus,address) : profile} for the sensors that have one.
+    sensors behind an I2C mux are left out; (bus,address) doesn't say which channel they're on."""
+    with open(os.path.expanduser(cfgfile),'r') as f:
+        sensorcfg = json.load(f)
+    profiles = {}
+    for s in sensorcfg['sensors'].values():
+        if s['address'] != -1 and s.get('calibration') and s.get('channel') is None:
+            profiles[(s.get('bus',defaultbus),s['address'])] = s['calibration']
+    return profiles
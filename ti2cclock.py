@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+# ti2cclock.py - trigger scheduling & timing for sensors from J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+#
+# ti2cclock.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Now that that's out of the way...
+# Triggered sampling is only as even as the triggers. Sleeping for a period at a time, from
+# whenever the last trigger happened to finish, adds every sleep's overshoot and every bus
+# write's latency to the next interval, so the samples wander off the schedule. Instead, a
+# schedule fixes when every trigger is due, on the monotonic clock, in ns:
+#
+#   slot k is due at origin + k * period
+#
+# and a trigger sleeps until its slot's deadline, not for a length of time: sleepuntil() uses
+# clock_nanosleep(CLOCK_MONOTONIC,TIMER_ABSTIME) from libc, so a late wakeup one time doesn't
+# make the next one late. Slots are numbered from 1, and the numbers carry on across a halt;
+# a restart puts the next slot at the moment of the restart. Every bus's trigger runs on the
+# one schedule, so the k'th triggers on every bus are due at the same moment, and the slot #
+# is what the logger matches samples into rows by.
+#
+# A slot that's missed, by more than a tenth of a period (the bus was held up, say, or the previous
+# conversion was slow to collect), is handled by the overrun policy, the same way every time:
+#   'skip'      - the missed slots are skipped, and counted; sampling carries on with the next
+#                 slot still to come, so the samples that are taken stay on the schedule.
+#   'catchup'   - the missed slots are triggered anyway, as soon as possible, one after another,
+#                 until the schedule's caught up; no slot goes without a sample, but those
+#                 samples are off the schedule.
+#
+# Each trigger's timing is recorded: the time it was due, the time the trigger was actually
+# sent (when the general call finished: the conversion starts at its STOP), and how long the
+# bus write took. A timingstats keeps running statistics of them, per bus:
+#   late    - actual - due: mean & max; how far behind the schedule triggers are.
+#   jitter  - the standard deviation of late; how uneven the intervals are.
+#   drift   - the slope of late against time, in ns per s; a schedule that's slipping.
+#   write   - the bus write's latency: mean & max.
+#   failed  - the triggers that failed: a general call that's NACKed (or otherwise fails) costs its
+#             slot, as an overrun would, and sampling carries on with the next.
+# A timinglog writes every trigger's timing to a csv file, <log>.timing.csv:
+#
+#   slot,bus,due (ns),actual (ns),late (us),write (us)
+#   12,1,5101300000123,5101300081234,81.111,64.202
+#
+# due & actual are on the monotonic clock, so intervals can be taken straight from them.
+#
+# Samples are time stamped on both clocks at once, by stamp(): (monotonic ns, wall ns since the
+# epoch), as integers, so no precision is lost to floating point on the way to the log. The
+# monotonic clock never steps, so the intervals between stamps, across threads, are exact; the
+# wall clock says when it was, and can be compared between machines. wall - monotonic is the
+# same from stamp to stamp until NTP steps (or slews) the wall clock, so a step shows up as a
+# change in it.
+# __doc__
+"""ti2cclock python module; defines stamp(), sleepuntil(), and classes schedule, timingstats & timinglog."""
+
+import errno
+import math
+import time
+import threading
+import ctypes,ctypes.util
+
+import ti2clog
+
+overruns = ('skip','catchup')
+defaultoverrun = 'skip'
+margin = 5000000                # ns: the last of a wait is spent in sleepuntil(), not waiting on a control.
+tolerance = 0.1                 # of a period: a slot is missed once it's this late.
+
+CLOCK_MONOTONIC = 1             # from linux/time.h; the clock time.monotonic_ns() reads.
+TIMER_ABSTIME = 1
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec',ctypes.c_long),('tv_nsec',ctypes.c_long)]
+
+try:
+    clock_nanosleep = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True).clock_nanosleep
+    clock_nanosleep.argtypes = [ctypes.c_int,ctypes.c_int,ctypes.POINTER(timespec),ctypes.POINTER(timespec)]
+except (OSError,AttributeError):    # no libc, or one without it (not linux?); sleepuntil() falls back on time.sleep().
+    clock_nanosleep = None
+
+def stamp():
+    """now, on both clocks: (monotonic ns, wall ns since the epoch)."""
+    return time.monotonic_ns(),time.time_ns()
+
+def sleepuntil(deadline):
+    """sleep until deadline, in ns on the monotonic clock (as time.monotonic_ns()); returns at once if it's passed."""
+    if clock_nanosleep is None:
+        delay = deadline - time.monotonic_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        return
+    when = timespec(deadline // 1000000000,deadline % 1000000000)
+    while clock_nanosleep(CLOCK_MONOTONIC,TIMER_ABSTIME,ctypes.byref(when),None) == errno.EINTR:
+        pass                    # a signal; the deadline's the same, so just go back to sleep.
+
+class schedule(object):
+    """the slots triggers are due in, every period seconds; one schedule is shared by the trigger of every bus."""
+    def __init__(self,period,overrun=defaultoverrun):
+        if overrun not in overruns:
+            raise ValueError('overrun policy must be one of {}, not {}.'.format(', '.join(overruns),overrun))
+        self.period = max(int(round(period * 1e9)),1)   # ns.
+        self.overrun = overrun
+        self.tolerance = int(self.period * tolerance)
+        self.origin = None          # when slot 0 would have been due; None until start().
+        self.lock = threading.Lock()
+
+    def start(self,now=None):
+        """(re)start the schedule: the next slot not yet due is due now, and the rest follow every period."""
+        with self.lock:
+            now = time.monotonic_ns() if now is None else now
+            if self.origin is None:
+                slot = 1
+            else:
+                slot = -(-(now - self.origin) // self.period)   # the first slot not yet due; slot #s only go up.
+            self.origin = now - slot * self.period
+
+    def due(self,slot):
+        """when slot is due, in ns on the monotonic clock."""
+        return self.origin + slot * self.period
+
+    def current(self,now=None):
+        """the slot a trigger that's just been run should start with: the last one due."""
+        if self.origin is None:
+            self.start(now)
+        now = time.monotonic_ns() if now is None else now
+        return max((now - self.origin) // self.period,1)
+
+    def next(self,slot,now=None):
+        """the slot to trigger next, slot by rights, after the overrun policy; returns (slot,# of slots skipped)."""
+        now = time.monotonic_ns() if now is None else now
+        if self.overrun == 'catchup' or now <= self.due(slot) + self.tolerance:
+            return slot,0
+        nextslot = -(-(now - self.tolerance - self.origin) // self.period)      # the first that isn't missed yet.
+        return nextslot,nextslot - slot
+
+class timingstats(object):
+    """running statistics of one trigger's timing; all times in ns."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.skipped = 0
+            self.failed = 0
+            self.first = None           # the due time of the first trigger; drift is measured from it.
+            self.mean = 0.0             # of late; Welford's update.
+            self.m2 = 0.0
+            self.maxlate = 0
+            self.sxx = 0.0              # co-moments of due time (s, from first) & late, for drift.
+            self.sxy = 0.0
+            self.meant = 0.0
+            self.write = 0
+            self.maxwrite = 0
+
+    def record(self,due,actual,write):
+        """one trigger, due at due, sent at actual, whose bus write took write ns."""
+        late = actual - due
+        with self.lock:
+            if self.first is None:
+                self.first = due
+            t = (due - self.first) / 1e9
+            self.count += 1
+            delta = late - self.mean
+            deltat = t - self.meant
+            self.mean += delta / self.count
+            self.meant += deltat / self.count
+            self.m2 += delta * (late - self.mean)
+            self.sxx += deltat * (t - self.meant)
+            self.sxy += deltat * (late - self.mean)
+            self.maxlate = max(self.maxlate,late)
+            self.write += write
+            self.maxwrite = max(self.maxwrite,write)
+
+    def skip(self,n):
+        """n slots skipped after an overrun."""
+        with self.lock:
+            self.skipped += n
+
+    def fail(self):
+        """a trigger that failed; its slot goes without a sample."""
+        with self.lock:
+            self.failed += 1
+
+    def stats(self):
+        """the statistics so far: triggers, skipped, failed, late (mean & max), jitter & write (mean & max) in ns; drift in ns per s."""
+        with self.lock:
+            n = self.count
+            return {'triggers' : n,'skipped' : self.skipped,'failed' : self.failed,
+                    'late' : {'mean' : self.mean,'max' : self.maxlate},
+                    'jitter' : math.sqrt(self.m2 / n) if n else 0.0,
+                    'drift' : self.sxy / self.sxx if self.sxx else 0.0,
+                    'write' : {'mean' : self.write / n if n else 0.0,'max' : self.maxwrite}}
+
+class timinglog(object):
+    """every trigger's timing, as a csv file, prefix.timing.csv."""
+    def __init__(self,prefix,policy=ti2clog.defaultflushpolicy):
+        self.f = ti2clog.logbuffer('{}.timing.csv'.format(prefix),policy)
+        self.f.write('slot,bus,due (ns),actual (ns),late (us),write (us)\n')
+        self.f.endrow()
+
+    def add(self,slot,bus,timing):
+        """one trigger's timing, (due,actual,write) in ns, as the trigger queues it."""
+        due,actual,write = timing
+        self.f.write('{},{},{},{},{:.3f},{:.3f}\n'.format(slot,bus,due,actual,(actual - due) / 1000,write / 1000))
+        self.f.endrow()
+
+    def poll(self):
+        self.f.poll()
+
+    def close(self):
+        self.f.close()
@@ -0,0 +1,308 @@
+#!/usr/bin/python3
+# ti2ccodec.py - compact sample logs for sensors from J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+#
+# ti2ccodec.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Now that that's out of the way...
+# Samples barely change from one to the next: a raw code moves a few counts, and trigger
+# times come round like clockwork. A compact log stores only the changes:
+#
+#   offset | size | contents
+#   -------+------+------------------------------------------------------------
+#        0 |    8 | magic: b'TI2CCOD1'
+#        8 |    4 | uint32: length of the json header.
+#       12 |    n | json header; as a binary log's (see ti2clog.py), plus 'time base',
+#          |      | the start time in ns since the epoch, and 'clock offset', the wall
+#          |      | clock less the monotonic clock at the start, in ns.
+#     12+n |  ... | records.
+#
+# Times are in ns. Every number in a record is a varint: 7 bits a byte, least significant
+# first, the top bit set on every byte but the last. Signed numbers are zigzagged first (0,
+# -1, 1, -2, ... to 0, 1, 2, 3, ...), so small changes either way take a byte. Records are:
+#
+#   triggered  - one per trigger: the time's delta of delta (the change in the interval
+#                since the trigger before), the change in the clock offset, then the change
+#                in raw code since the trigger before, for each sensor, then the change in
+#                read latency (read monotonic time less the trigger's), for each sensor.
+#   continuous - one per sample: sensor #, then the delta of delta of that sensor's time,
+#                the change in the clock offset, and the change in that sensor's raw code.
+#
+# Every time is stamped on both clocks (see ti2cclock.stamp()); the monotonic time is the
+# wall time less the clock offset, which only changes when the wall clock is stepped, or by
+# the few ns between reading one clock and the other. A sample's read time on the wall clock
+# is its trigger's, plus the read latency; a sensor that missed the trigger has latency 0.
+# Before the first record, every time is the time base, every raw code & latency 0, and the
+# offset the clock offset. A steady triggered row of eight sensors is about thirty bytes,
+# against three hundred or so as csv. Version 1 logs have times in us, and only the times &
+# raw codes; their monotonic & read times are 0.
+# Temperatures aren't stored at all: the header has each sensor's slope, intercept,
+# calibration & units, so the reader works them out from the raw codes, exactly as the
+# logger did. A log cut short by a power failure just ends at its last whole record.
+# __doc__
+"""ti2ccodec python module; defines class encoder for writing compact logs, and codecreader, with decode(), for reading them."""
+
+import os
+import json
+import struct
+import time
+import gzip
+import lzma
+
+import ti2clog
+import ti2ccal
+import ti2cclock
+
+try:
+    import numpy
+except ImportError:     # only needed by codecreader.
+    numpy = None
+
+magic = b'TI2CCOD1'
+extension = '.tcz'
+preamble = struct.Struct('<8sI')
+
+def putvarint(out,n):
+    """append signed n, zigzagged, to bytearray out as a varint."""
+    n = n << 1 if n >= 0 else (-n << 1) - 1
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+def putuvarint(out,n):
+    """append n (>= 0) to bytearray out as a varint."""
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+class encoder(object):
+    def __init__(self,f,sensors,continuous=False,sampleperiod=None,starttime=None):
+        """encoder __init__; f is a logbuffer, sensors a list of tempsensor objects; writes the header.
+        The same interface as ti2clog.logwriter, so the logger can use either."""
+        self.f = f
+        self.nsensors = len(sensors)
+        self.continuous = continuous
+        monotonic,wall = ti2cclock.stamp()
+        self.starttime = wall / 1e9 if starttime is None else starttime
+        self.base = ti2clog.ns(self.starttime)
+        # the encoder's state: previous time & interval (one per sensor, in continuous mode), clock offset, raw code & latency.
+        self.last = [self.base] * (self.nsensors if continuous else 1)
+        self.interval = [0] * len(self.last)
+        self.offset = wall - monotonic
+        self.raw = [0] * self.nsensors
+        self.latency = [0] * self.nsensors
+        header = {'version' : 2,
+                  'acquisition' : 'continuous' if continuous else 'triggered',
+                  'sample period' : None if continuous else sampleperiod,
+                  'start time' : time.asctime(time.localtime(self.starttime)),
+                  'time base' : self.base,
+                  'clock offset' : self.offset,
+                  'sensors' : [ti2clog.sensorinfo(s) for s in sensors]}
+        header = json.dumps(header).encode('utf-8')
+        self.f.write(preamble.pack(magic,len(header)))
+        self.f.write(header)
+        self.f.checkpoint('compact')
+
+    def __time(self,n,t):
+        """the delta of delta of time t (ns) for time series n."""
+        interval = t - self.last[n]
+        dod = interval - self.interval[n]
+        self.last[n] = t
+        self.interval[n] = interval
+        return dod
+
+    def __offset(self,stamp):
+        """the change in the clock offset, from a (monotonic,wall) stamp."""
+        offset = stamp[1] - stamp[0]
+        change = offset - self.offset
+        self.offset = offset
+        return change
+
+    def writerow(self,stamp,raw,cooked=None,reads=None):
+        """triggered: one sample from every sensor, in header order, from the trigger at stamp, and read at reads (stamps are
+        (monotonic,wall) ns); cooked isn't stored. None for a sensor with no sample; it's stored as ti2clog.missingraw."""
+        out = bytearray()
+        putvarint(out,self.__time(0,stamp[1]))
+        putvarint(out,self.__offset(stamp))
+        last = self.raw
+        for i,r in enumerate(raw):
+            if r is None:
+                r = ti2clog.missingraw
+            putvarint(out,r - last[i])
+            last[i] = r
+        last = self.latency
+        for i,r in enumerate(reads or [None] * self.nsensors):
+            latency = 0 if r is None else r[0] - stamp[0]
+            putvarint(out,latency - last[i])
+            last[i] = latency
+        self.f.write(bytes(out))
+        self.f.endrow(1,stamp[1] / 1e9)
+
+    def writesamples(self,samples):
+        """continuous: (stamp,sensor #,raw,cooked) samples, in time order, stamp when it was read, (monotonic,wall) ns;
+        cooked isn't stored."""
+        out = bytearray()
+        n = 0
+        t = None
+        last = self.raw
+        for t,s,r,_ in samples:
+            putuvarint(out,s)
+            putvarint(out,self.__time(s,t[1]))
+            putvarint(out,self.__offset(t))
+            putvarint(out,r - last[s])
+            last[s] = r
+            n += 1
+        if n:
+            self.f.write(bytes(out))
+            self.f.endrow(n,t[1] / 1e9)
+
+    def close(self,endtime=None):
+        """close the file; a compact log has no end time to stamp, it ends where the records do."""
+        self.f.close()
+
+def decode(data,header,offset=0):
+    """decode the records in data, from offset, to (times in ns,monotonic times,sensor #s,raw codes,read latencies); triggered
+    logs have no sensor #s (None), and a list of raw codes & latencies, in header order, for every time. version 1 logs have
+    neither monotonic times nor latencies (None)."""
+    nsensors = len(header['sensors'])
+    continuous = header['acquisition'] == 'continuous'
+    stamped = header.get('version',1) >= 2
+    scale = 1 if stamped else 1000          # version 1 times are in us.
+    times = []
+    monotonic = [] if stamped else None
+    sensors = [] if continuous else None
+    raws = []
+    latencies = [] if stamped and not continuous else None
+    n = len(data)
+    pos = offset
+    last = [header['time base'] * scale] * (nsensors if continuous else 1)
+    interval = [0] * len(last)
+    clockoffset = header.get('clock offset',0)
+    raw = [0] * nsensors
+    latency = [0] * nsensors
+    if continuous:
+        fields = 4 if stamped else 3
+    else:
+        fields = nsensors * 2 + 2 if stamped else nsensors + 1
+    while pos < n:
+        # a record's worth of varints; everything's local, since this is where the time goes.
+        values = []
+        for _ in range(fields):
+            if pos >= n:
+                return times,monotonic,sensors,raws,latencies   # the log ends part way through a record.
+            b = data[pos]
+            pos += 1
+            if b < 0x80:                        # most values fit in a byte.
+                values.append(b)
+                continue
+            v = b & 0x7f
+            shift = 7
+            while True:
+                if pos >= n:
+                    return times,monotonic,sensors,raws,latencies
+                b = data[pos]
+                pos += 1
+                v |= (b & 0x7f) << shift
+                if b < 0x80:
+                    break
+                shift += 7
+            values.append(v)
+        if stamped:
+            o = values.pop(2 if continuous else 1)
+            clockoffset += (o >> 1) ^ -(o & 1)
+        if continuous:
+            s = values[0]
+            t = values[1]
+            r = values[2]
+            interval[s] += ((t >> 1) ^ -(t & 1)) * scale
+            last[s] += interval[s]
+            raw[s] += (r >> 1) ^ -(r & 1)
+            times.append(last[s])
+            sensors.append(s)
+            raws.append(raw[s])
+        else:
+            t = values[0]
+            interval[0] += ((t >> 1) ^ -(t & 1)) * scale
+            last[0] += interval[0]
+            for i in range(nsensors):
+                r = values[i + 1]
+                raw[i] += (r >> 1) ^ -(r & 1)
+            times.append(last[0])
+            raws.append(list(raw))
+            if stamped:
+                for i in range(nsensors):
+                    d = values[nsensors + i + 1]
+                    latency[i] += (d >> 1) ^ -(d & 1)
+                latencies.append(list(latency))
+        if stamped:
+            monotonic.append(times[-1] - clockoffset)
+    return times,monotonic,sensors,raws,latencies
+
+def cook(sensor,raw):
+    """a numpy array of raw codes from the header's sensor to temperatures in its units, as the logger worked them out;
+    NaN where the sensor had no sample (ti2clog.missingraw)."""
+    raw = numpy.asarray(raw,dtype=numpy.int64)
+    missing = raw == ti2clog.missingraw
+    if sensor['calibration']:
+        tempC = numpy.frombuffer(ti2ccal.buildlut(sensor['calibration'],sensor['mode']))[numpy.where(missing,0,raw) + ti2ccal.lutoffset(sensor['mode'])]
+    else:
+        tempC = raw * sensor['slope'] + sensor['intercept']
+    if missing.any():
+        tempC = numpy.where(missing,numpy.nan,tempC)
+    if sensor['units'] == 1:
+        return tempC + 273.15
+    if sensor['units'] == 2:
+        return tempC * 9 / 5 + 32
+    return tempC
+
+class codecreader(ti2clog.logreader):
+    def __init__(self,filename):
+        """codecreader __init__; decodes a compact log into records laid out as a binary log's; see ti2clog.logreader."""
+        if numpy is None:
+            raise ImportError('codecreader requires the numpy module.')
+        self.filename = filename
+        opener = {'.gz' : gzip.open,'.xz' : lzma.open}.get(os.path.splitext(filename)[1],open)
+        with opener(filename,'rb') as f:
+            data = f.read()
+        mark,headerlength = preamble.unpack_from(data)
+        if mark != magic:
+            raise ValueError('{} is not a ti2c compact log.'.format(filename))
+        self.header = json.loads(data[preamble.size:preamble.size + headerlength].decode('utf-8'))
+        self.sensors = self.header['sensors']
+        self.continuous = self.header['acquisition'] == 'continuous'
+        self.dtype = numpy.dtype(ti2clog.recordlayout(len(self.sensors),self.continuous))
+        times,monotonic,sensors,raws,latencies = decode(data,self.header,preamble.size + headerlength)
+        self.records = numpy.zeros(len(times),dtype=self.dtype)
+        self.records['time'] = times
+        if monotonic is not None:
+            self.records['monotonic'] = monotonic
+        if self.continuous:
+            self.records['sensor'] = sensors
+            self.records['raw'] = raws
+            for i,s in enumerate(self.sensors):
+                mine = self.records['sensor'] == i
+                self.records['temp'][mine] = cook(s,self.records['raw'][mine])
+        elif len(times):
+            self.records['raw'] = raws
+            for i,s in enumerate(self.sensors):
+                self.records['temp'][:,i] = cook(s,self.records['raw'][:,i])
+            if latencies is not None:
+                latencies = numpy.array(latencies,dtype=numpy.int64)
+                read = self.records['raw'] != ti2clog.missingraw
+                self.records['readtime'] = numpy.where(read,self.records['time'][:,None] + latencies,0)
+                self.records['readmonotonic'] = numpy.where(read,self.records['monotonic'][:,None] + latencies,0)
+        self.starttime = self.header['time base'] * (1 if self.header.get('version',1) >= 2 else 1000)
+        self.endtime = int(self.records['time'][-1]) if len(times) else 0      # as good as it gets; see encoder.close().
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+# ti2cdb.py - sqlite sample databases for sensors from J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+#
+# ti2cdb.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Now that that's out of the way...
+# Log files are one per run (or per segment); finding last March's samples means finding the
+# right files, then reading them. A sample database keeps every run in one sqlite file:
+#
+#   runs    - one row per run: run #, start & end time (ns since the epoch), acquisition
+#             (triggered or continuous), sample period, and the jtlogc configuration as json.
+#   sensors - one row per sensor per run: everything in a binary log's header (see
+#             ti2clog.sensorinfo()); mode, calibration, slope & intercept, and so on.
+#   samples - one row per sample: time (ns since the epoch), I2C address, run #, sensor #
+#             (in the run's sensors table), raw code, and temperature in the sensor's units;
+#             then the monotonic time (ns) to go with time, and the wall & monotonic times
+#             the sample was read at. time is the trigger's, or in continuous mode, the
+#             read's; see ti2cclock.stamp(). Databases from before these were kept have
+#             them added, empty for the samples already in them.
+#
+# samples is indexed on (time,address), so a time range comes straight out of the index,
+# however many months are in the database:
+#
+#   import ti2cdb
+#   db = ti2cdb.dbreader('jtlog.db')
+#   db.between(time.time() - 3600,time.time())      # the last hour: (time,address,run,sensor,raw,temp) rows
+#
+# The database is in WAL mode, so it can be read while sampling carries on. Samples are
+# inserted in batches, one transaction per batch; when a batch is committed is the flush
+# policy's say (see ti2clog.py): every n rows, every t seconds, or, with 'shutdown', when
+# the batch is full and when sampling stops. Every commit is synced to the card.
+# __doc__
+"""ti2cdb python module; defines classes dbwriter and dbreader for sqlite sample databases."""
+
+import os
+import json
+import time
+import sqlite3
+
+import ti2clog
+
+extension = '.db'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY,starttime INTEGER,endtime INTEGER,
+                                 acquisition TEXT,sampleperiod REAL,config TEXT);
+CREATE TABLE IF NOT EXISTS sensors (run INTEGER,sensor INTEGER,location TEXT,bus INTEGER,channel INTEGER,
+                                    address INTEGER,mode INTEGER,resolution INTEGER,samplerate REAL,
+                                    units INTEGER,unit TEXT,slope REAL,intercept REAL,calibration TEXT,
+                                    PRIMARY KEY (run,sensor));
+CREATE TABLE IF NOT EXISTS samples (time INTEGER,address INTEGER,run INTEGER,sensor INTEGER,raw INTEGER,temp REAL,
+                                    monotonic INTEGER,readtime INTEGER,readmonotonic INTEGER);
+CREATE INDEX IF NOT EXISTS samples_time ON samples (time,address);
+'''
+stampcolumns = ('monotonic','readtime','readmonotonic')     # the samples columns a database made before them lacks.
+
+def connect(filename):
+    """open (or create) a sample database."""
+    db = sqlite3.connect(filename)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=FULL')       # a commit is on the card when it returns.
+    db.executescript(schema)
+    columns = [c[1] for c in db.execute('PRAGMA table_info(samples)')]
+    with db:
+        for c in stampcolumns:
+            if c not in columns:
+                db.execute('ALTER TABLE samples ADD COLUMN {} INTEGER'.format(c))
+    return db
+
+class dbwriter(object):
+    batchsize = 10000       # samples held before a commit, whatever the policy.
+
+    def __init__(self,filename,sensors,continuous=False,sampleperiod=None,policy=ti2clog.defaultflushpolicy,config=None):
+        """dbwriter __init__; adds a run, and its sensors, to the database filename; config is the jtlogc configuration, if any."""
+        self.kind,self.every = ti2clog.parseflushpolicy(policy)
+        self.filename = filename
+        self.db = connect(filename)
+        self.addresses = [s.get_address() for s in sensors]
+        self.pending = []       # sample rows not committed yet.
+        self.rows = 0
+        self.due = time.monotonic() + (self.every if self.kind == 'seconds' else 0)
+        with self.db:
+            self.run = self.db.execute('INSERT INTO runs (starttime,endtime,acquisition,sampleperiod,config) VALUES (?,0,?,?,?)',
+                                       (ti2clog.ns(time.time()),'continuous' if continuous else 'triggered',
+                                        None if continuous else sampleperiod,json.dumps(config))).lastrowid
+            for n,s in enumerate(sensors):
+                info = ti2clog.sensorinfo(s)
+                self.db.execute('INSERT INTO sensors VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                                (self.run,n,info['location'],info['bus'],info['channel'],info['address'],info['mode'],
+                                 info['resolution'],info['samplerate'],info['units'],info['unit'],info['slope'],
+                                 info['intercept'],None if info['calibration'] is None else json.dumps(info['calibration'])))
+
+    def writerow(self,stamp,raw,cooked,reads):
+        """triggered: one sample from every sensor, in the order they were given, from the trigger at stamp, and read at reads
+        (stamps are (monotonic,wall) ns); None for a sensor with no sample, which is left out."""
+        monotonic,t = stamp
+        self.pending.extend([(t,a,self.run,n,r,c,monotonic,read[1],read[0])
+                             for n,(a,r,c,read) in enumerate(zip(self.addresses,raw,cooked,reads)) if r is not None])
+        self.rows += 1
+        self.poll()
+
+    def writesamples(self,samples):
+        """continuous: (stamp,sensor #,raw,cooked) samples; stamp is when it was read, (monotonic,wall) ns."""
+        n = len(self.pending)
+        self.pending.extend([(t[1],self.addresses[s],self.run,s,r,c,t[0],t[1],t[0]) for t,s,r,c in samples])
+        self.rows += len(self.pending) - n
+        self.poll()
+
+    def poll(self):
+        """commit if the policy says it's time, or the batch is full."""
+        if ((self.kind == 'rows' and self.rows >= self.every) or (self.kind == 'seconds' and self.rows and time.monotonic() >= self.due)
+            or len(self.pending) >= self.batchsize):
+            self.commit()
+
+    def commit(self):
+        """insert the pending samples, in one transaction."""
+        with self.db:
+            self.db.executemany('INSERT INTO samples (time,address,run,sensor,raw,temp,monotonic,readtime,readmonotonic) '
+                                'VALUES (?,?,?,?,?,?,?,?,?)',self.pending)
+        self.pending = []
+        self.rows = 0
+        if self.kind == 'seconds':
+            self.due = time.monotonic() + self.every
+
+    def tell(self):
+        """the size of the database on the card, with its write-ahead log; what's pending isn't counted."""
+        return sum([os.path.getsize(f) for f in (self.filename,self.filename + '-wal') if os.path.exists(f)])
+
+    def full(self):
+        """a database isn't cut into segments; this is for the datalogger, which asks the same of a log file."""
+        return False
+
+    def close(self,endtime=None):
+        """commit what's left, and stamp the run's end time."""
+        self.commit()
+        with self.db:
+            self.db.execute('UPDATE runs SET endtime = ? WHERE run = ?',(ti2clog.ns(time.time() if endtime is None else endtime),self.run))
+        self.db.close()
+
+class dbreader(object):
+    def __init__(self,filename):
+        """dbreader __init__; opens a sample database for reading."""
+        self.filename = filename
+        self.db = sqlite3.connect('file:{}?mode=ro'.format(filename),uri=True)
+
+    def runs(self):
+        """(run,starttime,endtime,acquisition,sampleperiod) for every run; times in ns since the epoch."""
+        return self.db.execute('SELECT run,starttime,endtime,acquisition,sampleperiod FROM runs ORDER BY run').fetchall()
+
+    def sensors(self,run):
+        """the sensors of a run, as dictionaries, in sensor # order."""
+        cursor = self.db.execute('SELECT * FROM sensors WHERE run = ? ORDER BY sensor',(run,))
+        names = [d[0] for d in cursor.description]
+        sensors = [dict(zip(names,row)) for row in cursor]
+        for s in sensors:
+            s['calibration'] = s['calibration'] and json.loads(s['calibration'])
+        return sensors
+
+    def config(self,run):
+        """the jtlogc configuration a run was made with, or None."""
+        return json.loads(self.db.execute('SELECT config FROM runs WHERE run = ?',(run,)).fetchone()[0])
+
+    def between(self,start=None,stop=None,address=None,stamps=False):
+        """(time,address,run,sensor,raw,temp) samples from time start up to, but not including, stop (seconds since the epoch;
+        None is open-ended), in time order; all addresses, or just one. stamps adds (monotonic,readtime,readmonotonic)."""
+        query = 'SELECT time,address,run,sensor,raw,temp{} FROM samples WHERE time >= ? AND time < ?'.format(''.join(',' + c for c in stampcolumns) if stamps else '')
+        args = [ti2clog.ns(start) if start is not None else -1 << 63,ti2clog.ns(stop) if stop is not None else (1 << 63) - 1]
+        if address is not None:
+            query += ' AND address = ?'
+            args.append(address)
+        return self.db.execute(query + ' ORDER BY time,address',args).fetchall()
+
+    def close(self):
+        self.db.close()
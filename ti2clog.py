@@ -0,0 +1,818 @@
+#!/usr/bin/python3
+# ti2clog.py - binary log files for sensors from J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+#
+# ti2clog.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Now that that's out of the way...
+# csv logs are easy to look at, but every sample costs a strftime and three number formats to
+# write, and parsing them all back again to read. A binary log is a short header, then fixed
+# width records, all little-endian:
+#
+#   offset | size | contents
+#   -------+------+------------------------------------------------------------
+#        0 |    8 | magic: b'TI2CLOG1'
+#        8 |    4 | uint32: length of the json header, including padding.
+#       12 |    4 | uint32: reserved, 0.
+#       16 |    8 | int64: start time, ns since the epoch.
+#       24 |    8 | int64: end time, ns since the epoch; 0 until the log is closed.
+#       32 |    n | json header, space padded so the records start on a multiple of 8.
+#     32+n |  ... | records.
+#
+# The json header describes the sensors (bus, channel, address, mode, units, slope, intercept
+# and calibration profile; see sensorinfo()), how they were sampled, and the record layout as
+# a numpy dtype description. Records are:
+#
+#   triggered  - one per trigger: int64 time (ns since the epoch) & int64 monotonic time
+#                (ns) of the trigger, then int32 raw code for each sensor, then float32
+#                temperature (in the sensor's units) for each, then the int64 wall & int64
+#                monotonic times each sensor's sample was read at. A sensor that missed the
+#                trigger has raw code missingraw, temperature NaN & read times 0.
+#   continuous - one per sample: int64 time & int64 monotonic time it was read at, int32
+#                sensor # (index into the header's sensor list), int32 raw code, float32
+#                temperature. Records are written in time order across all sensors.
+#
+# Every time stamp is on both clocks (see ti2cclock.stamp()): the monotonic times give exact
+# intervals, read latencies say, and time - monotonic changes only when the wall clock is
+# stepped. Version 1 logs have time, and the sensors' raw codes & temperatures, only.
+#
+# Either way the times only go forward, so a reader can find a time by binary search. The
+# writer needs nothing beyond the standard library; logreader needs numpy, and maps the file
+# rather than reading it, so opening even a year's worth is instant.
+#
+# All logs, csv & binary, jtlog's & jtlogc's, are written through a logbuffer: rows are
+# gathered in memory and written a batch at a time, one system call per batch, and made
+# durable (fsync) according to a flush policy:
+#   'rows:<n>'      - every n rows; at most n rows are lost if the power goes.
+#   'seconds:<t>'   - every t seconds; at most t seconds' worth are lost.
+#   'shutdown'      - only when the log is closed; until then, batches are written as they
+#                     fill (see logbuffer.batchsize), and it's up to the OS when they reach
+#                     the card. The fewest writes, but no bound on what's lost.
+# Fewer, larger writes matter on the SD card of a pi, where every small write rewrites a
+# whole flash page.
+#
+# A long campaign needn't be one enormous file: a rotation policy cuts the log into segments,
+# each a complete log with its own header, so any one of them can be read on its own:
+#   'none'          - one file per run.
+#   'size:<MB>'     - a new segment once one reaches <MB> megabytes.
+#   'hours:<h>'     - a new segment every <h> hours, on the clock: counted from local
+#                     midnight, so 'hours:1' cuts on the hour and 'hours:24' at midnight.
+# Closed segments can be compressed, gzip (.gz) or lzma (.xz; smaller, but much slower), by
+# a compressor: a thread of its own, at the lowest priority, so it only gets the processor
+# when sampling doesn't want it. logreader reads compressed segments too, but has to
+# decompress them into memory rather than map them.
+#
+# csv rows vary in length, so finding a time in a csv log means reading up to it. Instead,
+# csv logs are indexed as they're written: a sidecar file, <log>.idx (kept as is when the
+# log is compressed), holds the time & byte offset of every n'th row:
+#
+#   offset | size | contents
+#   -------+------+------------------------------------------------------------
+#        0 |    8 | magic: b'TI2CIDX1'
+#        8 |    4 | uint32: n, rows per entry.
+#       12 |    4 | uint32: reserved, 0.
+#       16 |    8 | int64: slack, ns; rows can be up to this much earlier than the entry
+#          |      | before them (continuous mode, where a block at a time is written).
+#       24 |  ... | entries: int64 time, ns since the epoch; int64 offset of the row.
+#
+# csvrows() bisects the index and seeks straight to the rows wanted; buildindex() makes
+# the same index for a log that hasn't one. Older jtlog logs' rows have no time stamps, so for
+# those the times come from the index, and are interpolated between entries.
+#
+# csvsamples() goes one further, and splits the rows into samples, whichever program wrote
+# them: jtlogc's rows are 'time,monotonic,,label,raw,temp,read monotonic,read time' once per
+# sensor (',label,raw,temp' once per row, in continuous mode); jtlog's are 'time,monotonic',
+# then a cell per sensor, 'raw,temp', or just one of them, in the order of the column
+# headings, and empty on rows the sensor wasn't read. The times are ns, but jtlogc's time is
+# local time, 'yyyy/mm/dd hh:mm:ss.nnnnnnnnn', to be read as it is. Older logs have no
+# monotonic times, and no read times: jtlogc's rows start 'yyyy/mm/dd hh:mm:ss.mmm,', and
+# jtlog's have no time stamps at all.
+#
+# A log that's closed has its end time stamped (csv: the 'dnE time: ' line becomes 'End
+# time: '; binary: the preamble's end time); one cut off by a power failure or a crash
+# hasn't, and may end part way through a row, or in a run of zeros the file system never
+# got to fill in. So, while a log is open, every sync appends a checkpoint to a sidecar,
+# <log>.ckpt, once the sync has returned:
+#
+#   offset | size | contents
+#   -------+------+------------------------------------------------------------
+#        0 |    8 | magic: b'TI2CCKP1'
+#        8 |    4 | uint32: the kind of log, as checkpointkinds.
+#       12 |    4 | uint32: reserved, 0.
+#       16 |    8 | int64: position of the end time to stamp; -1 if there isn't one.
+#       24 |  ... | checkpoints: int64 rows, int64 time of the latest row (ns since the
+#          |      | epoch, 0 if not known), int64 bytes on the card, uint32 crc32 of those
+#          |      | 24 bytes, uint32 reserved.
+#
+# Closing the log removes the sidecar, so one that's still there (and not locked by the
+# logger) belongs to a log that was never finished. recover() takes the last intact
+# checkpoint, checks only the rows written after it (no more than the flush policy allows),
+# cuts off anything after the last good row, and stamps the end time; however long the log.
+# __doc__
+"""ti2clog python module; defines classes logwriter and logreader for binary log files, logbuffer & compressor for writing any log,
+and indexwriter & csvindex, with csvrows(), csvsamples() & buildindex(), for indexing & reading csv logs; recover() finishes logs that weren't closed."""
+
+import os
+import sys
+import glob
+import json
+import struct
+import time
+import array
+import bisect
+import gzip
+import lzma
+import queue
+import threading
+import fcntl
+import zlib
+
+try:
+    import numpy
+except ImportError:     # only needed by logreader.
+    numpy = None
+
+magic = b'TI2CLOG1'
+extension = '.tlog'
+preamble = struct.Struct('<8sIIqq')
+alignment = 8
+missingraw = -(1 << 31)     # triggered: the raw code of a sensor with no sample for the row; no ADC gives it.
+
+defaultflushpolicy = 'seconds:5'
+defaultrotation = 'none'
+compressions = {'none' : '','gzip' : '.gz','lzma' : '.xz'}     # and the suffix each adds to a segment's name.
+
+def parseflushpolicy(policy):
+    """a flush policy string to (kind,every): ('rows',n), ('seconds',t) or ('shutdown',None); ValueError if it's not one."""
+    kind,_,every = policy.strip().partition(':')
+    if kind == 'shutdown' and not every:
+        return kind,None
+    if kind == 'rows' and int(every) > 0:
+        return kind,int(every)
+    if kind == 'seconds' and float(every) > 0:
+        return kind,float(every)
+    raise ValueError('flush policy must be rows:<n>, seconds:<t> or shutdown, not {}.'.format(policy))
+
+def parserotation(policy):
+    """a rotation policy string to (kind,every): ('none',None), ('size',bytes) or ('hours',seconds); ValueError if it's not one."""
+    kind,_,every = policy.strip().partition(':')
+    if kind == 'none' and not every:
+        return kind,None
+    if kind == 'size' and float(every) > 0:
+        return kind,int(float(every) * (1 << 20))
+    if kind == 'hours' and float(every) > 0:
+        return kind,float(every) * 3600
+    raise ValueError('rotation policy must be none, size:<MB> or hours:<h>, not {}.'.format(policy))
+
+def nextcut(every,now=None):
+    """the time (time.time() style) of the next segment boundary, every seconds, counted from local midnight."""
+    now = time.time() if now is None else now
+    midnight = time.mktime(time.localtime(now)[:3] + (0,0,0,0,0,-1))
+    return midnight + (int((now - midnight) // every) + 1) * every
+
+class logbuffer(object):
+    batchsize = 1 << 16     # bytes held before a write, whatever the policy.
+
+    def __init__(self,filename,policy=defaultflushpolicy,rotation=defaultrotation):
+        """logbuffer __init__; creates (or truncates) filename; policy is a flush policy, see parseflushpolicy(),
+        and rotation a rotation policy, see parserotation(); the logbuffer only says when it's full(), though."""
+        self.kind,self.every = parseflushpolicy(policy)
+        self.rotation,self.limit = parserotation(rotation)
+        self.cut = nextcut(self.limit) if self.rotation == 'hours' else None
+        self.filename = filename
+        self.fd = os.open(filename,os.O_WRONLY | os.O_CREAT | os.O_TRUNC,0o644)
+        self.pending = []       # bytes not written yet.
+        self.size = 0
+        self.offset = 0         # file position of the first pending byte.
+        self.rows = 0           # rows since the last sync.
+        self.due = time.monotonic() + (self.every if self.kind == 'seconds' else 0)
+        self.writes = 0         # system calls, for the curious.
+        self.syncs = 0
+        self.total = 0          # rows, all told.
+        self.last = None        # the time of the latest row, if the writer says; see endrow().
+        self.ckpt = None        # the checkpoint file, if checkpoint() was called.
+
+    def write(self,data):
+        """queue data (bytes, or str, which is encoded as utf-8) for writing; returns the file position it will be at."""
+        if isinstance(data,str):
+            data = data.encode('utf-8')
+        position = self.offset + self.size
+        self.pending.append(data)
+        self.size += len(data)
+        return position
+
+    def tell(self):
+        """the size of the file, counting what's queued."""
+        return self.offset + self.size
+
+    def full(self):
+        """True once the segment is as big, or as old, as the rotation policy allows; time to start another."""
+        if self.rotation == 'size':
+            return self.tell() >= self.limit
+        if self.rotation == 'hours':
+            return time.time() >= self.cut
+        return False
+
+    def endrow(self,n=1,timestamp=None):
+        """count n complete rows, the latest taken at timestamp, if given, and write or sync if the policy says it's time."""
+        self.rows += n
+        self.total += n
+        if timestamp is not None and (self.last is None or timestamp > self.last):
+            self.last = timestamp
+        self.poll()
+
+    def poll(self):
+        """write or sync if it's time; call now & then if rows stop coming, so a 'seconds' policy still holds."""
+        if (self.kind == 'rows' and self.rows >= self.every) or (self.kind == 'seconds' and self.rows and time.monotonic() >= self.due):
+            self.sync()
+        elif self.size >= self.batchsize:
+            self.flush()
+
+    def flush(self):
+        """write everything queued, in one system call (more, only if the OS takes less than all of it)."""
+        if self.pending:
+            data = memoryview(b''.join(self.pending))
+            self.pending = []
+            while len(data):
+                n = os.write(self.fd,data)
+                self.writes += 1
+                data = data[n:]
+            self.offset += self.size
+            self.size = 0
+
+    def sync(self):
+        """write everything queued, and wait until it's on the card."""
+        self.flush()
+        os.fsync(self.fd)
+        self.syncs += 1
+        self.rows = 0
+        if self.ckpt is not None:
+            # only written once what it describes is on the card, so it needn't be synced itself; if it's lost, the one before still holds.
+            state = struct.pack('<qqq',self.total,0 if self.last is None else ns(self.last),self.offset)
+            os.write(self.ckpt,state + struct.pack('<II',zlib.crc32(state),0))
+        if self.kind == 'seconds':
+            self.due = time.monotonic() + self.every
+
+    def pwrite(self,data,position):
+        """overwrite what's already at position (e.g. a time stamp in a header); anything queued is written first."""
+        if isinstance(data,str):
+            data = data.encode('utf-8')
+        self.flush()
+        os.pwrite(self.fd,data,position)
+
+    def checkpoint(self,kind,endstamp=-1):
+        """keep checkpoints from now on, see recover(); kind is one of checkpointkinds, endstamp the position of the end time, if any."""
+        self.ckpt = os.open(checkpointname(self.filename),os.O_WRONLY | os.O_CREAT | os.O_TRUNC,0o644)
+        fcntl.flock(self.ckpt,fcntl.LOCK_EX | fcntl.LOCK_NB)     # recover() leaves a log that's still being written alone.
+        os.write(self.ckpt,checkpointpreamble.pack(checkpointmagic,checkpointkinds.index(kind),0,endstamp))
+
+    def close(self):
+        self.sync()
+        os.close(self.fd)
+        if self.ckpt is not None:       # the log's complete; no checkpoints means it was closed.
+            os.close(self.ckpt)
+            os.remove(checkpointname(self.filename))
+
+def compress(filename,method):
+    """compress filename (method is 'gzip' or 'lzma'), then remove it; returns the name of the compressed file."""
+    target = filename + compressions[method]
+    part = target + '.part'                 # never a half written target, whatever happens.
+    with open(filename,'rb') as src, open(part,'wb') as raw:
+        if method == 'gzip':
+            dst = gzip.GzipFile(os.path.basename(filename),'wb',9,raw)
+        else:
+            dst = lzma.LZMAFile(raw,'wb')
+        with dst:
+            while True:
+                data = src.read(compressor.chunksize)
+                if not data:
+                    break
+                dst.write(data)
+        raw.flush()
+        os.fsync(raw.fileno())              # the original goes next; the copy had better be on the card.
+    os.replace(part,target)
+    os.remove(filename)
+    return target
+
+class compressor(object):
+    chunksize = 1 << 20     # bytes compressed at a time.
+
+    def __init__(self,method,report=None):
+        """compressor __init__; method is a key of compressions; report, if given, is called with a message when a segment can't be compressed."""
+        if method not in compressions:
+            raise ValueError('compression must be one of {}, not {}.'.format(', '.join(compressions),method))
+        self.method = method
+        self.report = report
+        self.q = queue.Queue()
+        self.tc = threading.Thread(target=self.__compresstask,name='t-compress',args=())
+        self.tc.start()
+
+    def add(self,filename):
+        """queue a closed segment for compression; with method 'none', there's nothing to do."""
+        if self.method != 'none':
+            self.q.put(filename)
+
+    def close(self):
+        """no more segments; doesn't wait. The thread finishes what's queued, and python waits for it at exit."""
+        self.q.put(None)
+
+    def __compresstask(self):
+        try:    # on linux, a thread has a priority of its own; the lowest is 19.
+            os.setpriority(os.PRIO_PROCESS,threading.get_native_id(),19)
+        except (AttributeError,OSError):
+            pass
+        while True:
+            filename = self.q.get()
+            if filename is None:
+                break
+            try:
+                compress(filename,self.method)
+            except OSError as error:
+                if self.report:
+                    self.report('error: cannot compress {}: {}'.format(filename,error))
+
+def ns(t):
+    """a time.time() style float to int64 ns since the epoch."""
+    return int(round(t * 1e9))
+
+def sensorinfo(sensor):
+    """the header entry for a tempsensor."""
+    return {'location' : sensor.get_location(),
+            'bus' : sensor.get_bus(),
+            'channel' : sensor.get_channel(),
+            'address' : sensor.get_address(),
+            'mode' : sensor.get_mode(),
+            'resolution' : sensor.get_resolution(),
+            'samplerate' : sensor.get_samplerate(),
+            'units' : sensor.units,
+            'unit' : sensor.unit[sensor.units],
+            'slope' : sensor.get_slope(),
+            'intercept' : sensor.get_intercept(),
+            'calibration' : sensor.get_calibration()}
+
+def recordlayout(nsensors,continuous):
+    """the record layout, as a list of (name,type[,shape]) fields; numpy.dtype() takes it as is."""
+    if continuous:
+        return [('time','<i8'),('monotonic','<i8'),('sensor','<i4'),('raw','<i4'),('temp','<f4')]
+    return [('time','<i8'),('monotonic','<i8'),('raw','<i4',(nsensors,)),('temp','<f4',(nsensors,)),
+            ('readtime','<i8',(nsensors,)),('readmonotonic','<i8',(nsensors,))]
+
+def recordformat(nsensors,continuous):
+    """the record layout, as a struct format."""
+    if continuous:
+        return '<qqiif'
+    return '<qq{0}i{0}f{0}q{0}q'.format(nsensors)
+
+def recordsize(layout):
+    """the size of a record, from its layout as it is in a header; any version."""
+    codes = {'<i8' : 'q','<i4' : 'i','<f4' : 'f'}
+    return struct.calcsize('<' + ''.join(str(field[2][0] if len(field) > 2 else 1) + codes[field[1]] for field in layout))
+
+def timetext(t):
+    """time t (int ns since the epoch) as a jtlogc csv row's time stamp, local time to the ns: 'yyyy/mm/dd hh:mm:ss.nnnnnnnnn'."""
+    return time.strftime('%Y/%m/%d %H:%M:%S',time.localtime(t // 1000000000)) + '.{:09}'.format(t % 1000000000)
+
+stampsline = 'Time stamps: ns; wall & monotonic clocks.\n'     # in the header of a jtlogc csv log with monotonic times.
+
+class logwriter(object):
+    def __init__(self,f,sensors,continuous=False,sampleperiod=None,starttime=None):
+        """logwriter __init__; f is a logbuffer, sensors a list of tempsensor objects; writes the header."""
+        self.f = f
+        self.nsensors = len(sensors)
+        self.continuous = continuous
+        self.record = struct.Struct(recordformat(self.nsensors,continuous))
+        self.starttime = time.time() if starttime is None else starttime
+        header = {'version' : 2,
+                  'acquisition' : 'continuous' if continuous else 'triggered',
+                  'sample period' : None if continuous else sampleperiod,
+                  'start time' : time.asctime(time.localtime(self.starttime)),
+                  'sensors' : [sensorinfo(s) for s in sensors],
+                  'record' : recordlayout(self.nsensors,continuous)}
+        header = json.dumps(header).encode('utf-8')
+        header += b' ' * (-(preamble.size + len(header)) % alignment)
+        self.f.write(preamble.pack(magic,len(header),0,ns(self.starttime),0))
+        self.f.write(header)
+        self.f.checkpoint('binary',preamble.size - 8)
+
+    def writerow(self,stamp,raw,cooked,reads):
+        """triggered: one sample from every sensor, in header order, from the trigger at stamp, and read at reads; stamps
+        are (monotonic,wall) ns, as ti2cclock.stamp(). None for a sensor with no sample."""
+        if None in raw:
+            raw = [missingraw if r is None else r for r in raw]
+            cooked = [float('nan') if c is None else c for c in cooked]
+            reads = [(0,0) if r is None else r for r in reads]
+        self.f.write(self.record.pack(stamp[1],stamp[0],*raw,*cooked,*[r[1] for r in reads],*[r[0] for r in reads]))
+        self.f.endrow(1,stamp[1] / 1e9)
+
+    def writesamples(self,samples):
+        """continuous: (stamp,sensor #,raw,cooked) samples, in time order; stamp is when it was read, (monotonic,wall) ns."""
+        pack = self.record.pack
+        records = [pack(t[1],t[0],s,r,c) for t,s,r,c in samples]
+        if records:
+            self.f.write(b''.join(records))
+            self.f.endrow(len(records),struct.unpack_from('<q',records[-1])[0] / 1e9)
+
+    def close(self,endtime=None):
+        """stamp the end time in the preamble, and close the file."""
+        self.f.pwrite(struct.pack('<q',ns(time.time() if endtime is None else endtime)),preamble.size - 8)
+        self.f.close()
+
+class logreader(object):
+    def __init__(self,filename):
+        """logreader __init__; maps the records of a binary log; see the header, sensors & records attributes."""
+        if numpy is None:
+            raise ImportError('logreader requires the numpy module.')
+        self.filename = filename
+        opener = {'.gz' : gzip.open,'.xz' : lzma.open}.get(os.path.splitext(filename)[1],open)
+        with opener(filename,'rb') as f:
+            mark,headerlength,_,self.starttime,self.endtime = preamble.unpack(f.read(preamble.size))
+            if mark != magic:
+                raise ValueError('{} is not a ti2c binary log.'.format(filename))
+            self.header = json.loads(f.read(headerlength).decode('utf-8'))
+            data = None if opener is open else f.read()     # a compressed segment can't be mapped.
+        self.sensors = self.header['sensors']
+        self.continuous = self.header['acquisition'] == 'continuous'
+        self.dtype = numpy.dtype([tuple(field[:2]) + tuple(tuple(s) for s in field[2:]) for field in self.header['record']])
+        offset = preamble.size + headerlength
+        if data is None:
+            count = (os.path.getsize(filename) - offset) // self.dtype.itemsize     # a log cut short can end part way through a record.
+        else:
+            count = len(data) // self.dtype.itemsize
+        if count <= 0:
+            self.records = numpy.zeros(0,dtype=self.dtype)
+        elif data is None:
+            self.records = numpy.memmap(filename,dtype=self.dtype,mode='r',offset=offset,shape=(count,))
+        else:
+            self.records = numpy.frombuffer(data,dtype=self.dtype,count=count)
+
+    def __len__(self):
+        return len(self.records)
+
+    def times(self):
+        """record times, in seconds since the epoch (float64; ns are in records['time'])."""
+        return self.records['time'] / 1e9
+
+    def index(self,t):
+        """index of the first record at or after time t (seconds since the epoch)."""
+        return int(numpy.searchsorted(self.records['time'],ns(t)))
+
+    def between(self,start=None,stop=None):
+        """the records from time start up to, but not including, stop (seconds since the epoch; None is open-ended); a view, not a copy."""
+        i = 0 if start is None else self.index(start)
+        j = len(self.records) if stop is None else self.index(stop)
+        return self.records[i:j]
+
+    def sensor(self,n,records=None):
+        """continuous logs: the records (of all of them, by default) from the header's sensor # n."""
+        if records is None:
+            records = self.records
+        if not self.continuous:
+            raise ValueError('triggered logs have every sensor in every record; use records[\'raw\'][:,n].')
+        return records[records['sensor'] == n]
+
+indexmagic = b'TI2CIDX1'
+indexpreamble = struct.Struct('<8sIIq')
+indexentry = struct.Struct('<qq')
+indexevery = 1000       # rows per index entry.
+continuousslack = 1.0   # seconds; how far out of order continuous mode's csv rows can be.
+
+def indexname(logname):
+    """the name of a csv log's index; a compressed log keeps the index it had before."""
+    for suffix in compressions.values():
+        if suffix and logname.endswith(suffix):
+            return logname[:-len(suffix)] + '.idx'
+    return logname + '.idx'
+
+def openlog(logname):
+    """open a log for reading, in binary; compressed logs are decompressed on the fly."""
+    return {'.gz' : gzip.open,'.xz' : lzma.open}.get(os.path.splitext(logname)[1],open)(logname,'rb')
+
+class indexwriter(object):
+    def __init__(self,logname,every=indexevery,slack=0.0,policy=defaultflushpolicy):
+        """indexwriter __init__; creates the index of logname; an entry every every rows; slack in seconds, see above."""
+        self.f = logbuffer(indexname(logname),policy)
+        self.every = every
+        self.rows = 0
+        self.last = None
+        self.f.write(indexpreamble.pack(indexmagic,every,0,ns(slack)))
+
+    def row(self,timestamp,position,n=1):
+        """n rows, the first at file position position, from time timestamp; an entry if one of them is due one."""
+        if self.rows % self.every == 0 or self.rows // self.every != (self.rows + n - 1) // self.every:
+            t = ns(timestamp)
+            self.last = t if self.last is None else max(t,self.last)    # entries only go forward, so they can be bisected.
+            self.f.write(indexentry.pack(self.last,position))
+            self.f.endrow()
+        self.rows += n
+
+    def close(self):
+        self.f.close()
+
+class csvindex(object):
+    def __init__(self,logname):
+        """csvindex __init__; reads the index of logname; see the times & offsets attributes."""
+        with open(indexname(logname),'rb') as f:
+            data = f.read()
+        if len(data) < indexpreamble.size:      # the logger stopped before its first sync; no entries.
+            data = indexpreamble.pack(indexmagic,indexevery,0,0)
+        mark,self.every,_,self.slack = indexpreamble.unpack_from(data)
+        if mark != indexmagic:
+            raise ValueError('{} is not a ti2c csv index.'.format(indexname(logname)))
+        n = (len(data) - indexpreamble.size) // indexentry.size            # an index cut short can end part way through an entry.
+        entries = array.array('q',data[indexpreamble.size:indexpreamble.size + n * indexentry.size])
+        if sys.byteorder != 'little':
+            entries.byteswap()
+        self.times = entries[0::2]
+        self.offsets = entries[1::2]
+
+    def __len__(self):
+        return len(self.times)
+
+    def entry(self,t):
+        """the # of the entry to start reading from, for rows from time t (ns since the epoch) on."""
+        return max(bisect.bisect_right(self.times,t - self.slack) - 1,0)
+
+    def rowtime(self,row,rate=None):
+        """the time (ns) of row # row, interpolated from the entries either side; past the last, rate (Hz) carries on from it."""
+        i = min(row // self.every,len(self.times) - 1)
+        if i + 1 < len(self.times):
+            return self.times[i] + (self.times[i + 1] - self.times[i]) * (row - i * self.every) // self.every
+        return self.times[i] + int((row - i * self.every) * 1e9 / rate) if rate else self.times[i]
+
+def rowtime(line):
+    """the time stamp (ns since the epoch) of a jtlogc csv row, 'yyyy/mm/dd hh:mm:ss.nnnnnnnnn,...' (or .mmm, in older logs);
+    None if it hasn't one."""
+    if len(line) < 24 or line[4:5] != b'/' or line[19:20] != b'.':
+        return None
+    end = 29 if line[23:24] != b',' else 23
+    if line[end:end + 1] != b',':
+        return None
+    try:
+        seconds = int(time.mktime((int(line[0:4]),int(line[5:7]),int(line[8:10]),int(line[11:13]),int(line[14:16]),int(line[17:19]),0,0,-1)))
+        return seconds * 1000000000 + int(line[20:end]) * 10 ** (29 - end)
+    except ValueError:
+        return None
+
+def jtlogtime(line):
+    """the time stamp (ns since the epoch) of a jtlog csv row, 'time,monotonic,...'; None if it hasn't one."""
+    try:
+        return int(line.split(b',',1)[0])
+    except ValueError:
+        return None
+
+def csvheader(f):
+    """read the header of a csv log from f, a log opened with openlog(); returns a dictionary: 'format' is 'jtlog' or 'jtlogc',
+    'lines' the header lines, 'data' the offset of the first row, 'start' the start time (ns), 'continuous' whether continuous
+    mode, 'rate' (jtlog only) the rate rows were taken at (Hz), and 'stamps' whether rows have monotonic times too."""
+    header = {'format' : 'jtlogc','lines' : [],'start' : None,'continuous' : False,'rate' : None,'stamps' : False}
+    while True:
+        position = f.tell()
+        line = f.readline()
+        text = line.decode('utf-8','replace').rstrip('\n')
+        if text.startswith('Date: ') or text.startswith('Start time: '):
+            header['start'] = ns(time.mktime(time.strptime(text.split(': ',1)[1].strip())))
+            header['format'] = 'jtlog' if text.startswith('Date: ') else 'jtlogc'
+        elif text.startswith('Sample period: continuous'):
+            header['continuous'] = True
+        elif text.startswith('Time stamps: '):
+            header['stamps'] = True
+        elif text.startswith('Sensor #') and 'sample freq.=' in text:
+            rate = float(text.split('sample freq.=')[1].split()[0])
+            header['rate'] = max(header['rate'] or 0,rate)
+        elif not (text.startswith('Filename: ') or text.startswith('End time: ') or text.startswith('dnE time: ')
+                  or text.startswith('Sample period: ')):
+            if header['format'] == 'jtlog' and line:        # the column headings; the rows follow.
+                header['lines'].append(text)
+                header['stamps'] = text.startswith('time (ns),')
+                position = f.tell()
+            header['data'] = position
+            return header
+        header['lines'].append(text)
+
+def buildindex(logname,every=indexevery):
+    """index an existing csv log, as the logger would have; older jtlog logs have no time stamps, so the times are
+    nominal: the start time, plus a row every 1/rate seconds. returns the # of rows."""
+    with openlog(logname) as f:
+        header = csvheader(f)
+        index = indexwriter(logname,every,continuousslack if header['continuous'] else 0.0,'shutdown')
+        f.seek(header['data'])
+        rows = 0
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if header['format'] == 'jtlog' and not header['stamps']:
+                t = header['start'] + rows * 1e9 / (header['rate'] or 1)
+            else:
+                t = jtlogtime(line) if header['format'] == 'jtlog' else rowtime(line)
+                if t is None:
+                    continue
+            index.row(t / 1e9,position)
+            rows += 1
+        index.close()
+    return rows
+
+def csvrows(logname,start=None,stop=None):
+    """the rows of a csv log from time start up to, but not including, stop (int ns since the epoch; None is open-ended),
+    as (time ns,line) pairs, line in bytes; through the index, if there is one, or from the top. a generator."""
+    index = csvindex(logname) if os.path.exists(indexname(logname)) else None
+    if index is not None and len(index) == 0:
+        index = None
+    with openlog(logname) as f:
+        header = csvheader(f)
+        slack = index.slack if index else ns(continuousslack if header['continuous'] else 0.0)
+        row = 0
+        if index is not None and start is not None:
+            e = index.entry(start)
+            row = e * index.every
+            f.seek(index.offsets[e])
+        else:
+            f.seek(header['data'])
+        for line in f:
+            if header['format'] == 'jtlog' and not header['stamps']:
+                t = index.rowtime(row,header['rate']) if index else header['start'] + int(row * 1e9 / (header['rate'] or 1))
+            else:
+                t = jtlogtime(line) if header['format'] == 'jtlog' else rowtime(line)
+                if t is None:
+                    continue
+            row += 1
+            if stop is not None and t >= stop + slack:
+                break
+            if (start is None or t >= start) and (stop is None or t < stop):
+                yield t,line
+
+def csvsamples(logname,start=None,stop=None,labels=None):
+    """the samples in a csv log from time start up to, but not including, stop, as (time ns,label,raw,temp) tuples; raw or
+    temp is None if the log hasn't it. labels, if given, is a collection of the sensor labels wanted ('0x68', '3:0x69', ...).
+    a generator, one row in memory at a time; see csvrows()."""
+    with openlog(logname) as f:
+        header = csvheader(f)
+    columns = header['lines'][-1].split(',') if header['format'] == 'jtlog' else []
+    columns = [c for c in columns if c]     # jtlog's sensor labels, in column order.
+    stamped = 2 if header['stamps'] else 0  # jtlog: the time stamp fields before the first cell.
+    columns = columns[stamped:]
+    width = None                            # jtlog: cells per sensor, and what they hold; from the first row.
+    # jtlogc: where the first cell starts, and the fields per sensor; triggered rows have the read times in each cell, too.
+    first = 2 if header['stamps'] else 1
+    cell = 6 if header['stamps'] and not header['continuous'] else 4
+    for t,line in csvrows(logname,start,stop):
+        fields = line.decode('utf-8','replace').rstrip('\n').split(',')
+        if header['format'] == 'jtlogc':
+            for i in range(first,len(fields) - 3,cell):
+                label = fields[i + 1]
+                if not fields[i + 2].strip():   # the sensor missed this trigger.
+                    continue
+                if labels is None or label in labels:
+                    yield t,label,int(fields[i + 2],0),float(fields[i + 3])
+            continue
+        fields = fields[stamped:]
+        if width is None:
+            width = max(len(fields) // (len(columns) or 1),1)
+            cooked = '.' in fields[0]       # a lone column is temperatures if it has a decimal point.
+        i = 0
+        for label in columns:
+            if i >= len(fields):
+                break
+            if not fields[i].strip():       # not read this row.
+                i += 1
+                continue
+            cells = fields[i:i + width]
+            i += width
+            if labels is not None and label not in labels:
+                continue
+            if width == 2:
+                yield t,label,int(cells[0],0),float(cells[1])
+            elif cooked:
+                yield t,label,None,float(cells[0])
+            else:
+                yield t,label,int(cells[0],0),None
+
+checkpointmagic = b'TI2CCKP1'
+checkpointpreamble = struct.Struct('<8sIIq')
+checkpointrecord = struct.Struct('<qqqII')
+checkpointkinds = ('jtlog','jtlogc','binary','compact')     # jtlog & jtlogc are csv logs.
+checkpointsuffix = '.ckpt'
+
+def checkpointname(logname):
+    """the name of a log's checkpoint file."""
+    return logname + checkpointsuffix
+
+def checktail(kind,tail,last,f):
+    """the rows in tail, the part of a log written after the last checkpoint: returns (bytes,rows,latest time ns) of the good
+    rows, up to the first that isn't; last is the time of the latest row before them, f the log, for a binary log's header."""
+    kept = rows = 0
+    if kind in ('jtlog','jtlogc'):
+        for line in tail.split(b'\n')[:-1]:       # after the last newline is part of a row, at best.
+            if kind == 'jtlog':
+                if b'\0' in line:
+                    break
+            else:
+                t = rowtime(line + b'\n')
+                if t is None:
+                    break
+                last = max(t,last)
+            kept += len(line) + 1
+            rows += 1
+    elif kind == 'binary':
+        f.seek(0)
+        _,headerlength,_,_,_ = preamble.unpack(f.read(preamble.size))
+        header = json.loads(f.read(headerlength).decode('utf-8'))
+        size = recordsize(header['record'])
+        for position in range(0,len(tail) - size + 1,size):
+            t = struct.unpack_from('<q',tail,position)[0]
+            if t <= 0 or t < last:                  # records only go forward; zeros were never written.
+                break
+            last = t
+            kept += size
+            rows += 1
+    # a compact log's rows can't be checked without decoding it from the top; it's cut at the checkpoint.
+    return kept,rows,last
+
+def recover(logname):
+    """finish a log that was never closed, from its checkpoints: cut it after its last good row, and stamp its end time.
+    returns (rows,time of the last row in ns or 0,size), or None if there's nothing to do: it was closed, or it's still
+    being written."""
+    name = checkpointname(logname)
+    try:
+        fd = os.open(name,os.O_RDWR)
+    except FileNotFoundError:
+        return None
+    try:
+        try:
+            fcntl.flock(fd,fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        data = os.pread(fd,checkpointpreamble.size,0)
+        if len(data) < checkpointpreamble.size or data[:8] != checkpointmagic:
+            raise ValueError('{} is not a ti2c checkpoint file.'.format(name))
+        _,kind,_,endstamp = checkpointpreamble.unpack(data)
+        kind = checkpointkinds[kind]
+        rows = last = offset = None
+        n = (os.fstat(fd).st_size - checkpointpreamble.size) // checkpointrecord.size
+        for i in range(n - 1,-1,-1):        # the latest intact checkpoint; the very last may be torn.
+            data = os.pread(fd,checkpointrecord.size,checkpointpreamble.size + i * checkpointrecord.size)
+            r,t,o,crc,_ = checkpointrecord.unpack(data)
+            if zlib.crc32(data[:24]) == crc:
+                rows,last,offset = r,t,o
+                break
+        with open(logname,'r+b') as f:
+            end = f.seek(0,os.SEEK_END)
+            if offset is None:              # it never got as far as a sync; check it all, from the first row.
+                rows,last = 0,0
+                if kind in ('jtlog','jtlogc'):
+                    f.seek(0)
+                    offset = csvheader(f)['data']
+                elif kind == 'binary':
+                    f.seek(0)
+                    offset = preamble.size + preamble.unpack(f.read(preamble.size))[1]
+                else:
+                    offset = end
+            offset = min(offset,end)
+            f.seek(offset)
+            kept,more,last = checktail(kind,f.read(),last,f)
+            rows += more
+            f.truncate(offset + kept)
+            if endstamp >= 0 and last:
+                f.seek(endstamp)
+                if kind == 'jtlogc' and f.read(10) == b'dnE time: ':
+                    f.seek(endstamp)
+                    f.write(('End time: ' + time.asctime(time.localtime(last / 1e9))).encode('utf-8'))
+                elif kind == 'binary':
+                    f.seek(endstamp)
+                    f.write(struct.pack('<q',last))
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(name)
+        return rows,last,offset + kept
+    finally:
+        os.close(fd)
+
+def recoverall(pattern,report=None):
+    """recover() every unfinished log whose name matches pattern (a glob, without the checkpoint suffix); report, if given,
+    is called with a message for each. returns the names of the logs recovered."""
+    recovered = []
+    for name in sorted(glob.glob(pattern + checkpointsuffix)):
+        logname = name[:-len(checkpointsuffix)]
+        try:
+            result = recover(logname)
+        except (OSError,ValueError) as error:
+            if report:
+                report('error: cannot recover {}: {}'.format(logname,error))
+            continue
+        if result is not None:
+            recovered.append(logname)
+            if report:
+                report('recovered {}: {} rows.'.format(logname,result[0]))
+    return recovered
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+# ti2cmetrics.py - live health metrics for logging sensors from J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+#
+# ti2cmetrics.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Now that that's out of the way...
+# A rig that's going downhill (a sensor that's started to NACK, a card that's slowing down, a bus
+# that's getting busier) usually shows it before any data is lost: queues fill, reads take longer,
+# triggers run late. Metrics make that visible while it's happening, so it can be alerted on. They
+# are exported in the Prometheus text format:
+#
+#   # HELP jtlogc_samples_total samples logged, by sensor.
+#   # TYPE jtlogc_samples_total counter
+#   jtlogc_samples_total{sensor="0x68"} 1234
+#
+# A registry holds the metrics: counters, gauges & histograms. Most of them are read when they're
+# exported, from whatever keeps the numbers already (queues, bus schedulers, trigger timing), by
+# calling a collect function; so the sampling threads do no more work for them than they did. The
+# rest are set or counted as things happen. Times are in seconds, as Prometheus likes.
+# A counter can have a rate, too: <name, less _total>_per_second, over the last export interval, for
+# whatever reads the metrics that can't work it out for itself.
+#
+# An exporter exports a registry every interval seconds, either way or both:
+#   file    - written whole to a temporary file, then renamed over the last, so a reader never sees
+#             half of one; for node_exporter's textfile collector, say. It's rewritten every interval,
+#             so it's best somewhere in RAM (/run, /dev/shm), not on the card.
+#   socket  - a Unix socket; every connection is sent the metrics as they stand, then closed:
+#               socat - UNIX-CONNECT:$HOME/.jtlogc/metrics.sock
+# __doc__
+"""ti2cmetrics python module; defines classes metric, histogram, registry & exporter."""
+
+import os
+import math
+import time
+import select
+import socket
+import stat
+import threading
+
+defaultinterval = 5.0           # seconds between exports; rates are over this long.
+
+def number(value):
+    """a sample value as the text format has it."""
+    if isinstance(value,int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+def labeltext(names,values):
+    """{name="value",...}; nothing if there are no labels."""
+    if not names:
+        return ''
+    escaped = [str(v).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n') for v in values]
+    return '{' + ','.join(['{}="{}"'.format(n,v) for n,v in zip(names,escaped)]) + '}'
+
+class metric(object):
+    """a counter or gauge: a value per set of label values, either set as it goes, or got from collect() when exported."""
+    kinds = ('counter','gauge')
+
+    def __init__(self,name,help,kind='gauge',labels=(),collect=None):
+        if kind not in self.kinds:
+            raise ValueError('metric kind must be one of {}, not {}.'.format(', '.join(self.kinds),kind))
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.collect = collect          # returns [(label values,value)]; None for a metric that's set.
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self,n=1,labelvalues=()):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues,0) + n
+
+    def set(self,value,labelvalues=()):
+        with self.lock:
+            self.values[labelvalues] = value
+
+    def samples(self):
+        """[(label values,value)], as they stand."""
+        if self.collect:
+            return list(self.collect())
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self):
+        return ['{}{} {}'.format(self.name,labeltext(self.labels,labelvalues),number(value)) for labelvalues,value in self.samples()]
+
+class histogram(metric):
+    """a histogram: counts in buckets, by upper bound, with the sum of everything counted; or got from collect()
+    as [(label values,(counts,sum))], counts being per bucket, not cumulative, and one more for anything over the last."""
+    kinds = ('histogram',)
+
+    def __init__(self,name,help,buckets,labels=(),collect=None):
+        super().__init__(name,help,'histogram',labels,collect)
+        self.buckets = tuple(buckets)
+
+    def observe(self,value,labelvalues=()):
+        with self.lock:
+            counts,total = self.values.get(labelvalues,([0] * (len(self.buckets) + 1),0.0))
+            counts[next((i for i,b in enumerate(self.buckets) if value <= b),len(self.buckets))] += 1
+            self.values[labelvalues] = (counts,total + value)
+
+    def render(self):
+        lines = []
+        for labelvalues,(counts,total) in self.samples():
+            n = 0
+            for bound,count in zip(self.buckets + (float('inf'),),counts):
+                n += count
+                lines.append('{}_bucket{} {}'.format(self.name,labeltext(self.labels + ('le',),labelvalues + (number(float(bound)),)),n))
+            lines.append('{}_sum{} {}'.format(self.name,labeltext(self.labels,labelvalues),number(float(total))))
+            lines.append('{}_count{} {}'.format(self.name,labeltext(self.labels,labelvalues),n))
+        return lines
+
+class registry(object):
+    def __init__(self):
+        """registry __init__; an empty registry. Metrics are rendered in the order they're added."""
+        self.metrics = []
+        self.rates = {}                 # counter name: [the counter, {label values: (value,when)}, {label values: rate}].
+        self.lock = threading.Lock()
+
+    def add(self,m,rate=False):
+        """add metric m, and for a counter, its rate if rate is True; returns m."""
+        self.metrics.append(m)
+        if rate and m.kind == 'counter':
+            state = self.rates[m.name] = [m,{},{}]
+            name = m.name[:-len('_total')] if m.name.endswith('_total') else m.name
+            self.metrics.append(metric(name + '_per_second','{} (per second, over the last export interval)'.format(m.help.rstrip('.')),
+                                       'gauge',m.labels,lambda : list(state[2].items())))
+        return m
+
+    def counter(self,name,help,labels=(),collect=None,rate=False):
+        return self.add(metric(name,help,'counter',labels,collect),rate)
+
+    def gauge(self,name,help,labels=(),collect=None):
+        return self.add(metric(name,help,'gauge',labels,collect))
+
+    def histogram(self,name,help,buckets,labels=(),collect=None):
+        return self.add(histogram(name,help,buckets,labels,collect))
+
+    def tick(self,now=None):
+        """work out the counters' rates since the last tick(); the exporter calls it every interval."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for state in self.rates.values():
+                m,last,rates = state
+                rates = dict(rates)     # swapped in whole, so render() never sees it half done.
+                for labelvalues,value in m.samples():
+                    before,when = last.get(labelvalues,(None,None))
+                    if before is not None and now > when:
+                        rates[labelvalues] = max(value - before,0) / (now - when)    # a counter that's reset doesn't go negative.
+                    last[labelvalues] = (value,now)
+                state[2] = rates
+
+    def render(self):
+        """every metric, in the text format."""
+        lines = []
+        for m in self.metrics:
+            lines.append('# HELP {} {}'.format(m.name,m.help.replace('\\','\\\\').replace('\n','\\n')))
+            lines.append('# TYPE {} {}'.format(m.name,m.kind))
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+class exporter(object):
+    backlog = 4                 # connections waiting on the socket.
+    sendtimeout = 1.0           # seconds a client that won't read can hold up the exports.
+
+    def __init__(self,registry,interval=defaultinterval,filename=None,socketname=None,report=print):
+        """exporter __init__; exports registry every interval seconds to filename and/or on a Unix socket at socketname,
+        on a thread of its own; report is called with a message if either can't be done."""
+        self.registry = registry
+        self.interval = interval
+        self.filename = filename
+        self.socketname = socketname
+        self.report = report
+        self.server = None
+        if socketname:
+            try:
+                self.server = self.__listen(socketname)
+            except OSError as error:
+                self.report('metrics: can\'t listen on {}: {}.'.format(socketname,error.strerror or error))
+        self.failed = False             # the file couldn't be written last time; said once, not every interval.
+        self.wake,self.waker = os.pipe()    # written to by close(), to stop the thread.
+        self.thread = threading.Thread(target=self.__run,name='t-metrics',daemon=True)
+        self.thread.start()
+
+    def __listen(self,name):
+        try:
+            if stat.S_ISSOCK(os.stat(name).st_mode):
+                probe = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+                try:
+                    probe.connect(name)
+                except OSError:         # nothing's there; a crash left it behind.
+                    os.remove(name)
+                else:
+                    raise OSError('another logger is using it')
+                finally:
+                    probe.close()
+        except FileNotFoundError:
+            pass
+        server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        try:
+            server.bind(name)
+            server.listen(self.backlog)
+        except OSError:
+            server.close()
+            raise
+        server.setblocking(False)
+        return server
+
+    def __run(self):
+        due = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= due:
+                self.export()
+                due = max(due + self.interval,now)     # a late export doesn't bring on a burst of them.
+            ready,_,_ = select.select([self.wake] + ([self.server] if self.server else []),[],[],max(due - time.monotonic(),0))
+            if self.wake in ready:
+                break
+            if self.server in ready:
+                self.__serve()
+
+    def __serve(self):
+        try:
+            connection,_ = self.server.accept()
+        except OSError:                 # gone again, before it was accepted.
+            return
+        with connection:
+            connection.settimeout(self.sendtimeout)
+            try:
+                connection.sendall(self.registry.render().encode('utf-8'))
+            except OSError:
+                pass                    # the client's problem.
+
+    def export(self):
+        """work out the rates, and write the file, if there is one."""
+        self.registry.tick()
+        if not self.filename:
+            return
+        part = self.filename + '.part'
+        try:
+            with open(part,'w') as f:
+                f.write(self.registry.render())
+            os.replace(part,self.filename)
+            self.failed = False
+        except OSError as error:
+            if not self.failed:
+                self.report('metrics: can\'t write {}: {}.'.format(self.filename,error.strerror or error))
+            self.failed = True
+
+    def close(self):
+        """stop exporting, once the file's been written a last time; the socket is removed, the file is left as it is."""
+        os.write(self.waker,b'q')
+        self.thread.join()
+        os.close(self.wake)
+        os.close(self.waker)
+        if self.server:
+            self.server.close()
+            try:
+                os.remove(self.socketname)
+            except OSError:
+                pass
+        self.export()
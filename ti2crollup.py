@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# ti2crollup.py - running summaries of samples from sensors from J-Tech Engineering, Ltd.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+#
+# ti2crollup.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Now that that's out of the way...
+# A plot of a month doesn't need every sample, just a summary of each minute, or hour; working
+# those out from the log means reading all of it, every time. Instead, the logger keeps them as
+# it goes: a rollup is a set of tiers, 1 s, 1 min & 1 h by default, each a csv file of its own
+# with a row per sensor per bucket, written when the bucket closes:
+#
+#   time,sensor,count,mean,min,max,stddev
+#   2020/01/01 00:01:00,0x68,16,20.212,20.198,20.231,0.009
+#
+# time is the start of the bucket, local time; buckets are counted from the epoch, so 60 s
+# buckets start on the minute. The summaries are of the temperatures, in each sensor's units;
+# stddev is the population standard deviation. A day of 1 h buckets is a few kB, whatever
+# the sample rate.
+#
+# Only the finest tier sees every sample; each tier's closed buckets are merged into the
+# next tier's (count, mean & sum of squared deviations combine exactly), so the coarser
+# tiers cost next to nothing. That's why every tier must be a whole multiple of the one
+# before it. A bucket closes when its sensor's first sample from a later bucket arrives, or
+# when the rollup is closed.
+# __doc__
+"""ti2crollup python module; defines class rollup, which keeps per sensor summaries of samples in tiers of time buckets."""
+
+import math
+import time
+
+import ti2clog
+
+defaulttiers = (1,60,3600)      # seconds.
+
+def tiername(seconds):
+    """a tier's width as it appears in its file name: 1s, 1m, 1h, 90s..."""
+    for unit,width in (('h',3600),('m',60)):
+        if seconds >= width and seconds % width == 0:
+            return '{}{}'.format(seconds // width,unit)
+    return '{:g}s'.format(seconds)
+
+def validate(tiers):
+    """raise ValueError if tiers can't be rolled up one into the next."""
+    for i,width in enumerate(tiers):
+        if width <= 0 or width != int(width):
+            raise ValueError('rollup tiers must be whole numbers of seconds, more than 0.')
+        if i and width % tiers[i - 1]:
+            raise ValueError('each rollup tier must be a multiple of the one before it.')
+
+class rollup(object):
+    def __init__(self,prefix,labels,tiers=defaulttiers,policy=ti2clog.defaultflushpolicy):
+        """rollup __init__; one file per tier, named prefix.rollup-<tier>.csv; labels are the sensors' names in the log, by sensor #."""
+        validate(tiers)
+        self.labels = labels
+        self.tiers = tiers
+        self.widths = [int(w) * 1000000000 for w in tiers]   # ns.
+        self.files = []
+        for w in tiers:
+            f = ti2clog.logbuffer('{}.rollup-{}.csv'.format(prefix,tiername(w)),policy)
+            f.write('time,sensor,count,mean,min,max,stddev\n')
+            f.endrow()
+            self.files.append(f)
+        # the open bucket of each sensor in each tier: [start ns,count,mean,sum of squared deviations,min,max], or None.
+        self.buckets = [[None] * len(labels) for _ in tiers]
+
+    def add(self,sensor,t,value):
+        """one sample, value, from sensor # sensor, taken at time t (int ns since the epoch)."""
+        if value != value:          # NaN; a calibration curve can't reach it.
+            return
+        start = t - t % self.widths[0]
+        b = self.buckets[0][sensor]
+        if b is None or b[0] != start:
+            if b is not None:
+                self.__close(0,sensor,b)
+            self.buckets[0][sensor] = [start,1,value,0.0,value,value]
+            return
+        b[1] += 1                   # Welford's update.
+        delta = value - b[2]
+        b[2] += delta / b[1]
+        b[3] += delta * (value - b[2])
+        if value < b[4]:
+            b[4] = value
+        elif value > b[5]:
+            b[5] = value
+
+    def addblock(self,sensor,timestamps,values):
+        """a block of samples from sensor # sensor, in time order; timestamps as add()'s."""
+        for t,v in zip(timestamps,values):
+            self.add(sensor,t,v)
+
+    def __close(self,tier,sensor,b):
+        """write bucket b, and merge it into the next tier's."""
+        start,count,mean,m2,low,high = b
+        self.files[tier].write('{},{},{},{:.3f},{:.3f},{:.3f},{:.3f}\n'.format(time.strftime('%Y/%m/%d %H:%M:%S',time.localtime(start // 1000000000)),
+                                                                              self.labels[sensor],count,mean,low,high,math.sqrt(m2 / count)))
+        self.files[tier].endrow()
+        tier += 1
+        if tier == len(self.tiers):
+            return
+        upper = start - start % self.widths[tier]
+        a = self.buckets[tier][sensor]
+        if a is not None and a[0] != upper:
+            self.__close(tier,sensor,a)
+            a = None
+        if a is None:
+            self.buckets[tier][sensor] = [upper,count,mean,m2,low,high]
+            return
+        n = a[1] + count            # Chan et al.'s combination of two sets' mean & squared deviations.
+        delta = mean - a[2]
+        a[3] += m2 + delta * delta * a[1] * count / n
+        a[2] += delta * count / n
+        a[1] = n
+        a[4] = min(a[4],low)
+        a[5] = max(a[5],high)
+
+    def close(self):
+        """close every open bucket, finest first, so each is merged before its tier is closed, and close the files."""
+        for tier in range(len(self.tiers)):
+            for sensor,b in enumerate(self.buckets[tier]):
+                if b is not None:
+                    self.buckets[tier][sensor] = None
+                    self.__close(tier,sensor,b)
+        for f in self.files:
+            f.close()
@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+# ti2csim.py - a simulated I2C bus populated with MCP3421-based TI2C
+#              sensors, for running jtlog & jtlogc without hardware.
+# Copyright © 2020 - J-Tech Engineering, Ltd.
+#
+# ti2csim.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Now that that's out of the way...
+# The simulated bus stands in for smbus.SMBus; select it with TI2C_BUS=sim
+# (see ti2c.py), or create one directly and hand it to ti2c.buses[busnum].
+#
+# What's modelled, per device (datasheet ds22003e):
+#   - the configuration register: /RDY, /O/C (continuous/one-shot), and
+#     sample rate bits; power-on default is 0x90 (continuous, 12 bits).
+#   - conversion time for each mode: 1/240, 1/60, 1/15, 1/3.75 seconds.
+#   - the /RDY bit in the byte following the conversion result; in
+#     continuous mode it's set again once a result has been read, in
+#     one-shot mode it stays clear until the next conversion is started.
+#   - output coding: 18-bit results in three bytes, the rest in two, all
+#     two's complement with the sign bit repeated in the unused msbs.
+#   - general call reset (0x06) and conversion (0x08) at address 0.
+#
+# What's modelled, per bus:
+#   - transfer time at the bus bit rate (9 bits/byte, plus the address).
+#   - gaussian noise on the measured temperature.
+#   - NACKs, which smbus reports as OSError(EREMOTEIO): absent addresses
+#     always NACK; present devices NACK at random at nackrate, or on
+#     demand via fault().
+#   - optionally, a TCA9548A mux at ti2c.muxaddress with devices behind its
+#     channels: the control byte enables channels (it takes effect at the
+#     STOP, so not until the end of a combined transaction), devices on
+#     enabled channels are on the bus, and devices sharing an address on
+#     two enabled channels both answer; the data is wire-ANDed.
+#
+# Defaults can be changed without touching code through the environment:
+#   TI2C_SIM_ADDRESSES  comma separated device addresses; default 0x68-0x6f.
+#   TI2C_SIM_NOISE      standard deviation of temperature noise in °C; default 0.01.
+#   TI2C_SIM_NACKRATE   probability of any transaction being NACKed; default 0.
+#   TI2C_SIM_BITRATE    bus clock in Hz; 0 makes transfers instantaneous; default 100000.
+#   TI2C_SIM_MUX        device addresses behind each mux channel: comma separated lists,
+#                       channel 0 first, separated by semicolons, e.g. '0x68,0x69;0x68';
+#                       default none, and no mux. Addresses on the bus itself are still
+#                       given by TI2C_SIM_ADDRESSES; set it empty for a mux-only bus.
+# __doc__
+"""ti2csim python module; defines classes mcp3421sim and simbus."""
+
+import os,errno
+import time
+import math
+import random
+import threading
+
+from ti2c import tempsensor
+from ti2c import muxaddress,muxchannels
+
+def nack():
+    """the exception smbus raises when a device doesn't acknowledge its address."""
+    return OSError(errno.EREMOTEIO,os.strerror(errno.EREMOTEIO))
+
+class mcp3421sim(object):
+    # conversion time by mode, from the sample rates in tempsensor.mcp3421.
+    period = [1 / m[1] for m in tempsensor.mcp3421]
+    resolution = [m[0] for m in tempsensor.mcp3421]
+    por_cfg = 0x90                  # power-on/reset configuration: /RDY set, continuous, 12 bits, gain 1.
+
+    def __init__(self,address,temperature=None,clock=time.monotonic):
+        """mcp3421sim __init__; temperature is a function of time (seconds) returning °C; see defaulttemperature()."""
+        self.address = address
+        self.temperature = temperature if temperature is not None else self.defaulttemperature
+        self.clock = clock
+        self.noise = 0.0            # standard deviation in °C; set by the bus.
+        self.rng = random
+        self.reset()
+
+    def defaulttemperature(self,t):
+        """something to look at: a few degrees above 20°C, depending on address, drifting slowly."""
+        return 20.0 + (self.address & 0x07) * 0.5 + 0.25 * math.sin(2 * math.pi * t / 600)
+
+    def reset(self):
+        """power-on reset state."""
+        self.cfg = self.por_cfg & 0x7f
+        self.code = 0
+        self.ready = False          # True when the output register holds an unread (continuous) or new (one-shot) result.
+        self.converting = False     # one-shot conversion in progress.
+        self.convstart = self.clock()
+        self.convcount = 0          # continuous mode: conversions completed since convstart.
+
+    def mode(self):
+        return (self.cfg >> 2) & 0x03
+
+    def continuous(self):
+        return self.cfg & 0x10 != 0
+
+    def sample(self,t):
+        """the code the converter would produce for the temperature at time t, in the current mode."""
+        slope,intercept = tempsensor.slope_intercept[self.mode()]
+        temp = self.temperature(t)
+        if self.noise:
+            temp += self.rng.gauss(0.0,self.noise)
+        code = int(round((temp - intercept) / slope))
+        limit = 1 << (self.resolution[self.mode()] - 1)
+        return max(-limit,min(limit - 1,code))      # the converter saturates at full scale.
+
+    def update(self,now):
+        """bring conversions up to date with the clock."""
+        period = self.period[self.mode()]
+        if self.continuous():
+            n = int((now - self.convstart) / period)
+            if n > self.convcount:
+                self.convcount = n
+                self.code = self.sample(self.convstart + n * period)
+                self.ready = True
+        elif self.converting and now >= self.convstart + period:
+            self.converting = False
+            self.code = self.sample(self.convstart + period)
+            self.ready = True
+
+    def write(self,value):
+        """write to the configuration register."""
+        now = self.clock()
+        self.update(now)
+        modechange = (value ^ self.cfg) & 0x1c
+        self.cfg = value & 0x7f
+        if self.continuous():
+            if modechange:          # conversions restart on a change of mode or rate.
+                self.convstart = now
+                self.convcount = 0
+                self.converting = False
+        elif value & 0x80:          # writing /RDY in one-shot mode starts a conversion.
+            self.start(now)
+
+    def start(self,now):
+        self.convstart = now
+        self.converting = True
+        self.ready = False
+
+    def generalcall(self,command):
+        """general call: 0x06 resets the device; 0x08 starts a one-shot conversion."""
+        if command == 0x06:
+            self.reset()
+        elif command == 0x08:
+            now = self.clock()
+            self.update(now)
+            self.cfg &= ~0x10 & 0x7f
+            self.start(now)
+
+    def read(self,length):
+        """read length bytes: the conversion result, then the configuration byte (repeated if more are read)."""
+        self.update(self.clock())
+        if self.resolution[self.mode()] == 18:
+            data = [(self.code >> 16) & 0xff,(self.code >> 8) & 0xff,self.code & 0xff]
+        else:
+            data = [(self.code >> 8) & 0xff,self.code & 0xff]
+        status = self.cfg | (0x00 if self.ready else 0x80)
+        while len(data) < length:
+            data.append(status)
+        if self.continuous():
+            self.ready = False      # the result has been read; wait for the next one.
+        return data[:length]
+
+class simbus(object):
+    """simbus: a simulated I2C bus full of mcp3421 devices; a drop-in replacement for smbus.SMBus."""
+    gen_call_address = 0
+
+    def __init__(self,busnum=1,addresses=None,noise=None,nackrate=None,bitrate=None,seed=None,clock=time.monotonic,channels=None):
+        """simbus __init__; addresses are the devices on the bus, channels a list of address lists, one per mux channel (None for no mux)."""
+        self.busnum = busnum
+        self.clock = clock
+        if addresses is None:
+            addresses = [int(a,0) for a in os.environ.get('TI2C_SIM_ADDRESSES',
+                                                          ','.join(hex(a) for a in tempsensor.i2caddress)).split(',') if a.strip()]
+        if channels is None and os.environ.get('TI2C_SIM_MUX'):
+            channels = [[int(a,0) for a in c.split(',') if a.strip()] for c in os.environ['TI2C_SIM_MUX'].split(';')]
+        self.noise = float(os.environ.get('TI2C_SIM_NOISE',0.01)) if noise is None else noise
+        self.nackrate = float(os.environ.get('TI2C_SIM_NACKRATE',0.0)) if nackrate is None else nackrate
+        self.bitrate = float(os.environ.get('TI2C_SIM_BITRATE',100000)) if bitrate is None else bitrate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()        # it's a bus: one transaction at a time.
+        self.faults = {}                    # address: # of transactions still to be NACKed.
+        self.transactions = 0               # bus transactions completed (or NACKed); useful for profiling.
+        self.nacks = 0
+        self.devices = {}
+        for address in addresses:
+            self.attach(mcp3421sim(address,clock=clock))
+        self.mux = channels is not None     # is there a mux on the bus?
+        self.muxmask = 0                    # channels the mux has enabled; none, on power up.
+        self.channels = [{} for _ in range(muxchannels)]
+        for channel,chaddresses in enumerate(channels or []):
+            for address in chaddresses:
+                self.attach(mcp3421sim(address,clock=clock),channel)
+
+    def attach(self,device,channel=None):
+        """add a simulated device to the bus, or behind mux channel; replaces anything already at its address there."""
+        device.noise = self.noise
+        device.rng = self.rng
+        if channel is None:
+            self.devices[device.address] = device
+        else:
+            self.mux = True
+            self.channels[channel][device.address] = device
+
+    def detach(self,address,channel=None):
+        """unplug the device at address (behind mux channel); it will NACK from now on."""
+        if channel is None:
+            self.devices.pop(address,None)
+        else:
+            self.channels[channel].pop(address,None)
+
+    def __visible(self,address=None):
+        """the devices that answer to address (all of them, for None): on the bus, or on an enabled channel."""
+        devices = [d for d in self.devices.values() if address is None or d.address == address]
+        for channel,chdevices in enumerate(self.channels):
+            if self.muxmask & (1 << channel):
+                devices += [d for d in chdevices.values() if address is None or d.address == address]
+        return devices
+
+    def __ismux(self,address):
+        return self.mux and address == muxaddress
+
+    def __read(self,address,length):
+        """read length bytes from whatever answers at address; several devices answering are wire-ANDed."""
+        if self.__ismux(address):
+            return [self.muxmask] * length
+        data = [0xff] * length
+        for device in self.__visible(address):
+            data = [a & b for a,b in zip(data,device.read(length))]
+        return data
+
+    def __write(self,address,value):
+        """write a byte to whatever answers at address; returns the new mux control byte, if address is the mux."""
+        if self.__ismux(address):
+            return value
+        for device in self.__visible(address):
+            device.write(value)
+        return None
+
+    def fault(self,address,count=1):
+        """make the next count transactions with the device at address fail with EREMOTEIO."""
+        with self.lock:
+            self.faults[address] = self.faults.get(address,0) + count
+
+    def __transfer(self,address,nbytes):
+        """account for one transaction; raise the smbus NACK error if nobody answers."""
+        self.transactions += 1
+        if self.bitrate > 0:
+            time.sleep((nbytes + 1) * 9 / self.bitrate)     # address byte + data bytes, 9 clocks each.
+        if self.faults.get(address,0) > 0:
+            self.faults[address] -= 1
+            self.nacks += 1
+            raise nack()
+        if address != self.gen_call_address and not self.__ismux(address) and not self.__visible(address):
+            self.nacks += 1
+            raise nack()
+        if self.nackrate > 0 and self.rng.random() < self.nackrate:
+            self.nacks += 1
+            raise nack()
+
+    def write_byte(self,address,value):
+        """write a single byte; address 0 is the general call address."""
+        with self.lock:
+            self.__transfer(address,1)
+            if address == self.gen_call_address:
+                devices = self.__visible()
+                if not devices:
+                    self.nacks += 1
+                    raise nack()
+                for device in devices:
+                    device.generalcall(value)
+            else:
+                mask = self.__write(address,value)
+                if mask is not None:
+                    self.muxmask = mask
+
+    def read_i2c_block_data(self,address,cmd,length):
+        """smbus block read: cmd is written to the device (the mcp3421 takes it as a config write), then length bytes are read."""
+        with self.lock:
+            self.__transfer(address,length + 2)             # the command byte, plus a repeated start & address.
+            mask = self.__write(address,cmd)
+            data = self.__read(address,length)
+            if mask is not None:
+                self.muxmask = mask
+            return data
+
+    def transfer(self,msgs):
+        """combined transaction, as ti2c.smbusbackend.transfer(): (address,length) reads, (address,bytes) writes."""
+        data = bytearray()
+        with self.lock:
+            self.transactions += 1
+            nbytes = 0
+            for address,payload in msgs:
+                nbytes += 1 + (payload if isinstance(payload,int) else len(payload))
+            if self.bitrate > 0:
+                time.sleep(nbytes * 9 / self.bitrate)
+            # the adapter stops at the first message that isn't acknowledged, and the ioctl fails;
+            # a mux only switches channels at the STOP, after the last message.
+            newmask = None
+            try:
+                for address,payload in msgs:
+                    if self.faults.get(address,0) > 0:
+                        self.faults[address] -= 1
+                        self.nacks += 1
+                        raise nack()
+                    if address == self.gen_call_address and not isinstance(payload,int) and self.__visible():
+                        for value in payload:
+                            for device in self.__visible():
+                                device.generalcall(value)
+                        continue
+                    if not (self.__ismux(address) or self.__visible(address)) or \
+                       (self.nackrate > 0 and self.rng.random() < self.nackrate):
+                        self.nacks += 1
+                        raise nack()
+                    if isinstance(payload,int):
+                        data += bytes(self.__read(address,payload))
+                    else:
+                        for value in payload:
+                            mask = self.__write(address,value)
+                            if mask is not None:
+                                newmask = mask
+            finally:
+                if newmask is not None:
+                    self.muxmask = newmask
+        return bytes(data)
+
+    def close(self):
+        pass